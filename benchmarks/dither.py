@@ -0,0 +1,70 @@
+# Throughput of the dithered conversions next to the plain ones.
+#
+#     python benchmarks/dither.py [--size 1920x1080] [--repeat 10] [--threads 1]
+import argparse
+import time
+from collections.abc import Callable
+
+import cairo
+from PIL import Image
+
+from pil_cairo import Dither, set_threads, to_cairo_rgb16, to_pil
+
+
+def measure(func: Callable[[], object], repeat: int) -> float:
+    func()
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", default="1920x1080")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+    w, h = map(int, args.size.split("x"))
+    set_threads(args.threads)
+
+    im = Image.linear_gradient("L").resize((w, h)).convert("RGB")
+    cases: list[tuple[str, Callable[[Dither | None], object]]] = [
+        ("RGB -> RGB16_565", lambda dither: to_cairo_rgb16(im, dither=dither)),
+    ]
+    for name, surface_format in [
+        ("RGB30", cairo.Format.RGB30),
+        ("RGB96F", cairo.Format.RGB96F),
+        ("RGBA128F", cairo.Format.RGBA128F),
+    ]:
+        surface = cairo.ImageSurface(surface_format, w, h)
+        cr = cairo.Context(surface)
+        gradient = cairo.LinearGradient(0, 0, w, h)
+        gradient.add_color_stop_rgba(0, 1, 0, 0, 0.5)
+        gradient.add_color_stop_rgba(1, 0, 0, 1, 1)
+        cr.set_source(gradient)
+        cr.paint()
+        cases.append(
+            (
+                f"{name} -> PIL",
+                lambda dither, surface=surface: to_pil(surface, dither=dither),
+            )
+        )
+
+    dithers: list[Dither | None] = [None, "ordered", "floyd-steinberg"]
+    print(f"{w}x{h}, {args.threads} thread(s), best of {args.repeat}, MPix/s")
+    print(f"{'':<20}{'none':>10}{'ordered':>10}{'floyd-st.':>10}{'none/ordered':>14}")
+    for name, case in cases:
+        times = [
+            measure(lambda case=case, dither=dither: case(dither), args.repeat)
+            for dither in dithers
+        ]
+        rates = [w * h / t / 1e6 for t in times]
+        cells = "".join(f"{rate:>10.1f}" for rate in rates)
+        print(f"{name:<20}{cells}{rates[0] / rates[1]:>13.2f}x")
+
+
+if __name__ == "__main__":
+    main()
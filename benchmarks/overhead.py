@@ -0,0 +1,63 @@
+# Per call overhead of `to_cairo` on icon sized images, where the glue around the
+# kernels costs more than the pixels. "python" is the path taken before `_core.convert`
+# existed: checks and dispatch in Python, a bytearray, `_write_cairo` and
+# `create_for_data`.
+#
+#     python benchmarks/overhead.py [--sizes 1,16,32,64] [--number 20000] [--repeat 5]
+import argparse
+import timeit
+from collections.abc import Callable
+from functools import partial
+
+import cairo
+from PIL import Image
+
+from pil_cairo import to_cairo
+from pil_cairo._core import convert
+from pil_cairo._pixels import _CONVERT, _check_mode, _write_cairo
+
+MODES = [
+    ("L", cairo.Format.A8),
+    ("RGB", cairo.Format.RGB24),
+    ("RGBA", cairo.Format.ARGB32),
+]
+
+
+def python_path(im: Image.Image, surface_format: cairo.Format) -> cairo.ImageSurface:
+    _check_mode(im, surface_format)
+    w, h = im.size
+    stride = surface_format.stride_for_width(w)
+    data = bytearray(stride * h)
+    _write_cairo(im, data, surface_format, stride, "pillow")
+    return cairo.ImageSurface.create_for_data(data, surface_format, w, h, stride)
+
+
+def measure(func: Callable[[], object], number: int, repeat: int) -> float:
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1,16,32,64")
+    parser.add_argument("--number", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"best of {args.repeat} x {args.number} calls, microseconds per call")
+    print(f"{'':<14}{'python':>10}{'to_cairo':>10}{'convert':>10}{'speedup':>10}")
+    for size in map(int, args.sizes.split(",")):
+        for mode, surface_format in MODES:
+            im = Image.linear_gradient("L").resize((size, size)).convert(mode)
+            kernel, _ = _CONVERT[surface_format, mode]
+            cases: list[Callable[[], object]] = [
+                partial(python_path, im, surface_format),
+                partial(to_cairo, im),
+                partial(convert, im, surface_format, kernel),
+            ]
+            times = [measure(case, args.number, args.repeat) * 1e6 for case in cases]
+            cells = "".join(f"{t:>10.2f}" for t in times)
+            print(f"{f'{size}x{size} {mode}':<14}{cells}{times[0] / times[1]:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# Throughput of the row kernels that have an AVX2 copy, with and without it. The
+# baseline copy is what CPUs without AVX2 run.
+#
+#     python benchmarks/simd.py [--size 1920x1080] [--repeat 10]
+import argparse
+import time
+from collections.abc import Callable
+from functools import partial
+
+import numpy as np
+from PIL import Image
+
+from pil_cairo import to_cairo, to_cairo_rgb96f, to_cairo_rgba128f, to_pil
+from pil_cairo._core import get_avx2, set_avx2
+
+
+def measure(func: Callable[[], object], repeat: int) -> float:
+    func()
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", default="1920x1080")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+    w, h = map(int, args.size.split("x"))
+    if not get_avx2():
+        print("AVX2 is not available, both columns run the baseline copy")
+
+    arr = np.random.default_rng(0).integers(0, 256, (h, w, 4), np.uint8)
+    rgba = Image.fromarray(arr, "RGBA")
+    rgb = rgba.convert("RGB")
+    argb32 = to_cairo(rgba)
+    rgba128f = to_cairo_rgba128f(rgba)
+    cases: list[tuple[str, Callable[[], object]]] = [
+        ("RGBA -> ARGB32 (truncate)", partial(to_cairo, rgba, rounding="truncate")),
+        ("RGBA -> ARGB32 (nearest)", partial(to_cairo, rgba, rounding="nearest")),
+        ("ARGB32 -> RGBA (truncate)", partial(to_pil, argb32, rounding="truncate")),
+        ("ARGB32 -> RGBA (nearest)", partial(to_pil, argb32, rounding="nearest")),
+        ("RGB -> RGB96F", partial(to_cairo_rgb96f, rgb)),
+        ("RGBA -> RGBA128F", partial(to_cairo_rgba128f, rgba)),
+        ("RGBA128F -> RGBA", partial(to_pil, rgba128f)),
+    ]
+
+    print(f"{w}x{h}, 1 thread, best of {args.repeat}, MPix/s")
+    print(f"{'':<28}{'baseline':>10}{'avx2':>10}{'speedup':>10}")
+    for name, case in cases:
+        times = []
+        for avx2 in [False, True]:
+            set_avx2(avx2)
+            times.append(measure(case, args.repeat))
+        rates = [w * h / t / 1e6 for t in times]
+        cells = "".join(f"{rate:>10.1f}" for rate in rates)
+        print(f"{name:<28}{cells}{rates[1] / rates[0]:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
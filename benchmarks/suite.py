@@ -0,0 +1,456 @@
+# Throughput and peak memory of every conversion, next to plain Pillow and NumPy.
+#
+#     python benchmarks/suite.py [--sizes small,hd,4k,huge] [--threads 1,0] [--repeat 5]
+#                                [--cases SUBSTRING] [--output results.json]
+#                                [--compare old.json]
+#
+# Each case runs in a fresh process, so its peak RSS is not inflated by the cases before
+# it. Cases whose name starts with "pillow" or "numpy" are baselines; the NumPy ones are
+# skipped when NumPy is not installed.
+import argparse
+import json
+import platform
+import sys
+import timeit
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any
+
+import cairo
+from PIL import Image
+
+import pil_cairo
+from pil_cairo import (
+    BufferPool,
+    set_threads,
+    to_cairo,
+    to_cairo_into,
+    to_cairo_rgb16,
+    to_cairo_rgb30,
+    to_cairo_rgb96f,
+    to_cairo_rgba128f,
+    to_pil,
+    to_pil_into,
+    to_pil_rgb30,
+    to_pil_rgb96f,
+    to_pil_rgba128f,
+)
+
+try:
+    import resource
+except ImportError:
+    resource = None  # type: ignore[assignment]
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # type: ignore[assignment]
+
+SIZES = {
+    "small": (64, 64),
+    "hd": (1920, 1080),
+    "4k": (3840, 2160),
+    "huge": (8192, 8192),
+}
+
+_Setup = Callable[[int, int], Callable[[], object]]
+
+
+def _image(mode: str, w: int, h: int) -> Image.Image:
+    x = Image.linear_gradient("L").resize((w, h))
+    y = x.transpose(Image.Transpose.ROTATE_90).resize((w, h))
+    rgba = Image.merge(
+        "RGBA", (x, y, x.point(lambda v: 255 - v), y.point(lambda v: 255 - v))
+    )
+    if mode == "P":
+        im = rgba.convert("RGB").quantize(256)
+        im.info["transparency"] = 0
+        return im
+    if mode == "I;16":
+        return x.convert("I").point(lambda v: v * 257).convert("I;16")
+    if mode in ("1", "L", "I", "F"):
+        return x.convert(mode)
+    if mode in ("RGBa", "La"):
+        return rgba.convert("RGBA" if mode == "RGBa" else "LA").convert(mode)
+    return rgba.convert(mode)
+
+
+def _surface(surface_format: cairo.Format, w: int, h: int) -> cairo.ImageSurface:
+    surface = cairo.ImageSurface(surface_format, w, h)
+    cr = cairo.Context(surface)
+    gradient = cairo.LinearGradient(0, 0, w, h)
+    gradient.add_color_stop_rgba(0, 1, 0, 0, 0.5)
+    gradient.add_color_stop_rgba(1, 0, 0, 1, 1)
+    cr.set_source(gradient)
+    cr.paint()
+    surface.flush()
+    return surface
+
+
+def _to_cairo(mode: str) -> _Setup:
+    def setup(w: int, h: int) -> Callable[[], object]:
+        im = _image(mode, w, h)
+        return lambda: to_cairo(im)
+
+    return setup
+
+
+def _to_cairo_format(convert: Callable[..., cairo.ImageSurface], mode: str) -> _Setup:
+    def setup(w: int, h: int) -> Callable[[], object]:
+        im = _image(mode, w, h)
+        return lambda: convert(im)
+
+    return setup
+
+
+def _to_cairo_planes(convert: Callable[..., cairo.ImageSurface], modes: str) -> _Setup:
+    def setup(w: int, h: int) -> Callable[[], object]:
+        planes = tuple(_image(mode, w, h) for mode in modes.split(","))
+        return lambda: convert(planes)
+
+    return setup
+
+
+def _to_cairo_pool(w: int, h: int) -> Callable[[], object]:
+    im = _image("RGBA", w, h)
+    pool = BufferPool()
+
+    def run() -> None:
+        pool.release(to_cairo(im, pool))
+
+    return run
+
+
+def _to_cairo_into(w: int, h: int) -> Callable[[], object]:
+    im = _image("RGBA", w, h)
+    surface = cairo.ImageSurface(cairo.Format.ARGB32, w, h)
+    return lambda: to_cairo_into(im, surface)
+
+
+def _to_pil(surface_format: cairo.Format, **kwargs: Any) -> _Setup:
+    def setup(w: int, h: int) -> Callable[[], object]:
+        surface = _surface(surface_format, w, h)
+        return lambda: to_pil(surface, **kwargs)
+
+    return setup
+
+
+def _to_pil_planes(
+    convert: Callable[..., object], surface_format: cairo.Format
+) -> _Setup:
+    def setup(w: int, h: int) -> Callable[[], object]:
+        surface = _surface(surface_format, w, h)
+        return lambda: convert(surface)
+
+    return setup
+
+
+def _to_pil_into(w: int, h: int) -> Callable[[], object]:
+    surface = _surface(cairo.Format.ARGB32, w, h)
+    im = Image.new("RGBA", (w, h))
+    return lambda: to_pil_into(surface, im)
+
+
+def _pillow_to_cairo(mode: str, surface_format: cairo.Format, rawmode: str) -> _Setup:
+    def setup(w: int, h: int) -> Callable[[], object]:
+        im = _image(mode, w, h)
+        stride = surface_format.stride_for_width(w)
+
+        def run() -> cairo.ImageSurface:
+            data = bytearray(im.tobytes("raw", rawmode, stride))
+            return cairo.ImageSurface.create_for_data(
+                data, surface_format, w, h, stride
+            )
+
+        return run
+
+    return setup
+
+
+def _pillow_to_pil(surface_format: cairo.Format, mode: str, rawmode: str) -> _Setup:
+    def setup(w: int, h: int) -> Callable[[], object]:
+        surface = _surface(surface_format, w, h)
+        stride = surface.get_stride()
+
+        def run() -> Image.Image:
+            data = surface.get_data()
+            return Image.frombuffer(
+                mode, (w, h), data, "raw", rawmode, stride, 1
+            ).copy()
+
+        return run
+
+    return setup
+
+
+def _numpy_rgba_to_argb32(w: int, h: int) -> Callable[[], object]:
+    arr = np.asarray(_image("RGBA", w, h))
+
+    def run() -> cairo.ImageSurface:
+        a = arr[..., 3:].astype(np.uint16)
+        out = np.empty((h, w, 4), np.uint8)
+        out[..., 2::-1] = (arr[..., :3] * a + 127) // 255
+        out[..., 3] = arr[..., 3]
+        return cairo.ImageSurface.create_for_data(
+            memoryview(out).cast("B"), cairo.Format.ARGB32, w, h, w * 4
+        )
+
+    return run
+
+
+def _numpy_argb32_to_rgba(w: int, h: int) -> Callable[[], object]:
+    surface = _surface(cairo.Format.ARGB32, w, h)
+    stride = surface.get_stride()
+
+    def run() -> Image.Image:
+        arr = np.ndarray(
+            (h, w, 4), np.uint8, surface.get_data(), strides=(stride, 4, 1)
+        )
+        a = arr[..., 3:].astype(np.uint16)
+        rgb = arr[..., 2::-1].astype(np.uint16)
+        out = np.empty((h, w, 4), np.uint8)
+        out[..., :3] = np.minimum((rgb * 255 + a // 2) // np.maximum(a, 1), 255)
+        out[..., 3] = arr[..., 3]
+        return Image.fromarray(out, "RGBA")
+
+    return run
+
+
+def _numpy_rgb_to_rgb96f(w: int, h: int) -> Callable[[], object]:
+    arr = np.asarray(_image("RGB", w, h))
+    stride = cairo.Format.RGB96F.stride_for_width(w)
+
+    def run() -> cairo.ImageSurface:
+        out = np.zeros((h, stride // 4), np.float32)
+        out[:, : w * 3] = arr.reshape(h, w * 3) / np.float32(255)
+        return cairo.ImageSurface.create_for_data(
+            memoryview(out).cast("B"), cairo.Format.RGB96F, w, h, stride
+        )
+
+    return run
+
+
+def _numpy_rgba128f_to_rgba(w: int, h: int) -> Callable[[], object]:
+    surface = _surface(cairo.Format.RGBA128F, w, h)
+    stride = surface.get_stride()
+
+    def run() -> Image.Image:
+        arr = np.ndarray(
+            (h, w, 4), np.float32, surface.get_data(), strides=(stride, 16, 4)
+        )
+        a = arr[..., 3:]
+        out = np.zeros((h, w, 4), np.float32)
+        np.divide(arr[..., :3], a, out=out[..., :3], where=a > 0)
+        out[..., 3:] = a
+        return Image.fromarray(
+            np.rint(np.clip(out, 0, 1) * 255).astype(np.uint8), "RGBA"
+        )
+
+    return run
+
+
+# name: (setup, baseline to compare against)
+CASES: dict[str, tuple[_Setup, str | None]] = {
+    "to_cairo 1 -> A1": (_to_cairo("1"), None),
+    "to_cairo L -> A8": (_to_cairo("L"), "pillow L -> A8"),
+    "to_cairo RGB -> RGB24": (_to_cairo("RGB"), "pillow RGB -> RGB24"),
+    "to_cairo RGBX -> RGB24": (_to_cairo("RGBX"), "pillow RGB -> RGB24"),
+    "to_cairo RGBA -> ARGB32": (_to_cairo("RGBA"), "pillow RGBA -> ARGB32"),
+    "to_cairo RGBa -> ARGB32": (_to_cairo("RGBa"), "pillow RGBA -> ARGB32"),
+    "to_cairo LA -> ARGB32": (_to_cairo("LA"), "pillow RGBA -> ARGB32"),
+    "to_cairo La -> ARGB32": (_to_cairo("La"), "pillow RGBA -> ARGB32"),
+    "to_cairo P -> ARGB32": (_to_cairo("P"), "pillow RGBA -> ARGB32"),
+    "to_cairo I;16 -> RGB30": (_to_cairo("I;16"), None),
+    "to_cairo RGBA -> ARGB32 (pool)": (_to_cairo_pool, "pillow RGBA -> ARGB32"),
+    "to_cairo_into RGBA -> ARGB32": (_to_cairo_into, "pillow RGBA -> ARGB32"),
+    "to_cairo_rgb16 RGB -> RGB16_565": (_to_cairo_format(to_cairo_rgb16, "RGB"), None),
+    "to_cairo_rgb30 RGB -> RGB30": (_to_cairo_format(to_cairo_rgb30, "RGB"), None),
+    "to_cairo_rgb30 I,I,I -> RGB30": (_to_cairo_planes(to_cairo_rgb30, "I,I,I"), None),
+    "to_cairo_rgb96f RGB -> RGB96F": (
+        _to_cairo_format(to_cairo_rgb96f, "RGB"),
+        "numpy RGB -> RGB96F",
+    ),
+    "to_cairo_rgb96f F,F,F -> RGB96F": (
+        _to_cairo_planes(to_cairo_rgb96f, "F,F,F"),
+        None,
+    ),
+    "to_cairo_rgba128f RGBA -> RGBA128F": (
+        _to_cairo_format(to_cairo_rgba128f, "RGBA"),
+        None,
+    ),
+    "to_cairo_rgba128f F,F,F,F -> RGBA128F": (
+        _to_cairo_planes(to_cairo_rgba128f, "F,F,F,F"),
+        None,
+    ),
+    "to_pil A1 -> 1": (_to_pil(cairo.Format.A1), None),
+    "to_pil A8 -> L": (_to_pil(cairo.Format.A8), "pillow A8 -> L"),
+    "to_pil A8 -> L (copy=False)": (
+        _to_pil(cairo.Format.A8, copy=False),
+        "pillow A8 -> L",
+    ),
+    "to_pil RGB24 -> RGB": (_to_pil(cairo.Format.RGB24), "pillow RGB24 -> RGB"),
+    "to_pil ARGB32 -> RGBA": (_to_pil(cairo.Format.ARGB32), "pillow ARGB32 -> RGBA"),
+    "to_pil_into ARGB32 -> RGBA": (_to_pil_into, "pillow ARGB32 -> RGBA"),
+    "to_pil RGB16_565 -> RGB": (
+        _to_pil(cairo.Format.RGB16_565),
+        "pillow RGB16_565 -> RGB",
+    ),
+    "to_pil RGB30 -> RGB": (_to_pil(cairo.Format.RGB30), None),
+    "to_pil RGB96F -> RGB": (_to_pil(cairo.Format.RGB96F), None),
+    "to_pil RGBA128F -> RGBA": (
+        _to_pil(cairo.Format.RGBA128F),
+        "numpy RGBA128F -> RGBA",
+    ),
+    "to_pil_rgb30 RGB30 -> I,I,I": (
+        _to_pil_planes(to_pil_rgb30, cairo.Format.RGB30),
+        None,
+    ),
+    "to_pil_rgb96f RGB96F -> F,F,F": (
+        _to_pil_planes(to_pil_rgb96f, cairo.Format.RGB96F),
+        None,
+    ),
+    "to_pil_rgba128f RGBA128F -> F,F,F,F": (
+        _to_pil_planes(to_pil_rgba128f, cairo.Format.RGBA128F),
+        None,
+    ),
+    "to_pil_rgba128f RGBA128F -> float32 (interleaved)": (
+        _to_pil_planes(
+            lambda s: to_pil_rgba128f(s, interleaved=True), cairo.Format.RGBA128F
+        ),
+        None,
+    ),
+    "pillow L -> A8": (_pillow_to_cairo("L", cairo.Format.A8, "L"), None),
+    "pillow RGB -> RGB24": (_pillow_to_cairo("RGB", cairo.Format.RGB24, "BGRX"), None),
+    "pillow RGBA -> ARGB32": (
+        _pillow_to_cairo("RGBA", cairo.Format.ARGB32, "BGRa"),
+        None,
+    ),
+    "pillow A8 -> L": (_pillow_to_pil(cairo.Format.A8, "L", "L"), None),
+    "pillow RGB24 -> RGB": (_pillow_to_pil(cairo.Format.RGB24, "RGB", "BGRX"), None),
+    "pillow ARGB32 -> RGBA": (
+        _pillow_to_pil(cairo.Format.ARGB32, "RGBA", "BGRa"),
+        None,
+    ),
+    "pillow RGB16_565 -> RGB": (
+        _pillow_to_pil(cairo.Format.RGB16_565, "RGB", "BGR;16"),
+        None,
+    ),
+    "numpy RGBA -> ARGB32": (_numpy_rgba_to_argb32, None),
+    "numpy ARGB32 -> RGBA": (_numpy_argb32_to_rgba, None),
+    "numpy RGB -> RGB96F": (_numpy_rgb_to_rgb96f, None),
+    "numpy RGBA128F -> RGBA": (_numpy_rgba128f_to_rgba, None),
+}
+
+
+def _peak_rss() -> int | None:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes everywhere but macOS.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_case(name: str, w: int, h: int, threads: int, repeat: int) -> dict[str, Any]:
+    set_threads(threads)
+    func = CASES[name][0](w, h)
+    setup_rss = _peak_rss()
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    seconds = min(timer.repeat(repeat, number)) / number
+    peak_rss = _peak_rss()
+    return {
+        "case": name,
+        "width": w,
+        "height": h,
+        "threads": pil_cairo.get_threads(),
+        "seconds": seconds,
+        "mpix_per_s": w * h / seconds / 1e6,
+        "peak_rss": peak_rss,
+        "setup_rss": setup_rss,
+    }
+
+
+def _metadata() -> dict[str, Any]:
+    return {
+        "python": sys.version,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "pillow": Image.__version__,
+        "pycairo": cairo.version,
+        "numpy": None if np is None else np.__version__,
+    }
+
+
+def _key(result: dict[str, Any]) -> tuple[str, int, int, int]:
+    return result["case"], result["width"], result["height"], result["threads"]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default=",".join(SIZES))
+    parser.add_argument("--threads", default="1,0", help="0 uses all cores")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--cases", default="", help="only run cases containing this")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument(
+        "--compare", help="JSON results of an earlier run to compare with"
+    )
+    args = parser.parse_args()
+
+    names = [
+        name
+        for name in CASES
+        if args.cases in name and (np is not None or not name.startswith("numpy"))
+    ]
+    sizes = [SIZES[size] for size in args.sizes.split(",")]
+    threads = [int(n) for n in args.threads.split(",")]
+    old = {}
+    if args.compare:
+        with open(args.compare) as f:
+            old = {_key(result): result for result in json.load(f)["results"]}
+
+    results: list[dict[str, Any]] = []
+    print(
+        f"{'':<52}{'size':>12}{'threads':>8}{'MPix/s':>10}{'peak MiB':>10}{'vs base':>9}"
+    )
+    for w, h in sizes:
+        for n in threads:
+            by_name: dict[str, dict[str, Any]] = {}
+            for name in names:
+                # A fresh process per case, so peak RSS belongs to that case alone.
+                with ProcessPoolExecutor(
+                    1, mp_context=get_context("spawn")
+                ) as executor:
+                    result = executor.submit(
+                        run_case, name, w, h, n, args.repeat
+                    ).result()
+                results.append(result)
+                by_name[name] = result
+            for name in names:
+                result = by_name[name]
+                baseline = by_name.get(CASES[name][1] or "")
+                ratio = ""
+                if baseline is not None:
+                    ratio = f"{baseline['seconds'] / result['seconds']:.2f}x"
+                peak = (
+                    ""
+                    if result["peak_rss"] is None
+                    else f"{result['peak_rss'] / 2**20:.0f}"
+                )
+                line = (
+                    f"{name:<52}{f'{w}x{h}':>12}{result['threads']:>8}"
+                    f"{result['mpix_per_s']:>10.1f}{peak:>10}{ratio:>9}"
+                )
+                previous = old.get(_key(result))
+                if previous is not None:
+                    line += f"  {previous['seconds'] / result['seconds']:.2f}x of old"
+                print(line)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"metadata": _metadata(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,26 +2,293 @@ use pyo3::prelude::*;
 
 #[pymodule]
 mod _core {
-    use pyo3::{prelude::*, types::PyByteArray};
+    use std::{
+        ops::Range,
+        sync::{
+            LazyLock,
+            atomic::{AtomicBool, AtomicUsize, Ordering},
+        },
+        thread,
+    };
+
+    use pyo3::{
+        exceptions::{PyTypeError, PyValueError},
+        prelude::*,
+        sync::PyOnceLock,
+        types::{PyByteArray, PyBytes, PyMemoryView},
+    };
+
+    // Every kernel below releases the GIL while it walks the pixels. Each `Buffer` holds an export
+    // of the object it reads or writes until the kernel returns, and objects with exports can't
+    // be resized: another thread trying to resize a `bytearray` meanwhile gets a BufferError.
+
+    // The bytes behind a `bytes`, a `bytearray` or any other contiguous buffer, such as the
+    // memoryview returned by `cairo.ImageSurface.get_data()`. The stable ABI we build against has
+    // no buffer protocol before Python 3.11, so a `bytearray` is locked by a memoryview of it and
+    // other objects are exported through ctypes, which keeps the export (and the memory behind
+    // it) alive for as long as the `Buffer` lives.
+    struct Buffer<'py> {
+        ptr: *mut u8,
+        len: usize,
+        _owner: Bound<'py, PyAny>,
+    }
+
+    impl<'py> Buffer<'py> {
+        fn new(obj: &Bound<'py, PyAny>) -> PyResult<Self> {
+            Self::export(obj, false)
+        }
+
+        fn new_mut(obj: &Bound<'py, PyAny>) -> PyResult<Self> {
+            Self::export(obj, true)
+        }
+
+        fn export(obj: &Bound<'py, PyAny>, writable: bool) -> PyResult<Self> {
+            if let Ok(bytes) = obj.cast::<PyBytes>() {
+                if writable {
+                    return Err(PyTypeError::new_err("Buffer is read-only"));
+                }
+                let data = bytes.as_bytes();
+                return Ok(Self {
+                    ptr: data.as_ptr() as *mut u8,
+                    len: data.len(),
+                    _owner: obj.clone(),
+                });
+            }
+            if let Ok(bytearray) = obj.cast::<PyByteArray>() {
+                let view = PyMemoryView::from(obj)?;
+                return Ok(Self {
+                    ptr: bytearray.data(),
+                    len: bytearray.len(),
+                    _owner: view.into_any(),
+                });
+            }
+            let py = obj.py();
+            let builtins = py.import("builtins")?;
+            let view = builtins.getattr("memoryview")?.call1((obj,))?;
+            // ctypes only exports writable buffers, a read-only one (e.g. `np.asarray` of a
+            // Pillow image) is copied into `bytes` instead.
+            if view.getattr("readonly")?.extract()? {
+                if writable {
+                    return Err(PyTypeError::new_err("Buffer is read-only"));
+                }
+                return Self::export(&builtins.getattr("bytes")?.call1((view,))?, false);
+            }
+            let len: usize = view.getattr("nbytes")?.extract()?;
+            if len == 0 {
+                return Ok(Self {
+                    ptr: std::ptr::NonNull::dangling().as_ptr(),
+                    len,
+                    _owner: view,
+                });
+            }
+            let ctypes = py.import("ctypes")?;
+            let owner = ctypes
+                .getattr("c_char")?
+                .call_method1("from_buffer", (view,))?;
+            let ptr: usize = ctypes.getattr("addressof")?.call1((&owner,))?.extract()?;
+            Ok(Self {
+                ptr: ptr as *mut u8,
+                len,
+                _owner: owner,
+            })
+        }
+
+        // Safety: nothing else may resize the buffer while the slice is alive.
+        unsafe fn as_slice(&self) -> &[u8] {
+            unsafe { std::slice::from_raw_parts(self.ptr, self.len) }
+        }
+
+        // Safety: the buffer must have been created with `new_mut`, and nothing else may resize
+        // it while the slice is alive.
+        unsafe fn as_mut_slice(&mut self) -> &mut [u8] {
+            unsafe { std::slice::from_raw_parts_mut(self.ptr, self.len) }
+        }
+
+        // `as_slice` for a buffer that must hold `h` rows of `row` bytes, `stride` bytes apart.
+        // A short buffer raises ValueError here instead of panicking halfway through a kernel.
+        unsafe fn as_rows(&self, h: usize, stride: usize, row: usize) -> PyResult<&[u8]> {
+            check_rows(self.len, h, stride, row)?;
+            Ok(unsafe { self.as_slice() })
+        }
+
+        unsafe fn as_rows_mut(
+            &mut self,
+            h: usize,
+            stride: usize,
+            row: usize,
+        ) -> PyResult<&mut [u8]> {
+            check_rows(self.len, h, stride, row)?;
+            Ok(unsafe { self.as_mut_slice() })
+        }
+    }
+
+    fn check_rows(len: usize, h: usize, stride: usize, row: usize) -> PyResult<()> {
+        if h > 1 && stride < row {
+            return Err(PyValueError::new_err("Stride too small"));
+        }
+        let needed = match h {
+            0 => Some(0),
+            _ => (h - 1).checked_mul(stride).and_then(|n| n.checked_add(row)),
+        };
+        match needed {
+            Some(needed) if needed <= len => Ok(()),
+            _ => Err(PyValueError::new_err("Buffer too small")),
+        }
+    }
+
+    // Number of threads a single conversion may use. 1 (the default) keeps everything on the
+    // calling thread.
+    static THREADS: AtomicUsize = AtomicUsize::new(1);
+    // Don't bother spawning a thread for less than this many pixels.
+    const MIN_BAND_PIXELS: usize = 1 << 16;
+
+    #[pyfunction]
+    fn set_threads(threads: usize) {
+        let threads = if threads == 0 {
+            thread::available_parallelism().map_or(1, |n| n.get())
+        } else {
+            threads
+        };
+        THREADS.store(threads, Ordering::Relaxed);
+    }
 
-    // "1" <-> cairo.Format.A1
     #[pyfunction]
-    fn a1_swap(data: &Bound<'_, PyByteArray>, w: usize, h: usize, stride: usize) {
-        let data = unsafe { data.as_bytes_mut() };
-        for y in 0..h {
-            for x in (0..w).step_by(32) {
-                let i = y * stride + x / 8;
-                let v = u32::from_ne_bytes([data[i], data[i + 1], data[i + 2], data[i + 3]]);
-                let v = ((v & 0xaaaaaaaa) >> 1) | ((v & 0x55555555) << 1);
-                let v = ((v & 0xcccccccc) >> 2) | ((v & 0x33333333) << 2);
-                let v = ((v & 0xf0f0f0f0) >> 4) | ((v & 0x0f0f0f0f) << 4);
-                [data[i], data[i + 1], data[i + 2], data[i + 3]] = v.to_ne_bytes();
+    fn get_threads() -> usize {
+        THREADS.load(Ordering::Relaxed)
+    }
+
+    // Split `outs` into bands of whole rows and call `f` with each band and the absolute rows it
+    // covers. Bands run on scoped threads when the image is big enough to be worth it.
+    fn for_each_band<const N: usize>(
+        outs: [&mut [u8]; N],
+        strides: [usize; N],
+        w: usize,
+        h: usize,
+        f: impl Fn([&mut [u8]; N], Range<usize>) + Sync,
+    ) {
+        let bands =
+            (w * h / MIN_BAND_PIXELS).clamp(1, THREADS.load(Ordering::Relaxed).clamp(1, h.max(1)));
+        if bands == 1 {
+            f(outs, 0..h);
+            return;
+        }
+        let rows = h.div_ceil(bands);
+        let mut rest = outs;
+        thread::scope(|s| {
+            let f = &f;
+            let mut y = 0;
+            while y < h {
+                let n = rows.min(h - y);
+                let band: [&mut [u8]; N] = std::array::from_fn(|i| {
+                    let out = std::mem::take(&mut rest[i]);
+                    let mid = (n * strides[i]).min(out.len());
+                    let (band, tail) = out.split_at_mut(mid);
+                    rest[i] = tail;
+                    band
+                });
+                let range = y..y + n;
+                y += n;
+                if y < h {
+                    s.spawn(move || f(band, range));
+                } else {
+                    f(band, range);
+                }
             }
+        });
+    }
+
+    // Whether the row kernels below may use their AVX2 copies. Only tests and benchmarks turn
+    // this off, to compare them with the baseline copies.
+    static AVX2: AtomicBool = AtomicBool::new(true);
+
+    #[pyfunction]
+    fn set_avx2(enabled: bool) {
+        AVX2.store(enabled, Ordering::Relaxed);
+    }
+
+    // Whether the AVX2 copies are in use: allowed and supported by the CPU.
+    #[pyfunction]
+    fn get_avx2() -> bool {
+        #[cfg(target_arch = "x86_64")]
+        {
+            AVX2.load(Ordering::Relaxed) && is_x86_feature_detected!("avx2")
+        }
+        #[cfg(not(target_arch = "x86_64"))]
+        {
+            false
         }
     }
 
+    // Define row kernels that are compiled twice: once for the baseline target (SSE2 on x86-64,
+    // NEON on aarch64) and, on x86-64, once more with AVX2 enabled, picked at runtime. There are
+    // no hand written intrinsics, the bodies are plain loops over `chunks_exact` without bounds
+    // checks or integer divisions, and vectorizing them at the width of each target is left to
+    // the compiler. They only use table lookups, integer multiplies and shifts, and lane-wise
+    // IEEE operations, so every copy gives identical results.
+    macro_rules! multiversion {
+        ($(fn $name:ident($($arg:ident: $ty:ty),* $(,)?) $body:block)*) => {$(
+            fn $name($($arg: $ty),*) {
+                #[inline(always)]
+                fn generic($($arg: $ty),*) $body
+
+                #[cfg(target_arch = "x86_64")]
+                {
+                    #[target_feature(enable = "avx2")]
+                    fn avx2($($arg: $ty),*) {
+                        generic($($arg),*)
+                    }
+
+                    if AVX2.load(Ordering::Relaxed) && is_x86_feature_detected!("avx2") {
+                        return unsafe { avx2($($arg),*) };
+                    }
+                }
+                generic($($arg),*)
+            }
+        )*};
+    }
+
+    #[inline(always)]
+    fn read_f32(data: &[u8]) -> f32 {
+        f32::from_ne_bytes([data[0], data[1], data[2], data[3]])
+    }
+
     #[inline(always)]
-    fn round_div(numerator: u16, denominator: u16) -> u16 {
+    fn write_f32(out: &mut [u8], v: f32) {
+        out[..4].copy_from_slice(&v.to_ne_bytes());
+    }
+
+    // "1" --> cairo.Format.A1. Pillow and cairo pack pixels into bytes in the opposite bit order.
+    // Only the bytes covering the `w` pixels of each row are written, so `out` may also be a
+    // region of a surface that starts on a byte boundary.
+    #[pyfunction]
+    fn pil_1_to_cairo_a1(
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
+        w: usize,
+        h: usize,
+        stride: usize,
+    ) -> PyResult<()> {
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, w.div_ceil(8), w.div_ceil(8))? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, stride, w.div_ceil(8))? };
+        let row = w.div_ceil(8);
+        py.detach(|| {
+            for_each_band([out], [stride], w, h, |[out], rows| {
+                for (y_out, y) in rows.enumerate() {
+                    let i_out = y_out * stride;
+                    let src = &data[y * row..(y + 1) * row];
+                    for (o, v) in out[i_out..i_out + row].iter_mut().zip(src) {
+                        *o = v.reverse_bits();
+                    }
+                }
+            });
+        });
+        Ok(())
+    }
+
+    const fn round_div(numerator: u16, denominator: u16) -> u16 {
         let quotient = numerator / denominator;
         let remainder = numerator % denominator;
 
@@ -32,449 +299,1831 @@ mod _core {
         }
     }
 
+    // Every channel conversion below maps at most 1024 input values, so they are all looked up in
+    // tables built at compile time instead of dividing per pixel.
+
+    // 8-bit channel --> RGB16_565 channel of `max`, already shifted into place.
+    const fn rgb16_table(max: u16, shift: u32) -> [u16; 256] {
+        let mut table = [0; 256];
+        let mut i = 0;
+        while i < 256 {
+            table[i] = round_div(i as u16 * max, 0xff) << shift;
+            i += 1;
+        }
+        table
+    }
+
+    static RGB16_R: [u16; 256] = rgb16_table(0x1f, 11);
+    static RGB16_G: [u16; 256] = rgb16_table(0x3f, 5);
+    static RGB16_B: [u16; 256] = rgb16_table(0x1f, 0);
+
+    // 8-bit channel --> 10-bit channel of RGB30
+    static RGB30_FROM_8: [u32; 256] = {
+        let mut table = [0; 256];
+        let mut i = 0;
+        while i < 256 {
+            table[i] = i as u32 * 0x3ff / 0xff;
+            i += 1;
+        }
+        table
+    };
+
+    // 10-bit channel of RGB30 --> 8-bit channel
+    static RGB30_TO_8: [u8; 1024] = {
+        let mut table = [0; 1024];
+        let mut i = 0;
+        while i < 1024 {
+            table[i] = (i as u32 * 0xff / 0x3ff) as u8;
+            i += 1;
+        }
+        table
+    };
+
+    // 10-bit channel of RGB30 --> 32-bit "I" channel
+    static RGB30_TO_32: [u32; 1024] = {
+        let mut table = [0; 1024];
+        let mut i = 0;
+        while i < 1024 {
+            table[i] = (i as u64 * 0xffffffff / 0x3ff) as u32;
+            i += 1;
+        }
+        table
+    };
+
+    #[derive(Clone, Copy)]
+    enum Dither {
+        Ordered,
+        FloydSteinberg,
+    }
+
+    impl Dither {
+        fn parse(name: &str) -> PyResult<Self> {
+            match name {
+                "ordered" => Ok(Self::Ordered),
+                "floyd-steinberg" => Ok(Self::FloydSteinberg),
+                _ => Err(PyValueError::new_err(format!("Unsupported dither: {name}"))),
+            }
+        }
+    }
+
+    // The sRGB transfer function, between the gamma encoded levels Pillow stores and linear light.
+    // Decoding has an entry per 8-bit level. Encoding interpolates between 4096 steps, which stays
+    // within a hundredth of a level of the exact curve, so 8-bit levels survive a round trip.
+    static SRGB_TO_LINEAR: LazyLock<[f32; 256]> = LazyLock::new(|| {
+        std::array::from_fn(|i| {
+            let v = i as f64 / 255.0;
+            let linear = if v <= 0.04045 {
+                v / 12.92
+            } else {
+                ((v + 0.055) / 1.055).powf(2.4)
+            };
+            linear as f32
+        })
+    });
+
+    static LINEAR_TO_SRGB: LazyLock<[f32; 4097]> = LazyLock::new(|| {
+        std::array::from_fn(|i| {
+            let v = i as f64 / 4096.0;
+            let encoded = if v <= 0.0031308 {
+                v * 12.92
+            } else {
+                1.055 * v.powf(1.0 / 2.4) - 0.055
+            };
+            (encoded * 255.0) as f32
+        })
+    });
+
+    // Linear light --> sRGB scaled to `0.0..=255.0`, not rounded. Out of range values are clamped.
+    #[inline(always)]
+    fn linear_to_srgb(lut: &[f32; 4097], v: f32) -> f32 {
+        let x = v.clamp(0.0, 1.0) * 4096.0;
+        let i = (x as usize).min(4095);
+        let t = x - i as f32;
+        lut[i] + (lut[i + 1] - lut[i]) * t
+    }
+
+    // 8x8 Bayer matrix, each of 0..64 once.
+    const BAYER: [[u8; 8]; 8] = [
+        [0, 32, 8, 40, 2, 34, 10, 42],
+        [48, 16, 56, 24, 50, 18, 58, 26],
+        [12, 44, 4, 36, 14, 46, 6, 38],
+        [60, 28, 52, 20, 62, 30, 54, 22],
+        [3, 35, 11, 43, 1, 33, 9, 41],
+        [51, 19, 59, 27, 49, 17, 57, 25],
+        [15, 47, 7, 39, 13, 45, 5, 37],
+        [63, 31, 55, 23, 61, 29, 53, 21],
+    ];
+
+    // Quantize `h` rows of `w` pixels with `C` channels each. `exact(y, x)` gives the channels of
+    // a pixel scaled so that the output levels are the integers `0..=max[c]`, and
+    // `store(row, x, levels)` writes a pixel into its row of `out`. Ordered dithering only looks at
+    // the position of a pixel, so it runs in bands like the other kernels. Floyd-Steinberg carries
+    // the error over to the next row, so it runs on the calling thread.
+    fn quantize_dithered<const C: usize>(
+        dither: Dither,
+        out: &mut [u8],
+        out_stride: usize,
+        w: usize,
+        h: usize,
+        max: [f32; C],
+        exact: impl Fn(usize, usize) -> [f32; C] + Sync,
+        store: impl Fn(&mut [u8], usize, [u32; C]) + Sync,
+    ) {
+        match dither {
+            Dither::Ordered => {
+                for_each_band([out], [out_stride], w, h, |[out], rows| {
+                    for (y_out, y) in rows.enumerate() {
+                        let row = &mut out[y_out * out_stride..];
+                        for x in 0..w {
+                            let t = (BAYER[y & 7][x & 7] as f32 + 0.5) / 64.0;
+                            let v = exact(y, x);
+                            store(
+                                row,
+                                x,
+                                std::array::from_fn(|c| (v[c] + t).clamp(0.0, max[c]) as u32),
+                            );
+                        }
+                    }
+                });
+            }
+            Dither::FloydSteinberg => {
+                // Error carried into this row and the next one, with a pixel of padding each side.
+                let mut cur = vec![[0.0f32; C]; w + 2];
+                let mut next = vec![[0.0f32; C]; w + 2];
+                for y in 0..h {
+                    let row = &mut out[y * out_stride..];
+                    for x in 0..w {
+                        let v = exact(y, x);
+                        let mut levels = [0; C];
+                        for c in 0..C {
+                            let v = v[c].clamp(0.0, max[c]) + cur[x + 1][c];
+                            let level = v.round().clamp(0.0, max[c]);
+                            levels[c] = level as u32;
+                            let err = v - level;
+                            cur[x + 2][c] += err * (7.0 / 16.0);
+                            next[x][c] += err * (3.0 / 16.0);
+                            next[x + 1][c] += err * (5.0 / 16.0);
+                            next[x + 2][c] += err * (1.0 / 16.0);
+                        }
+                        store(row, x, levels);
+                    }
+                    std::mem::swap(&mut cur, &mut next);
+                    next.fill([0.0; C]);
+                }
+            }
+        }
+    }
+
+    // The "RGB" kernels read 3 bytes per pixel, as `tobytes()` returns them, or 4, as Pillow
+    // keeps them in memory and pastes them into an "RGBX" buffer.
+    fn check_rgb_bpp(bpp: usize) -> PyResult<usize> {
+        match bpp {
+            3 | 4 => Ok(bpp),
+            _ => Err(PyValueError::new_err(format!("Unsupported bpp: {bpp}"))),
+        }
+    }
+
     // "RGB" --> cairo.Format.RGB16_565
     #[pyfunction]
+    #[pyo3(signature = (data, out, w, h, stride, bpp=3))]
     fn pil_rgb_to_cairo_rgb16(
-        data: &[u8],
-        out: &Bound<'_, PyByteArray>,
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
         w: usize,
         h: usize,
         stride: usize,
-    ) {
-        let out = unsafe { out.as_bytes_mut() };
-        let mut i_in: usize = 0;
-        for y in 0..h {
-            for x in 0..w {
-                let i_out = y * stride + x * 2;
-                let r = round_div(data[i_in] as u16 * 0x1f, 0xff);
-                let g = round_div(data[i_in + 1] as u16 * 0x3f, 0xff);
-                let b = round_div(data[i_in + 2] as u16 * 0x1f, 0xff);
-                let v = (r << 11) | (g << 5) | b;
-                [out[i_out], out[i_out + 1]] = v.to_ne_bytes();
-                i_in += 3;
-            }
-        }
+        bpp: usize,
+    ) -> PyResult<()> {
+        let bpp = check_rgb_bpp(bpp)?;
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, w * bpp, w * bpp)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, stride, w * 2)? };
+        py.detach(|| {
+            for_each_band([out], [stride], w, h, |[out], rows| {
+                for (y_out, y) in rows.enumerate() {
+                    for x in 0..w {
+                        let i_in = (y * w + x) * bpp;
+                        let i_out = y_out * stride + x * 2;
+                        let v = RGB16_R[data[i_in] as usize]
+                            | RGB16_G[data[i_in + 1] as usize]
+                            | RGB16_B[data[i_in + 2] as usize];
+                        [out[i_out], out[i_out + 1]] = v.to_ne_bytes();
+                    }
+                }
+            });
+        });
+        Ok(())
+    }
+
+    // "RGB" --> cairo.Format.RGB16_565, dithered
+    #[pyfunction]
+    #[pyo3(signature = (data, out, w, h, stride, dither, bpp=3))]
+    fn pil_rgb_to_cairo_rgb16_dithered(
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
+        w: usize,
+        h: usize,
+        stride: usize,
+        dither: String,
+        bpp: usize,
+    ) -> PyResult<()> {
+        let dither = Dither::parse(&dither)?;
+        let bpp = check_rgb_bpp(bpp)?;
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, w * bpp, w * bpp)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, stride, w * 2)? };
+        py.detach(|| {
+            quantize_dithered(
+                dither,
+                out,
+                stride,
+                w,
+                h,
+                [31.0, 63.0, 31.0],
+                |y, x| {
+                    let i = (y * w + x) * bpp;
+                    let p = &data[i..i + 3];
+                    [
+                        p[0] as f32 * (31.0 / 255.0),
+                        p[1] as f32 * (63.0 / 255.0),
+                        p[2] as f32 * (31.0 / 255.0),
+                    ]
+                },
+                |row, x, [r, g, b]| {
+                    let v = (r << 11 | g << 5 | b) as u16;
+                    row[x * 2..x * 2 + 2].copy_from_slice(&v.to_ne_bytes());
+                },
+            );
+        });
+        Ok(())
     }
 
     // "RGB" --> cairo.Format.RGB30
     #[pyfunction]
+    #[pyo3(signature = (data, out, w, h, stride, bpp=3))]
     fn pil_rgb_to_cairo_rgb30(
-        data: &[u8],
-        out: &Bound<'_, PyByteArray>,
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
         w: usize,
         h: usize,
         stride: usize,
-    ) {
-        let out = unsafe { out.as_bytes_mut() };
-        let mut i_in: usize = 0;
-        for y in 0..h {
-            for x in 0..w {
-                let i_out = y * stride + x * 4;
-                let r = data[i_in] as u32 * 0x3ff / 0xff;
-                let g = data[i_in + 1] as u32 * 0x3ff / 0xff;
-                let b = data[i_in + 2] as u32 * 0x3ff / 0xff;
-                let v = (r << 20) | (g << 10) | b;
-                [out[i_out], out[i_out + 1], out[i_out + 2], out[i_out + 3]] = v.to_ne_bytes();
-                i_in += 3;
-            }
-        }
+        bpp: usize,
+    ) -> PyResult<()> {
+        let bpp = check_rgb_bpp(bpp)?;
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, w * bpp, w * bpp)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, stride, w * 4)? };
+        py.detach(|| {
+            for_each_band([out], [stride], w, h, |[out], rows| {
+                for (y_out, y) in rows.enumerate() {
+                    for x in 0..w {
+                        let i_in = (y * w + x) * bpp;
+                        let i_out = y_out * stride + x * 4;
+                        let r = RGB30_FROM_8[data[i_in] as usize];
+                        let g = RGB30_FROM_8[data[i_in + 1] as usize];
+                        let b = RGB30_FROM_8[data[i_in + 2] as usize];
+                        let v = (r << 20) | (g << 10) | b;
+                        [out[i_out], out[i_out + 1], out[i_out + 2], out[i_out + 3]] =
+                            v.to_ne_bytes();
+                    }
+                }
+            });
+        });
+        Ok(())
     }
 
     // "I" * 3 --> cairo.Format.RGB30
     #[pyfunction]
     fn pil_i_to_cairo_rgb30(
-        r: &[u8],
-        g: &[u8],
-        b: &[u8],
-        out: &Bound<'_, PyByteArray>,
+        py: Python<'_>,
+        r: &Bound<'_, PyAny>,
+        g: &Bound<'_, PyAny>,
+        b: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
         w: usize,
         h: usize,
         stride: usize,
-    ) {
-        let out: &mut [u8] = unsafe { out.as_bytes_mut() };
-        let mut i_in: usize = 0;
-        for y in 0..h {
-            for x in 0..w {
-                let i_out = y * stride + x * 4;
-                let r_v = u32::from_ne_bytes([r[i_in], r[i_in + 1], r[i_in + 2], r[i_in + 3]]);
-                let g_v = u32::from_ne_bytes([g[i_in], g[i_in + 1], g[i_in + 2], g[i_in + 3]]);
-                let b_v = u32::from_ne_bytes([b[i_in], b[i_in + 1], b[i_in + 2], b[i_in + 3]]);
-                let r_v = r_v as u64 * 0x3ff / 0xffffffff;
-                let g_v = g_v as u64 * 0x3ff / 0xffffffff;
-                let b_v = b_v as u64 * 0x3ff / 0xffffffff;
-                let v = ((r_v as u32) << 20) | ((g_v as u32) << 10) | (b_v as u32);
-                [out[i_out], out[i_out + 1], out[i_out + 2], out[i_out + 3]] = v.to_ne_bytes();
-                i_in += 4;
+    ) -> PyResult<()> {
+        let r = Buffer::new(r)?;
+        let r = unsafe { r.as_rows(h, w * 4, w * 4)? };
+        let g = Buffer::new(g)?;
+        let g = unsafe { g.as_rows(h, w * 4, w * 4)? };
+        let b = Buffer::new(b)?;
+        let b = unsafe { b.as_rows(h, w * 4, w * 4)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, stride, w * 4)? };
+        py.detach(|| {
+            for_each_band([out], [stride], w, h, |[out], rows| {
+                for (y_out, y) in rows.enumerate() {
+                    for x in 0..w {
+                        let i_in = (y * w + x) * 4;
+                        let i_out = y_out * stride + x * 4;
+                        let r_v =
+                            u32::from_ne_bytes([r[i_in], r[i_in + 1], r[i_in + 2], r[i_in + 3]]);
+                        let g_v =
+                            u32::from_ne_bytes([g[i_in], g[i_in + 1], g[i_in + 2], g[i_in + 3]]);
+                        let b_v =
+                            u32::from_ne_bytes([b[i_in], b[i_in + 1], b[i_in + 2], b[i_in + 3]]);
+                        let r_v = r_v as u64 * 0x3ff / 0xffffffff;
+                        let g_v = g_v as u64 * 0x3ff / 0xffffffff;
+                        let b_v = b_v as u64 * 0x3ff / 0xffffffff;
+                        let v = ((r_v as u32) << 20) | ((g_v as u32) << 10) | (b_v as u32);
+                        [out[i_out], out[i_out + 1], out[i_out + 2], out[i_out + 3]] =
+                            v.to_ne_bytes();
+                    }
+                }
+            });
+        });
+        Ok(())
+    }
+
+    multiversion! {
+        fn pil_rgb_to_cairo_rgb96f_row(data: &[u8], out: &mut [u8]) {
+            for (p, o) in data.chunks_exact(3).zip(out.chunks_exact_mut(12)) {
+                write_f32(&mut o[0..4], (p[0] as f32) / 255.0);
+                write_f32(&mut o[4..8], (p[1] as f32) / 255.0);
+                write_f32(&mut o[8..12], (p[2] as f32) / 255.0);
+            }
+        }
+
+        fn pil_rgbx_to_cairo_rgb96f_row(data: &[u8], out: &mut [u8]) {
+            for (p, o) in data.chunks_exact(4).zip(out.chunks_exact_mut(12)) {
+                write_f32(&mut o[0..4], (p[0] as f32) / 255.0);
+                write_f32(&mut o[4..8], (p[1] as f32) / 255.0);
+                write_f32(&mut o[8..12], (p[2] as f32) / 255.0);
+            }
+        }
+
+        fn pil_rgba_to_cairo_rgba128f_row(data: &[u8], out: &mut [u8]) {
+            for (p, o) in data.chunks_exact(4).zip(out.chunks_exact_mut(16)) {
+                let a = (p[3] as f32) / 255.0;
+                write_f32(&mut o[0..4], (p[0] as f32) / 255.0 * a);
+                write_f32(&mut o[4..8], (p[1] as f32) / 255.0 * a);
+                write_f32(&mut o[8..12], (p[2] as f32) / 255.0 * a);
+                write_f32(&mut o[12..16], a);
+            }
+        }
+
+        fn pil_f_to_cairo_rgba128f_row(
+            r: &[u8],
+            g: &[u8],
+            b: &[u8],
+            a: &[u8],
+            out: &mut [u8],
+        ) {
+            let planes = r.chunks_exact(4).zip(g.chunks_exact(4)).zip(b.chunks_exact(4));
+            let pixels = a.chunks_exact(4).zip(out.chunks_exact_mut(16));
+            for (((r, g), b), (a, o)) in planes.zip(pixels) {
+                let a = read_f32(a);
+                write_f32(&mut o[0..4], read_f32(r) * a);
+                write_f32(&mut o[4..8], read_f32(g) * a);
+                write_f32(&mut o[8..12], read_f32(b) * a);
+                write_f32(&mut o[12..16], a);
+            }
+        }
+
+        fn pil_rgba_to_cairo_argb32_row(data: &mut [u8], nearest: bool) {
+            if data.chunks_exact(4).all(|p| p[3] == 0xff) {
+                premultiply_row(data, |c, _| c);
+            } else if nearest {
+                premultiply_row(data, mul_div_255);
+            } else {
+                // `c * a / 0xff`, exact for every pair of bytes.
+                premultiply_row(data, |c, a| ((c as u32 * a as u32 * 0x8081) >> 23) as u8);
+            }
+        }
+
+        fn cairo_argb32_to_pil_rgba_row(data: &[u8], out: &mut [u8], nearest: bool) {
+            if data.chunks_exact(4).all(|p| read_u32(p) >> 24 == 0xff) {
+                unpremultiply_row(data, out, |c, _| c as u8);
+            } else if nearest {
+                unpremultiply_row(data, out, |c, r| ((c * r + 0x8000) >> 16).min(0xff) as u8);
+            } else {
+                unpremultiply_row(data, out, |c, r| ((c * r) >> 16).min(0xff) as u8);
+            }
+        }
+
+        fn rgbaf_to_cairo_rgba128f_row(data: &[u8], out: &mut [u8]) {
+            for (p, o) in data.chunks_exact(16).zip(out.chunks_exact_mut(16)) {
+                let a = read_f32(&p[12..16]);
+                write_f32(&mut o[0..4], read_f32(&p[0..4]) * a);
+                write_f32(&mut o[4..8], read_f32(&p[4..8]) * a);
+                write_f32(&mut o[8..12], read_f32(&p[8..12]) * a);
+                write_f32(&mut o[12..16], a);
+            }
+        }
+
+        fn cairo_rgba128f_to_rgbaf_row(data: &[u8], out: &mut [u8]) {
+            for (p, o) in data.chunks_exact(16).zip(out.chunks_exact_mut(16)) {
+                let a = read_f32(&p[12..16]);
+                let unpremultiply = |v: f32| if a == 0.0 { 0.0 } else { v / a };
+                write_f32(&mut o[0..4], unpremultiply(read_f32(&p[0..4])));
+                write_f32(&mut o[4..8], unpremultiply(read_f32(&p[4..8])));
+                write_f32(&mut o[8..12], unpremultiply(read_f32(&p[8..12])));
+                write_f32(&mut o[12..16], a);
+            }
+        }
+
+        fn cairo_rgb96f_to_pil_rgb_row(data: &[u8], out: &mut [u8]) {
+            for (p, o) in data.chunks_exact(12).zip(out.chunks_exact_mut(3)) {
+                o[0] = (read_f32(&p[0..4]) * 255.0) as u8;
+                o[1] = (read_f32(&p[4..8]) * 255.0) as u8;
+                o[2] = (read_f32(&p[8..12]) * 255.0) as u8;
+            }
+        }
+
+        fn cairo_rgba128f_to_pil_rgba_row(data: &[u8], out: &mut [u8]) {
+            for (p, o) in data.chunks_exact(16).zip(out.chunks_exact_mut(4)) {
+                let a = read_f32(&p[12..16]);
+                o[0] = (read_f32(&p[0..4]) / a * 255.0) as u8;
+                o[1] = (read_f32(&p[4..8]) / a * 255.0) as u8;
+                o[2] = (read_f32(&p[8..12]) / a * 255.0) as u8;
+                o[3] = (a * 255.0) as u8;
+            }
+        }
+
+        fn cairo_rgba128f_to_pil_f_row(
+            data: &[u8],
+            r: &mut [u8],
+            g: &mut [u8],
+            b: &mut [u8],
+            a: &mut [u8],
+        ) {
+            let planes = r.chunks_exact_mut(4).zip(g.chunks_exact_mut(4));
+            let planes = planes.zip(b.chunks_exact_mut(4));
+            let pixels = a.chunks_exact_mut(4).zip(data.chunks_exact(16));
+            for (((r, g), b), (a, p)) in planes.zip(pixels) {
+                let a_v = read_f32(&p[12..16]);
+                let unpremultiply = |v: f32| if a_v == 0.0 { 0.0 } else { v / a_v };
+                write_f32(r, unpremultiply(read_f32(&p[0..4])));
+                write_f32(g, unpremultiply(read_f32(&p[4..8])));
+                write_f32(b, unpremultiply(read_f32(&p[8..12])));
+                write_f32(a, a_v);
             }
         }
     }
 
     // "RGB" --> cairo.Format.RGB96F
     #[pyfunction]
+    #[pyo3(signature = (data, out, w, h, stride, bpp=3))]
     fn pil_rgb_to_cairo_rgb96f(
-        data: &[u8],
-        out: &Bound<'_, PyByteArray>,
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
         w: usize,
         h: usize,
         stride: usize,
-    ) {
-        let out = unsafe { out.as_bytes_mut() };
-        let mut i_in: usize = 0;
-        for y in 0..h {
-            for x in 0..w {
-                let i_out = y * stride + x * 12;
-                let r = data[i_in];
-                let g = data[i_in + 1];
-                let b = data[i_in + 2];
-                [out[i_out], out[i_out + 1], out[i_out + 2], out[i_out + 3]] =
-                    ((r as f32) / 255.0).to_ne_bytes();
-                [
-                    out[i_out + 4],
-                    out[i_out + 5],
-                    out[i_out + 6],
-                    out[i_out + 7],
-                ] = ((g as f32) / 255.0).to_ne_bytes();
-                [
-                    out[i_out + 8],
-                    out[i_out + 9],
-                    out[i_out + 10],
-                    out[i_out + 11],
-                ] = ((b as f32) / 255.0).to_ne_bytes();
-                i_in += 3;
-            }
-        }
+        bpp: usize,
+    ) -> PyResult<()> {
+        let bpp = check_rgb_bpp(bpp)?;
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, w * bpp, w * bpp)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, stride, w * 12)? };
+        let row = if bpp == 3 {
+            pil_rgb_to_cairo_rgb96f_row
+        } else {
+            pil_rgbx_to_cairo_rgb96f_row
+        };
+        py.detach(|| {
+            for_each_band([out], [stride], w, h, |[out], rows| {
+                for (y_out, y) in rows.enumerate() {
+                    let i_out = y_out * stride;
+                    row(
+                        &data[y * w * bpp..(y + 1) * w * bpp],
+                        &mut out[i_out..i_out + w * 12],
+                    );
+                }
+            });
+        });
+        Ok(())
     }
 
     // "F" * 3 --> cairo.Format.RGB96F
     #[pyfunction]
     fn pil_f_to_cairo_rgb96f(
-        r: &[u8],
-        g: &[u8],
-        b: &[u8],
-        out: &Bound<'_, PyByteArray>,
+        py: Python<'_>,
+        r: &Bound<'_, PyAny>,
+        g: &Bound<'_, PyAny>,
+        b: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
         w: usize,
         h: usize,
         stride: usize,
-    ) {
-        let out: &mut [u8] = unsafe { out.as_bytes_mut() };
-        let mut i_in: usize = 0;
-        for y in 0..h {
-            for x in 0..w {
-                let i_out = y * stride + x * 12;
-                [out[i_out], out[i_out + 1], out[i_out + 2], out[i_out + 3]] =
-                    [r[i_in], r[i_in + 1], r[i_in + 2], r[i_in + 3]];
-                [
-                    out[i_out + 4],
-                    out[i_out + 5],
-                    out[i_out + 6],
-                    out[i_out + 7],
-                ] = [g[i_in], g[i_in + 1], g[i_in + 2], g[i_in + 3]];
-                [
-                    out[i_out + 8],
-                    out[i_out + 9],
-                    out[i_out + 10],
-                    out[i_out + 11],
-                ] = [b[i_in], b[i_in + 1], b[i_in + 2], b[i_in + 3]];
-                i_in += 4;
-            }
-        }
+    ) -> PyResult<()> {
+        let r = Buffer::new(r)?;
+        let r = unsafe { r.as_rows(h, w * 4, w * 4)? };
+        let g = Buffer::new(g)?;
+        let g = unsafe { g.as_rows(h, w * 4, w * 4)? };
+        let b = Buffer::new(b)?;
+        let b = unsafe { b.as_rows(h, w * 4, w * 4)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, stride, w * 12)? };
+        py.detach(|| {
+            for_each_band([out], [stride], w, h, |[out], rows| {
+                for (y_out, y) in rows.enumerate() {
+                    for x in 0..w {
+                        let i_in = (y * w + x) * 4;
+                        let i_out = y_out * stride + x * 12;
+                        [out[i_out], out[i_out + 1], out[i_out + 2], out[i_out + 3]] =
+                            [r[i_in], r[i_in + 1], r[i_in + 2], r[i_in + 3]];
+                        [
+                            out[i_out + 4],
+                            out[i_out + 5],
+                            out[i_out + 6],
+                            out[i_out + 7],
+                        ] = [g[i_in], g[i_in + 1], g[i_in + 2], g[i_in + 3]];
+                        [
+                            out[i_out + 8],
+                            out[i_out + 9],
+                            out[i_out + 10],
+                            out[i_out + 11],
+                        ] = [b[i_in], b[i_in + 1], b[i_in + 2], b[i_in + 3]];
+                    }
+                }
+            });
+        });
+        Ok(())
     }
 
     // "RGBA" --> cairo.Format.RGBA128F
     #[pyfunction]
     fn pil_rgba_to_cairo_rgba128f(
-        data: &[u8],
-        out: &Bound<'_, PyByteArray>,
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
         w: usize,
         h: usize,
         stride: usize,
-    ) {
-        let out = unsafe { out.as_bytes_mut() };
-        let mut i_in: usize = 0;
-        for y in 0..h {
-            for x in 0..w {
-                let i_out = y * stride + x * 16;
-                let mut r = (data[i_in] as f32) / 255.0;
-                let mut g = (data[i_in + 1] as f32) / 255.0;
-                let mut b = (data[i_in + 2] as f32) / 255.0;
-                let a = (data[i_in + 3] as f32) / 255.0;
-                r *= a;
-                g *= a;
-                b *= a;
-                [out[i_out], out[i_out + 1], out[i_out + 2], out[i_out + 3]] = r.to_ne_bytes();
-                [
-                    out[i_out + 4],
-                    out[i_out + 5],
-                    out[i_out + 6],
-                    out[i_out + 7],
-                ] = g.to_ne_bytes();
-                [
-                    out[i_out + 8],
-                    out[i_out + 9],
-                    out[i_out + 10],
-                    out[i_out + 11],
-                ] = b.to_ne_bytes();
-                [
-                    out[i_out + 12],
-                    out[i_out + 13],
-                    out[i_out + 14],
-                    out[i_out + 15],
-                ] = a.to_ne_bytes();
-                i_in += 4;
-            }
-        }
+    ) -> PyResult<()> {
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, w * 4, w * 4)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, stride, w * 16)? };
+        py.detach(|| {
+            for_each_band([out], [stride], w, h, |[out], rows| {
+                for (y_out, y) in rows.enumerate() {
+                    let i_out = y_out * stride;
+                    pil_rgba_to_cairo_rgba128f_row(
+                        &data[y * w * 4..(y + 1) * w * 4],
+                        &mut out[i_out..i_out + w * 16],
+                    );
+                }
+            });
+        });
+        Ok(())
+    }
+
+    // "RGB" --> cairo.Format.RGB96F, decoded from sRGB to linear light
+    #[pyfunction]
+    #[pyo3(signature = (data, out, w, h, stride, bpp=3))]
+    fn pil_rgb_to_cairo_rgb96f_srgb(
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
+        w: usize,
+        h: usize,
+        stride: usize,
+        bpp: usize,
+    ) -> PyResult<()> {
+        let bpp = check_rgb_bpp(bpp)?;
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, w * bpp, w * bpp)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, stride, w * 12)? };
+        py.detach(|| {
+            let lut = &*SRGB_TO_LINEAR;
+            for_each_band([out], [stride], w, h, |[out], rows| {
+                for (y_out, y) in rows.enumerate() {
+                    let i_out = y_out * stride;
+                    let pixels = data[y * w * bpp..(y + 1) * w * bpp].chunks_exact(bpp);
+                    for (p, o) in pixels.zip(out[i_out..i_out + w * 12].chunks_exact_mut(12)) {
+                        for c in 0..3 {
+                            write_f32(&mut o[c * 4..], lut[p[c] as usize]);
+                        }
+                    }
+                }
+            });
+        });
+        Ok(())
+    }
+
+    // "RGBA" --> cairo.Format.RGBA128F, decoded from sRGB to linear light before being
+    // premultiplied. Alpha is linear already.
+    #[pyfunction]
+    fn pil_rgba_to_cairo_rgba128f_srgb(
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
+        w: usize,
+        h: usize,
+        stride: usize,
+    ) -> PyResult<()> {
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, w * 4, w * 4)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, stride, w * 16)? };
+        py.detach(|| {
+            let lut = &*SRGB_TO_LINEAR;
+            for_each_band([out], [stride], w, h, |[out], rows| {
+                for (y_out, y) in rows.enumerate() {
+                    let i_out = y_out * stride;
+                    let pixels = data[y * w * 4..(y + 1) * w * 4].chunks_exact(4);
+                    for (p, o) in pixels.zip(out[i_out..i_out + w * 16].chunks_exact_mut(16)) {
+                        let a = (p[3] as f32) / 255.0;
+                        for c in 0..3 {
+                            write_f32(&mut o[c * 4..], lut[p[c] as usize] * a);
+                        }
+                        write_f32(&mut o[12..], a);
+                    }
+                }
+            });
+        });
+        Ok(())
     }
 
     // "F" * 4 --> cairo.Format.RGBA128F
     #[pyfunction]
     fn pil_f_to_cairo_rgba128f(
-        r: &[u8],
-        g: &[u8],
-        b: &[u8],
-        a: &[u8],
-        out: &Bound<'_, PyByteArray>,
+        py: Python<'_>,
+        r: &Bound<'_, PyAny>,
+        g: &Bound<'_, PyAny>,
+        b: &Bound<'_, PyAny>,
+        a: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
         w: usize,
         h: usize,
         stride: usize,
-    ) {
-        let out: &mut [u8] = unsafe { out.as_bytes_mut() };
-        let mut i_in: usize = 0;
-        for y in 0..h {
-            for x in 0..w {
-                let i_out = y * stride + x * 16;
-                let mut r_v = f32::from_ne_bytes([r[i_in], r[i_in + 1], r[i_in + 2], r[i_in + 3]]);
-                let mut g_v = f32::from_ne_bytes([g[i_in], g[i_in + 1], g[i_in + 2], g[i_in + 3]]);
-                let mut b_v = f32::from_ne_bytes([b[i_in], b[i_in + 1], b[i_in + 2], b[i_in + 3]]);
-                let a_v = f32::from_ne_bytes([a[i_in], a[i_in + 1], a[i_in + 2], a[i_in + 3]]);
-                r_v *= a_v;
-                g_v *= a_v;
-                b_v *= a_v;
-                [out[i_out], out[i_out + 1], out[i_out + 2], out[i_out + 3]] = r_v.to_ne_bytes();
-                [
-                    out[i_out + 4],
-                    out[i_out + 5],
-                    out[i_out + 6],
-                    out[i_out + 7],
-                ] = g_v.to_ne_bytes();
-                [
-                    out[i_out + 8],
-                    out[i_out + 9],
-                    out[i_out + 10],
-                    out[i_out + 11],
-                ] = b_v.to_ne_bytes();
-                [
-                    out[i_out + 12],
-                    out[i_out + 13],
-                    out[i_out + 14],
-                    out[i_out + 15],
-                ] = a_v.to_ne_bytes();
-                i_in += 4;
-            }
-        }
-    }
-
-    // cairo.Format.RGB30 --> "BGRX"
-    #[pyfunction]
-    fn cairo_rgb30_to_pil_bgrx(data: &Bound<'_, PyByteArray>, w: usize, h: usize, stride: usize) {
-        let data = unsafe { data.as_bytes_mut() };
-        for y in 0..h {
-            for x in 0..w {
-                let i = y * stride + x * 4;
-                let v = u32::from_ne_bytes([data[i], data[i + 1], data[i + 2], data[i + 3]]);
-                let r = ((v >> 20) * 0xff / 0x3ff) as u8;
-                let g = (((v >> 10) & 0x3ff) * 0xff / 0x3ff) as u8;
-                let b = ((v & 0x3ff) * 0xff / 0x3ff) as u8;
-                [data[i], data[i + 1], data[i + 2], data[i + 3]] = [b, g, r, 255];
-            }
+    ) -> PyResult<()> {
+        let r = Buffer::new(r)?;
+        let r = unsafe { r.as_rows(h, w * 4, w * 4)? };
+        let g = Buffer::new(g)?;
+        let g = unsafe { g.as_rows(h, w * 4, w * 4)? };
+        let b = Buffer::new(b)?;
+        let b = unsafe { b.as_rows(h, w * 4, w * 4)? };
+        let a = Buffer::new(a)?;
+        let a = unsafe { a.as_rows(h, w * 4, w * 4)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, stride, w * 16)? };
+        py.detach(|| {
+            for_each_band([out], [stride], w, h, |[out], rows| {
+                for (y_out, y) in rows.enumerate() {
+                    let i_in = y * w * 4..(y + 1) * w * 4;
+                    let i_out = y_out * stride;
+                    pil_f_to_cairo_rgba128f_row(
+                        &r[i_in.clone()],
+                        &g[i_in.clone()],
+                        &b[i_in.clone()],
+                        &a[i_in],
+                        &mut out[i_out..i_out + w * 16],
+                    );
+                }
+            });
+        });
+        Ok(())
+    }
+
+    // Interleaved float32 RGBA --> cairo.Format.RGBA128F
+    #[pyfunction]
+    fn rgbaf_to_cairo_rgba128f(
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
+        w: usize,
+        h: usize,
+        stride: usize,
+    ) -> PyResult<()> {
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, w * 16, w * 16)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, stride, w * 16)? };
+        py.detach(|| {
+            for_each_band([out], [stride], w, h, |[out], rows| {
+                for (y_out, y) in rows.enumerate() {
+                    let i_out = y_out * stride;
+                    rgbaf_to_cairo_rgba128f_row(
+                        &data[y * w * 16..(y + 1) * w * 16],
+                        &mut out[i_out..i_out + w * 16],
+                    );
+                }
+            });
+        });
+        Ok(())
+    }
+
+    // Same rounding as Pillow's "BGRa" packer, which is exactly round(a * b / 255).
+    #[inline(always)]
+    fn mul_div_255(a: u8, b: u8) -> u8 {
+        let tmp = a as u32 * b as u32 + 128;
+        (((tmp >> 8) + tmp) >> 8) as u8
+    }
+
+    #[inline(always)]
+    fn read_u32(data: &[u8]) -> u32 {
+        u32::from_ne_bytes([data[0], data[1], data[2], data[3]])
+    }
+
+    // "RGBA" --> native endian premultiplied ARGB, in place. A fully opaque row passes `|c, _| c`
+    // so it is a plain shuffle.
+    #[inline(always)]
+    fn premultiply_row(data: &mut [u8], mul: impl Fn(u8, u8) -> u8) {
+        for p in data.chunks_exact_mut(4) {
+            let [r, g, b, a] = [p[0], p[1], p[2], p[3]];
+            let [r, g, b] = [mul(r, a), mul(g, a), mul(b, a)];
+            let v = (a as u32) << 24 | (r as u32) << 16 | (g as u32) << 8 | b as u32;
+            p.copy_from_slice(&v.to_ne_bytes());
         }
     }
 
-    // cairo.Format.RGB96F --> "RGB"
+    // 0xff / a in 16.16 fixed point, rounded up. For every byte `c` and non-zero `a`,
+    // `(c * UNPREMULTIPLY[a]) >> 16` is exactly `c * 0xff / a`, and adding 0x8000 before the
+    // shift gives `(c * 0xff + a / 2) / a`, without dividing per pixel.
+    static UNPREMULTIPLY: [u32; 256] = {
+        let mut table = [0; 256];
+        let mut a = 1;
+        while a < 256 {
+            table[a] = (0xff_u32 << 16).div_ceil(a as u32);
+            a += 1;
+        }
+        table
+    };
+
+    // Native endian premultiplied ARGB --> "RGBA". `div` gets each channel and the
+    // `UNPREMULTIPLY` entry of its alpha, which is 0 for fully transparent pixels so they always
+    // come out zero.
+    #[inline(always)]
+    fn unpremultiply_row(data: &[u8], out: &mut [u8], div: impl Fn(u32, u32) -> u8) {
+        for (p, o) in data.chunks_exact(4).zip(out.chunks_exact_mut(4)) {
+            let v = read_u32(p);
+            let a = v >> 24;
+            let [r, g, b] = [(v >> 16) & 0xff, (v >> 8) & 0xff, v & 0xff];
+            let reciprocal = UNPREMULTIPLY[a as usize];
+            let rgb = [div(r, reciprocal), div(g, reciprocal), div(b, reciprocal)];
+            o.copy_from_slice(&[rgb[0], rgb[1], rgb[2], a as u8]);
+        }
+    }
+
+    // "RGBX" --> cairo.Format.RGB24, in place
     #[pyfunction]
-    fn cairo_rgb96f_to_pil_rgb(
+    fn pil_rgbx_to_cairo_rgb24(
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        w: usize,
+        h: usize,
+        stride: usize,
+    ) -> PyResult<()> {
+        let mut data = Buffer::new_mut(data)?;
+        let data = unsafe { data.as_rows_mut(h, stride, w * 4)? };
+        py.detach(|| {
+            for_each_band([data], [stride], w, h, |[data], rows| {
+                for y in 0..rows.len() {
+                    for x in 0..w {
+                        let i = y * stride + x * 4;
+                        let [r, g, b] = [data[i], data[i + 1], data[i + 2]];
+                        let v = 0xff000000 | (r as u32) << 16 | (g as u32) << 8 | b as u32;
+                        [data[i], data[i + 1], data[i + 2], data[i + 3]] = v.to_ne_bytes();
+                    }
+                }
+            });
+        });
+        Ok(())
+    }
+
+    // "RGB" --> cairo.Format.RGB24
+    #[pyfunction]
+    fn pil_rgb_to_cairo_rgb24(
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
+        w: usize,
+        h: usize,
+        stride: usize,
+    ) -> PyResult<()> {
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, w * 3, w * 3)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, stride, w * 4)? };
+        py.detach(|| {
+            map_pixels_u32(data, out, 3, w, h, stride, |p| {
+                0xff000000 | (p[0] as u32) << 16 | (p[1] as u32) << 8 | p[2] as u32
+            });
+        });
+        Ok(())
+    }
+
+    // Write each pixel of `bpp` bytes in `data` (rows packed) as a native endian 32-bit pixel of
+    // `out` (rows `stride` apart).
+    fn map_pixels_u32(
         data: &[u8],
-        out: &Bound<'_, PyByteArray>,
+        out: &mut [u8],
+        bpp: usize,
         w: usize,
         h: usize,
         stride: usize,
+        f: impl Fn(&[u8]) -> u32 + Sync,
     ) {
-        let out: &mut [u8] = unsafe { out.as_bytes_mut() };
-        let mut i_out: usize = 0;
-        for y in 0..h {
-            for x in 0..w {
-                let i_in = y * stride + x * 12;
-                let r = f32::from_ne_bytes([
-                    data[i_in],
-                    data[i_in + 1],
-                    data[i_in + 2],
-                    data[i_in + 3],
-                ]);
-                let g = f32::from_ne_bytes([
-                    data[i_in + 4],
-                    data[i_in + 5],
-                    data[i_in + 6],
-                    data[i_in + 7],
-                ]);
-                let b = f32::from_ne_bytes([
-                    data[i_in + 8],
-                    data[i_in + 9],
-                    data[i_in + 10],
-                    data[i_in + 11],
-                ]);
-                [out[i_out], out[i_out + 1], out[i_out + 2]] =
-                    [(r * 255.0) as u8, (g * 255.0) as u8, (b * 255.0) as u8];
-                i_out += 3;
+        for_each_band([out], [stride], w, h, |[out], rows| {
+            for (y_out, y) in rows.enumerate() {
+                let src = data[y * w * bpp..(y + 1) * w * bpp].chunks_exact(bpp);
+                let dst = out[y_out * stride..y_out * stride + w * 4].chunks_exact_mut(4);
+                for (p, o) in src.zip(dst) {
+                    o.copy_from_slice(&f(p).to_ne_bytes());
+                }
             }
+        });
+    }
+
+    // "LA" or "La" --> cairo.Format.ARGB32 grey. "LA" is premultiplied the same way as
+    // `pil_rgba_to_cairo_argb32` does it, "La" already is.
+    #[pyfunction]
+    fn pil_la_to_cairo_argb32(
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
+        w: usize,
+        h: usize,
+        stride: usize,
+        premultiplied: bool,
+        nearest: bool,
+    ) -> PyResult<()> {
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, w * 2, w * 2)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, stride, w * 4)? };
+        py.detach(|| {
+            map_pixels_u32(data, out, 2, w, h, stride, |p| {
+                let [l, a] = [p[0], p[1]];
+                let l = if premultiplied {
+                    l
+                } else if nearest {
+                    mul_div_255(l, a)
+                } else {
+                    (l as u32 * a as u32 / 255) as u8
+                };
+                (a as u32) << 24 | (l as u32) * 0x010101
+            });
+        });
+        Ok(())
+    }
+
+    // "RGBa" --> cairo.Format.ARGB32, a plain channel swizzle
+    #[pyfunction]
+    fn pil_rgba_premultiplied_to_cairo_argb32(
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
+        w: usize,
+        h: usize,
+        stride: usize,
+    ) -> PyResult<()> {
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, w * 4, w * 4)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, stride, w * 4)? };
+        py.detach(|| {
+            map_pixels_u32(data, out, 4, w, h, stride, |p| {
+                (p[3] as u32) << 24 | (p[0] as u32) << 16 | (p[1] as u32) << 8 | p[2] as u32
+            });
+        });
+        Ok(())
+    }
+
+    // "P" --> cairo.Format.ARGB32. `palette` holds 256 native endian premultiplied ARGB pixels.
+    #[pyfunction]
+    fn pil_p_to_cairo_argb32(
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        palette: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
+        w: usize,
+        h: usize,
+        stride: usize,
+    ) -> PyResult<()> {
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, w, w)? };
+        let palette = Buffer::new(palette)?;
+        let palette = unsafe { palette.as_slice() };
+        if palette.len() != 256 * 4 {
+            return Err(PyValueError::new_err("Palette must have 256 entries"));
         }
+        let palette: [u32; 256] = std::array::from_fn(|i| read_u32(&palette[i * 4..]));
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, stride, w * 4)? };
+        py.detach(|| {
+            map_pixels_u32(data, out, 1, w, h, stride, |p| palette[p[0] as usize]);
+        });
+        Ok(())
+    }
+
+    // "I;16" --> cairo.Format.RGB30 grey, keeping 10 of the 16 bits instead of the 8 left after
+    // converting to "RGB".
+    #[pyfunction]
+    fn pil_i16_to_cairo_rgb30(
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
+        w: usize,
+        h: usize,
+        stride: usize,
+    ) -> PyResult<()> {
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, w * 2, w * 2)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, stride, w * 4)? };
+        py.detach(|| {
+            map_pixels_u32(data, out, 2, w, h, stride, |p| {
+                let v = u16::from_le_bytes([p[0], p[1]]) as u32;
+                let v = (v * 0x3ff + 0x7fff) / 0xffff;
+                (v << 20) | (v << 10) | v
+            });
+        });
+        Ok(())
+    }
+
+    // "I;16" --> cairo.Format.RGB96F grey, losslessly
+    #[pyfunction]
+    fn pil_i16_to_cairo_rgb96f(
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
+        w: usize,
+        h: usize,
+        stride: usize,
+    ) -> PyResult<()> {
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, w * 2, w * 2)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, stride, w * 12)? };
+        py.detach(|| {
+            for_each_band([out], [stride], w, h, |[out], rows| {
+                for (y_out, y) in rows.enumerate() {
+                    let src = data[y * w * 2..(y + 1) * w * 2].chunks_exact(2);
+                    let dst = out[y_out * stride..y_out * stride + w * 12].chunks_exact_mut(12);
+                    for (p, o) in src.zip(dst) {
+                        let v = u16::from_le_bytes([p[0], p[1]]) as f32 / 65535.0;
+                        write_f32(&mut o[0..4], v);
+                        write_f32(&mut o[4..8], v);
+                        write_f32(&mut o[8..12], v);
+                    }
+                }
+            });
+        });
+        Ok(())
+    }
+
+    // "RGBA" --> cairo.Format.ARGB32, in place. Premultiplies with rounding to nearest (what
+    // Pillow does) or truncating.
+    #[pyfunction]
+    fn pil_rgba_to_cairo_argb32(
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        w: usize,
+        h: usize,
+        stride: usize,
+        nearest: bool,
+    ) -> PyResult<()> {
+        let mut data = Buffer::new_mut(data)?;
+        let data = unsafe { data.as_rows_mut(h, stride, w * 4)? };
+        py.detach(|| {
+            for_each_band([data], [stride], w, h, |[data], rows| {
+                for y in 0..rows.len() {
+                    let row = &mut data[y * stride..y * stride + w * 4];
+                    pil_rgba_to_cairo_argb32_row(row, nearest);
+                }
+            });
+        });
+        Ok(())
+    }
+
+    // cairo.Format.ARGB32 --> "RGBA". Unpremultiplies with rounding to nearest, which makes
+    // converting back with `pil_rgba_to_cairo_argb32` lossless, or truncating.
+    #[pyfunction]
+    fn cairo_argb32_to_pil_rgba(
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
+        w: usize,
+        h: usize,
+        stride: usize,
+        nearest: bool,
+    ) -> PyResult<()> {
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, stride, w * 4)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, w * 4, w * 4)? };
+        py.detach(|| {
+            for_each_band([out], [w * 4], w, h, |[out], rows| {
+                for (y_out, y) in rows.enumerate() {
+                    let i_in = y * stride;
+                    cairo_argb32_to_pil_rgba_row(
+                        &data[i_in..i_in + w * 4],
+                        &mut out[y_out * w * 4..(y_out + 1) * w * 4],
+                        nearest,
+                    );
+                }
+            });
+        });
+        Ok(())
+    }
+
+    // cairo.Format.RGB30 --> "RGB"
+    #[pyfunction]
+    fn cairo_rgb30_to_pil_rgb(
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
+        w: usize,
+        h: usize,
+        stride: usize,
+    ) -> PyResult<()> {
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, stride, w * 4)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, w * 3, w * 3)? };
+        py.detach(|| {
+            for_each_band([out], [w * 3], w, h, |[out], rows| {
+                for (y_out, y) in rows.enumerate() {
+                    for x in 0..w {
+                        let i_in = y * stride + x * 4;
+                        let i_out = (y_out * w + x) * 3;
+                        let v = u32::from_ne_bytes([
+                            data[i_in],
+                            data[i_in + 1],
+                            data[i_in + 2],
+                            data[i_in + 3],
+                        ]);
+                        [out[i_out], out[i_out + 1], out[i_out + 2]] = [
+                            RGB30_TO_8[((v >> 20) & 0x3ff) as usize],
+                            RGB30_TO_8[((v >> 10) & 0x3ff) as usize],
+                            RGB30_TO_8[(v & 0x3ff) as usize],
+                        ];
+                    }
+                }
+            });
+        });
+        Ok(())
+    }
+
+    // cairo.Format.RGB96F --> "RGB"
+    #[pyfunction]
+    fn cairo_rgb96f_to_pil_rgb(
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
+        w: usize,
+        h: usize,
+        stride: usize,
+    ) -> PyResult<()> {
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, stride, w * 12)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, w * 3, w * 3)? };
+        py.detach(|| {
+            for_each_band([out], [w * 3], w, h, |[out], rows| {
+                for (y_out, y) in rows.enumerate() {
+                    let i_in = y * stride;
+                    cairo_rgb96f_to_pil_rgb_row(
+                        &data[i_in..i_in + w * 12],
+                        &mut out[y_out * w * 3..(y_out + 1) * w * 3],
+                    );
+                }
+            });
+        });
+        Ok(())
     }
 
     // cairo.Format.RGB128F --> "RGB"
     #[pyfunction]
     fn cairo_rgba128f_to_pil_rgba(
-        data: &[u8],
-        out: &Bound<'_, PyByteArray>,
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
         w: usize,
         h: usize,
         stride: usize,
-    ) {
-        let out: &mut [u8] = unsafe { out.as_bytes_mut() };
-        let mut i_out: usize = 0;
-        for y in 0..h {
-            for x in 0..w {
-                let i_in = y * stride + x * 16;
-                let mut r = f32::from_ne_bytes([
-                    data[i_in],
-                    data[i_in + 1],
-                    data[i_in + 2],
-                    data[i_in + 3],
-                ]);
-                let mut g = f32::from_ne_bytes([
-                    data[i_in + 4],
-                    data[i_in + 5],
-                    data[i_in + 6],
-                    data[i_in + 7],
-                ]);
-                let mut b = f32::from_ne_bytes([
-                    data[i_in + 8],
-                    data[i_in + 9],
-                    data[i_in + 10],
-                    data[i_in + 11],
-                ]);
-                let a = f32::from_ne_bytes([
-                    data[i_in + 12],
-                    data[i_in + 13],
-                    data[i_in + 14],
-                    data[i_in + 15],
-                ]);
-                r /= a;
-                g /= a;
-                b /= a;
-                [out[i_out], out[i_out + 1], out[i_out + 2], out[i_out + 3]] = [
-                    (r * 255.0) as u8,
-                    (g * 255.0) as u8,
-                    (b * 255.0) as u8,
-                    (a * 255.0) as u8,
-                ];
-                i_out += 4;
-            }
-        }
+    ) -> PyResult<()> {
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, stride, w * 16)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, w * 4, w * 4)? };
+        py.detach(|| {
+            for_each_band([out], [w * 4], w, h, |[out], rows| {
+                for (y_out, y) in rows.enumerate() {
+                    let i_in = y * stride;
+                    cairo_rgba128f_to_pil_rgba_row(
+                        &data[i_in..i_in + w * 16],
+                        &mut out[y_out * w * 4..(y_out + 1) * w * 4],
+                    );
+                }
+            });
+        });
+        Ok(())
+    }
+
+    // cairo.Format.RGB96F --> "RGB", encoded from linear light to sRGB and rounded to nearest
+    #[pyfunction]
+    fn cairo_rgb96f_to_pil_rgb_srgb(
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
+        w: usize,
+        h: usize,
+        stride: usize,
+    ) -> PyResult<()> {
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, stride, w * 12)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, w * 3, w * 3)? };
+        py.detach(|| {
+            let lut = &*LINEAR_TO_SRGB;
+            for_each_band([out], [w * 3], w, h, |[out], rows| {
+                for (y_out, y) in rows.enumerate() {
+                    let pixels = data[y * stride..y * stride + w * 12].chunks_exact(12);
+                    let row = &mut out[y_out * w * 3..(y_out + 1) * w * 3];
+                    for (p, o) in pixels.zip(row.chunks_exact_mut(3)) {
+                        for c in 0..3 {
+                            o[c] = (linear_to_srgb(lut, read_f32(&p[c * 4..])) + 0.5) as u8;
+                        }
+                    }
+                }
+            });
+        });
+        Ok(())
+    }
+
+    // cairo.Format.RGBA128F --> "RGBA", unpremultiplied in linear light, then encoded to sRGB.
+    // Rounds to nearest.
+    #[pyfunction]
+    fn cairo_rgba128f_to_pil_rgba_srgb(
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
+        w: usize,
+        h: usize,
+        stride: usize,
+    ) -> PyResult<()> {
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, stride, w * 16)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, w * 4, w * 4)? };
+        py.detach(|| {
+            let lut = &*LINEAR_TO_SRGB;
+            for_each_band([out], [w * 4], w, h, |[out], rows| {
+                for (y_out, y) in rows.enumerate() {
+                    let pixels = data[y * stride..y * stride + w * 16].chunks_exact(16);
+                    let row = &mut out[y_out * w * 4..(y_out + 1) * w * 4];
+                    for (p, o) in pixels.zip(row.chunks_exact_mut(4)) {
+                        let a = read_f32(&p[12..]);
+                        let scale = if a > 0.0 { 1.0 / a } else { 0.0 };
+                        for c in 0..3 {
+                            let v = read_f32(&p[c * 4..]) * scale;
+                            o[c] = (linear_to_srgb(lut, v) + 0.5) as u8;
+                        }
+                        o[3] = (a.clamp(0.0, 1.0) * 255.0 + 0.5) as u8;
+                    }
+                }
+            });
+        });
+        Ok(())
+    }
+
+    // cairo.Format.RGB30 --> "RGB", dithered
+    #[pyfunction]
+    fn cairo_rgb30_to_pil_rgb_dithered(
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
+        w: usize,
+        h: usize,
+        stride: usize,
+        dither: String,
+    ) -> PyResult<()> {
+        let dither = Dither::parse(&dither)?;
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, stride, w * 4)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, w * 3, w * 3)? };
+        py.detach(|| {
+            quantize_dithered(
+                dither,
+                out,
+                w * 3,
+                w,
+                h,
+                [255.0; 3],
+                |y, x| {
+                    let v = read_u32(&data[y * stride + x * 4..]);
+                    [20, 10, 0].map(|shift| ((v >> shift) & 0x3ff) as f32 * (255.0 / 1023.0))
+                },
+                |row, x, [r, g, b]| {
+                    row[x * 3..x * 3 + 3].copy_from_slice(&[r as u8, g as u8, b as u8])
+                },
+            );
+        });
+        Ok(())
+    }
+
+    // cairo.Format.RGB96F --> "RGB", dithered. With `srgb`, linear light is encoded to sRGB first.
+    #[pyfunction]
+    #[pyo3(signature = (data, out, w, h, stride, dither, srgb=false))]
+    fn cairo_rgb96f_to_pil_rgb_dithered(
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
+        w: usize,
+        h: usize,
+        stride: usize,
+        dither: String,
+        srgb: bool,
+    ) -> PyResult<()> {
+        let dither = Dither::parse(&dither)?;
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, stride, w * 12)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, w * 3, w * 3)? };
+        py.detach(|| {
+            let lut = &*LINEAR_TO_SRGB;
+            quantize_dithered(
+                dither,
+                out,
+                w * 3,
+                w,
+                h,
+                [255.0; 3],
+                |y, x| {
+                    let p = &data[y * stride + x * 12..];
+                    if srgb {
+                        [0, 4, 8].map(|i| linear_to_srgb(lut, read_f32(&p[i..])))
+                    } else {
+                        [0, 4, 8].map(|i| read_f32(&p[i..]) * 255.0)
+                    }
+                },
+                |row, x, [r, g, b]| {
+                    row[x * 3..x * 3 + 3].copy_from_slice(&[r as u8, g as u8, b as u8])
+                },
+            );
+        });
+        Ok(())
+    }
+
+    // cairo.Format.RGBA128F --> "RGBA", dithered. With `srgb`, colors are unpremultiplied in linear
+    // light and encoded to sRGB.
+    #[pyfunction]
+    #[pyo3(signature = (data, out, w, h, stride, dither, srgb=false))]
+    fn cairo_rgba128f_to_pil_rgba_dithered(
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
+        w: usize,
+        h: usize,
+        stride: usize,
+        dither: String,
+        srgb: bool,
+    ) -> PyResult<()> {
+        let dither = Dither::parse(&dither)?;
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, stride, w * 16)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, w * 4, w * 4)? };
+        py.detach(|| {
+            let lut = &*LINEAR_TO_SRGB;
+            quantize_dithered(
+                dither,
+                out,
+                w * 4,
+                w,
+                h,
+                [255.0; 4],
+                |y, x| {
+                    let p = &data[y * stride + x * 16..];
+                    let a = read_f32(&p[12..]);
+                    if srgb {
+                        let scale = if a > 0.0 { 1.0 / a } else { 0.0 };
+                        let [r, g, b] =
+                            [0, 4, 8].map(|i| linear_to_srgb(lut, read_f32(&p[i..]) * scale));
+                        return [r, g, b, a * 255.0];
+                    }
+                    let scale = if a == 0.0 { 0.0 } else { 255.0 / a };
+                    [
+                        read_f32(p) * scale,
+                        read_f32(&p[4..]) * scale,
+                        read_f32(&p[8..]) * scale,
+                        a * 255.0,
+                    ]
+                },
+                |row, x, levels| row[x * 4..x * 4 + 4].copy_from_slice(&levels.map(|v| v as u8)),
+            );
+        });
+        Ok(())
     }
 
     // cairo.Format.RGB30 --> "I" * 3
     #[pyfunction]
     fn cairo_rgb30_to_pil_i(
-        data: &[u8],
-        r: &Bound<'_, PyByteArray>,
-        g: &Bound<'_, PyByteArray>,
-        b: &Bound<'_, PyByteArray>,
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        r: &Bound<'_, PyAny>,
+        g: &Bound<'_, PyAny>,
+        b: &Bound<'_, PyAny>,
         w: usize,
         h: usize,
         stride: usize,
-    ) {
-        let r: &mut [u8] = unsafe { r.as_bytes_mut() };
-        let g: &mut [u8] = unsafe { g.as_bytes_mut() };
-        let b: &mut [u8] = unsafe { b.as_bytes_mut() };
-        let mut j: usize = 0;
-        for y in 0..h {
-            for x in 0..w {
-                let i = y * stride + x * 4;
-                let v = u32::from_ne_bytes([data[i], data[i + 1], data[i + 2], data[i + 3]]);
-                let r_v = ((v >> 20) as u64) * 0xffffffff / 0x3ff;
-                let g_v = (((v & 0xffc00) >> 10) as u64) * 0xffffffff / 0x3ff;
-                let b_v = ((v & 0x3ff) as u64) * 0xffffffff / 0x3ff;
-                [r[j], r[j + 1], r[j + 2], r[j + 3]] = (r_v as u32).to_ne_bytes();
-                [g[j], g[j + 1], g[j + 2], g[j + 3]] = (g_v as u32).to_ne_bytes();
-                [b[j], b[j + 1], b[j + 2], b[j + 3]] = (b_v as u32).to_ne_bytes();
-                j += 4;
-            }
-        }
+    ) -> PyResult<()> {
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, stride, w * 4)? };
+        let mut r = Buffer::new_mut(r)?;
+        let r = unsafe { r.as_rows_mut(h, w * 4, w * 4)? };
+        let mut g = Buffer::new_mut(g)?;
+        let g = unsafe { g.as_rows_mut(h, w * 4, w * 4)? };
+        let mut b = Buffer::new_mut(b)?;
+        let b = unsafe { b.as_rows_mut(h, w * 4, w * 4)? };
+        py.detach(|| {
+            for_each_band([r, g, b], [w * 4; 3], w, h, |[r, g, b], rows| {
+                for (y_out, y) in rows.enumerate() {
+                    for x in 0..w {
+                        let i = y * stride + x * 4;
+                        let j = (y_out * w + x) * 4;
+                        let v =
+                            u32::from_ne_bytes([data[i], data[i + 1], data[i + 2], data[i + 3]]);
+                        let r_v = RGB30_TO_32[((v >> 20) & 0x3ff) as usize];
+                        let g_v = RGB30_TO_32[((v >> 10) & 0x3ff) as usize];
+                        let b_v = RGB30_TO_32[(v & 0x3ff) as usize];
+                        [r[j], r[j + 1], r[j + 2], r[j + 3]] = r_v.to_ne_bytes();
+                        [g[j], g[j + 1], g[j + 2], g[j + 3]] = g_v.to_ne_bytes();
+                        [b[j], b[j + 1], b[j + 2], b[j + 3]] = b_v.to_ne_bytes();
+                    }
+                }
+            });
+        });
+        Ok(())
     }
 
     // cairo.Format.RGB96F --> "F" * 3
     #[pyfunction]
     fn cairo_rgb96f_to_pil_f(
-        data: &[u8],
-        r: &Bound<'_, PyByteArray>,
-        g: &Bound<'_, PyByteArray>,
-        b: &Bound<'_, PyByteArray>,
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        r: &Bound<'_, PyAny>,
+        g: &Bound<'_, PyAny>,
+        b: &Bound<'_, PyAny>,
         w: usize,
         h: usize,
         stride: usize,
-    ) {
-        let r: &mut [u8] = unsafe { r.as_bytes_mut() };
-        let g: &mut [u8] = unsafe { g.as_bytes_mut() };
-        let b: &mut [u8] = unsafe { b.as_bytes_mut() };
-        let mut j: usize = 0;
-        for y in 0..h {
-            for x in 0..w {
-                let i = y * stride + x * 12;
-                [r[j], r[j + 1], r[j + 2], r[j + 3]] =
-                    [data[i], data[i + 1], data[i + 2], data[i + 3]];
-                [g[j], g[j + 1], g[j + 2], g[j + 3]] =
-                    [data[i + 4], data[i + 5], data[i + 6], data[i + 7]];
-                [b[j], b[j + 1], b[j + 2], b[j + 3]] =
-                    [data[i + 8], data[i + 9], data[i + 10], data[i + 11]];
-                j += 4;
-            }
-        }
+    ) -> PyResult<()> {
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, stride, w * 12)? };
+        let mut r = Buffer::new_mut(r)?;
+        let r = unsafe { r.as_rows_mut(h, w * 4, w * 4)? };
+        let mut g = Buffer::new_mut(g)?;
+        let g = unsafe { g.as_rows_mut(h, w * 4, w * 4)? };
+        let mut b = Buffer::new_mut(b)?;
+        let b = unsafe { b.as_rows_mut(h, w * 4, w * 4)? };
+        py.detach(|| {
+            for_each_band([r, g, b], [w * 4; 3], w, h, |[r, g, b], rows| {
+                for (y_out, y) in rows.enumerate() {
+                    for x in 0..w {
+                        let i = y * stride + x * 12;
+                        let j = (y_out * w + x) * 4;
+                        [r[j], r[j + 1], r[j + 2], r[j + 3]] =
+                            [data[i], data[i + 1], data[i + 2], data[i + 3]];
+                        [g[j], g[j + 1], g[j + 2], g[j + 3]] =
+                            [data[i + 4], data[i + 5], data[i + 6], data[i + 7]];
+                        [b[j], b[j + 1], b[j + 2], b[j + 3]] =
+                            [data[i + 8], data[i + 9], data[i + 10], data[i + 11]];
+                    }
+                }
+            });
+        });
+        Ok(())
     }
 
     // cairo.Format.RGBA128F --> "F" * 4
     #[pyfunction]
     fn cairo_rgba128f_to_pil_f(
-        data: &[u8],
-        r: &Bound<'_, PyByteArray>,
-        g: &Bound<'_, PyByteArray>,
-        b: &Bound<'_, PyByteArray>,
-        a: &Bound<'_, PyByteArray>,
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        r: &Bound<'_, PyAny>,
+        g: &Bound<'_, PyAny>,
+        b: &Bound<'_, PyAny>,
+        a: &Bound<'_, PyAny>,
         w: usize,
         h: usize,
         stride: usize,
+    ) -> PyResult<()> {
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, stride, w * 16)? };
+        let mut r = Buffer::new_mut(r)?;
+        let r = unsafe { r.as_rows_mut(h, w * 4, w * 4)? };
+        let mut g = Buffer::new_mut(g)?;
+        let g = unsafe { g.as_rows_mut(h, w * 4, w * 4)? };
+        let mut b = Buffer::new_mut(b)?;
+        let b = unsafe { b.as_rows_mut(h, w * 4, w * 4)? };
+        let mut a = Buffer::new_mut(a)?;
+        let a = unsafe { a.as_rows_mut(h, w * 4, w * 4)? };
+        py.detach(|| {
+            for_each_band([r, g, b, a], [w * 4; 4], w, h, |[r, g, b, a], rows| {
+                for (y_out, y) in rows.enumerate() {
+                    let i_in = y * stride;
+                    let j = y_out * w * 4..(y_out + 1) * w * 4;
+                    cairo_rgba128f_to_pil_f_row(
+                        &data[i_in..i_in + w * 16],
+                        &mut r[j.clone()],
+                        &mut g[j.clone()],
+                        &mut b[j.clone()],
+                        &mut a[j],
+                    );
+                }
+            });
+        });
+        Ok(())
+    }
+
+    // cairo.Format.RGBA128F --> interleaved float32 RGBA
+    #[pyfunction]
+    fn cairo_rgba128f_to_rgbaf(
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
+        w: usize,
+        h: usize,
+        stride: usize,
+    ) -> PyResult<()> {
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, stride, w * 16)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, w * 16, w * 16)? };
+        py.detach(|| {
+            for_each_band([out], [w * 16], w, h, |[out], rows| {
+                for (y_out, y) in rows.enumerate() {
+                    let i_in = y * stride;
+                    cairo_rgba128f_to_rgbaf_row(
+                        &data[i_in..i_in + w * 16],
+                        &mut out[y_out * w * 16..(y_out + 1) * w * 16],
+                    );
+                }
+            });
+        });
+        Ok(())
+    }
+
+    // Add each byte of the `bpp` byte pixels of `row` to the sum of the block of `factor` pixels
+    // it falls in.
+    #[inline(always)]
+    fn add_blocks(row: &[u8], sums: &mut [u32], bpp: usize, factor: usize) {
+        for (block, sums) in row.chunks(factor * bpp).zip(sums.chunks_exact_mut(bpp)) {
+            for p in block.chunks_exact(bpp) {
+                for (s, &c) in sums.iter_mut().zip(p) {
+                    *s += c as u32;
+                }
+            }
+        }
+    }
+
+    // Write the averages of the sums of blocks `block_h` rows high, rounded to nearest. The last
+    // block of a row is cut short by the `w` pixels of the image.
+    #[inline(always)]
+    fn write_block_averages(
+        sums: &[u32],
+        out: &mut [u8],
+        bpp: usize,
+        factor: usize,
+        w: usize,
+        block_h: usize,
     ) {
-        let r: &mut [u8] = unsafe { r.as_bytes_mut() };
-        let g: &mut [u8] = unsafe { g.as_bytes_mut() };
-        let b: &mut [u8] = unsafe { b.as_bytes_mut() };
-        let a: &mut [u8] = unsafe { a.as_bytes_mut() };
-        let mut j: usize = 0;
-        for y in 0..h {
-            for x in 0..w {
-                let i = y * stride + x * 16;
-                let mut r_v = f32::from_ne_bytes([data[i], data[i + 1], data[i + 2], data[i + 3]]);
-                let mut g_v =
-                    f32::from_ne_bytes([data[i + 4], data[i + 5], data[i + 6], data[i + 7]]);
-                let mut b_v =
-                    f32::from_ne_bytes([data[i + 8], data[i + 9], data[i + 10], data[i + 11]]);
-                let a_v =
-                    f32::from_ne_bytes([data[i + 12], data[i + 13], data[i + 14], data[i + 15]]);
-                r_v = if a_v == 0.0 { 0.0 } else { r_v / a_v };
-                g_v = if a_v == 0.0 { 0.0 } else { g_v / a_v };
-                b_v = if a_v == 0.0 { 0.0 } else { b_v / a_v };
-                [r[j], r[j + 1], r[j + 2], r[j + 3]] = r_v.to_ne_bytes();
-                [g[j], g[j + 1], g[j + 2], g[j + 3]] = g_v.to_ne_bytes();
-                [b[j], b[j + 1], b[j + 2], b[j + 3]] = b_v.to_ne_bytes();
-                [a[j], a[j + 1], a[j + 2], a[j + 3]] = a_v.to_ne_bytes();
-                j += 4;
+        for (x, (o, sums)) in out
+            .chunks_exact_mut(bpp)
+            .zip(sums.chunks_exact(bpp))
+            .enumerate()
+        {
+            let n = (((x + 1) * factor).min(w) - x * factor) * block_h;
+            let n = n as u32;
+            for (o, &s) in o.iter_mut().zip(sums) {
+                *o = ((s + n / 2) / n) as u8;
+            }
+        }
+    }
+
+    // Shrink `bpp` byte pixels by `factor` in both directions, averaging each byte over blocks of
+    // `factor` x `factor` pixels like `Image.reduce` does. Blocks on the right and bottom edges are
+    // averaged over the pixels the image has. Premultiplied ARGB32 can be reduced this way, the
+    // averages of premultiplied colors are the premultiplied averages.
+    #[pyfunction]
+    fn reduce_u8(
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
+        w: usize,
+        h: usize,
+        stride: usize,
+        out_stride: usize,
+        bpp: usize,
+        factor: usize,
+    ) -> PyResult<()> {
+        if factor == 0 {
+            return Err(PyValueError::new_err("Reduce must be positive"));
+        }
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, stride, w * bpp)? };
+        let out_w = w.div_ceil(factor);
+        let out_h = h.div_ceil(factor);
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(out_h, out_stride, out_w * bpp)? };
+        py.detach(|| {
+            for_each_band([out], [out_stride], out_w, out_h, |[out], rows| {
+                let mut sums = vec![0; out_w * bpp];
+                for (y_out, y) in rows.enumerate() {
+                    sums.fill(0);
+                    let ys = y * factor..((y + 1) * factor).min(h);
+                    let block_h = ys.len();
+                    for y_in in ys {
+                        add_blocks(
+                            &data[y_in * stride..y_in * stride + w * bpp],
+                            &mut sums,
+                            bpp,
+                            factor,
+                        );
+                    }
+                    let i_out = y_out * out_stride;
+                    let out_row = &mut out[i_out..i_out + out_w * bpp];
+                    write_block_averages(&sums, out_row, bpp, factor, w, block_h);
+                }
+            });
+        });
+        Ok(())
+    }
+
+    // "RGBA" --> cairo.Format.ARGB32 shrunk by `factor`, the same as `pil_rgba_to_cairo_argb32`
+    // followed by `reduce_u8` but in one pass over the pixels.
+    #[pyfunction]
+    fn pil_rgba_to_cairo_argb32_reduced(
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
+        w: usize,
+        h: usize,
+        stride: usize,
+        factor: usize,
+        nearest: bool,
+    ) -> PyResult<()> {
+        if factor == 0 {
+            return Err(PyValueError::new_err("Reduce must be positive"));
+        }
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, w * 4, w * 4)? };
+        let out_w = w.div_ceil(factor);
+        let out_h = h.div_ceil(factor);
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(out_h, stride, out_w * 4)? };
+        py.detach(|| {
+            for_each_band([out], [stride], out_w, out_h, |[out], rows| {
+                let mut sums = vec![0; out_w * 4];
+                let mut row = vec![0; w * 4];
+                for (y_out, y) in rows.enumerate() {
+                    sums.fill(0);
+                    let ys = y * factor..((y + 1) * factor).min(h);
+                    let block_h = ys.len();
+                    for y_in in ys {
+                        row.copy_from_slice(&data[y_in * w * 4..(y_in + 1) * w * 4]);
+                        pil_rgba_to_cairo_argb32_row(&mut row, nearest);
+                        add_blocks(&row, &mut sums, 4, factor);
+                    }
+                    let out_row = &mut out[y_out * stride..y_out * stride + out_w * 4];
+                    write_block_averages(&sums, out_row, 4, factor, w, block_h);
+                }
+            });
+        });
+        Ok(())
+    }
+
+    #[inline(always)]
+    fn paeth(a: u8, b: u8, c: u8) -> u8 {
+        let p = a as i16 + b as i16 - c as i16;
+        let pa = (p - a as i16).abs();
+        let pb = (p - b as i16).abs();
+        let pc = (p - c as i16).abs();
+        if pa <= pb && pa <= pc {
+            a
+        } else if pb <= pc {
+            b
+        } else {
+            c
+        }
+    }
+
+    // Filter `line` with each of the five PNG filters and keep the one whose bytes, read as
+    // signed, have the smallest sum of absolute values, the heuristic libpng and Pillow use.
+    // `out` is the filter type byte followed by the filtered row.
+    fn png_filter_row(line: &[u8], above: &[u8], bpp: usize, out: &mut [u8], scratch: &mut [u8]) {
+        let (kind, best) = out.split_first_mut().unwrap();
+        let mut best_sum = u64::MAX;
+        for filter in 0..5 {
+            let mut sum = 0;
+            for i in 0..line.len() {
+                let a = if i >= bpp { line[i - bpp] } else { 0 };
+                let b = above[i];
+                let c = if i >= bpp { above[i - bpp] } else { 0 };
+                let predicted = match filter {
+                    0 => 0,
+                    1 => a,
+                    2 => b,
+                    3 => ((a as u16 + b as u16) / 2) as u8,
+                    _ => paeth(a, b, c),
+                };
+                let v = line[i].wrapping_sub(predicted);
+                scratch[i] = v;
+                sum += (v as i8).unsigned_abs() as u64;
+            }
+            if sum < best_sum {
+                best_sum = sum;
+                *kind = filter;
+                best.copy_from_slice(scratch);
+            }
+        }
+    }
+
+    // Packed rows of `bpp` byte pixels --> PNG scanlines, ready for zlib. `above` is the row
+    // before the first one, zeros at the top of the image, so an image can be filtered a band
+    // at a time.
+    #[pyfunction]
+    fn png_filter(
+        py: Python<'_>,
+        data: &Bound<'_, PyAny>,
+        above: &Bound<'_, PyAny>,
+        out: &Bound<'_, PyAny>,
+        w: usize,
+        h: usize,
+        bpp: usize,
+    ) -> PyResult<()> {
+        let row = w * bpp;
+        let data = Buffer::new(data)?;
+        let data = unsafe { data.as_rows(h, row, row)? };
+        let above = Buffer::new(above)?;
+        let above = unsafe { above.as_rows(1, row, row)? };
+        let mut out = Buffer::new_mut(out)?;
+        let out = unsafe { out.as_rows_mut(h, row + 1, row + 1)? };
+        py.detach(|| {
+            for_each_band([out], [row + 1], w, h, |[out], rows| {
+                let mut scratch = vec![0; row];
+                for (y_out, y) in rows.enumerate() {
+                    let prev = match y {
+                        0 => &above[..row],
+                        _ => &data[(y - 1) * row..y * row],
+                    };
+                    png_filter_row(
+                        &data[y * row..(y + 1) * row],
+                        prev,
+                        bpp,
+                        &mut out[y_out * (row + 1)..(y_out + 1) * (row + 1)],
+                        &mut scratch,
+                    );
+                }
+            });
+        });
+        Ok(())
+    }
+
+    static CREATE_FOR_DATA: PyOnceLock<Py<PyAny>> = PyOnceLock::new();
+
+    // Copy rows of `row` bytes packed in `data` into `out`, `stride` bytes apart.
+    fn copy_rows(data: &[u8], out: &mut [u8], row: usize, stride: usize) {
+        if row == 0 {
+            return;
+        }
+        for (src, dst) in data.chunks_exact(row).zip(out.chunks_exact_mut(stride)) {
+            dst[..row].copy_from_slice(src);
+        }
+    }
+
+    // The kernels `convert` can run. The Python wrappers look the format and mode up in their
+    // own tables and pass one of these, so a bad entry is a TypeError before any work is done.
+    #[pyclass(frozen, eq, eq_int)]
+    #[derive(Clone, Copy, PartialEq, Eq)]
+    enum Kernel {
+        PilLToCairoA8,
+        Pil1ToCairoA1,
+        PilRgbToCairoRgb24,
+        PilRgbxToCairoRgb24,
+        PilRgbaToCairoArgb32,
+        PilRgbaPremultipliedToCairoArgb32,
+        PilLaToCairoArgb32,
+        PilLaPremultipliedToCairoArgb32,
+        PilRgbToCairoRgb16,
+        PilRgbToCairoRgb30,
+        PilI16ToCairoRgb30,
+        PilRgbToCairoRgb96f,
+        PilI16ToCairoRgb96f,
+        PilRgbaToCairoRgba128f,
+    }
+
+    impl Kernel {
+        // The mode the kernel reads, and the bits per pixel of its input and output.
+        fn layout(self) -> (&'static str, usize, usize) {
+            match self {
+                Self::PilLToCairoA8 => ("L", 8, 8),
+                Self::Pil1ToCairoA1 => ("1", 1, 1),
+                Self::PilRgbToCairoRgb24 => ("RGB", 24, 32),
+                Self::PilRgbxToCairoRgb24 => ("RGBX", 32, 32),
+                Self::PilRgbaToCairoArgb32 => ("RGBA", 32, 32),
+                Self::PilRgbaPremultipliedToCairoArgb32 => ("RGBa", 32, 32),
+                Self::PilLaToCairoArgb32 => ("LA", 16, 32),
+                Self::PilLaPremultipliedToCairoArgb32 => ("La", 16, 32),
+                Self::PilRgbToCairoRgb16 => ("RGB", 24, 16),
+                Self::PilRgbToCairoRgb30 => ("RGB", 24, 32),
+                Self::PilI16ToCairoRgb30 => ("I;16", 16, 32),
+                Self::PilRgbToCairoRgb96f => ("RGB", 24, 96),
+                Self::PilI16ToCairoRgb96f => ("I;16", 16, 96),
+                Self::PilRgbaToCairoRgba128f => ("RGBA", 32, 128),
+            }
+        }
+    }
+
+    // PIL.Image --> cairo.ImageSurface in a single call. The size checks, the surface allocation
+    // and the kernel happen here instead of in a chain of Python calls, which for icon sized
+    // images cost more than the pixels do. Everything is checked before `tobytes()` and the
+    // surface memory are allocated.
+    #[pyfunction]
+    fn convert<'py>(
+        py: Python<'py>,
+        obj: &Bound<'py, PyAny>,
+        target: &Bound<'py, PyAny>,
+        kernel: &Bound<'py, Kernel>,
+    ) -> PyResult<Bound<'py, PyAny>> {
+        let kernel = *kernel.get();
+        let (mode, mode_bits, bits_per_pixel) = kernel.layout();
+        if obj.getattr("mode")?.extract::<String>()? != mode {
+            return Err(PyValueError::new_err("Wrong mode"));
+        }
+        let (w, h): (usize, usize) = obj.getattr("size")?.extract()?;
+        let row = (w * mode_bits).div_ceil(8);
+        // What `cairo_format_stride_for_width` returns: whole bytes, rounded up to 4.
+        let stride = (w * bits_per_pixel).div_ceil(8).next_multiple_of(4);
+        let len = stride
+            .checked_mul(h)
+            .ok_or_else(|| PyValueError::new_err("Image too large"))?;
+        let data = obj.call_method0("tobytes")?;
+        if data.len()? != row * h {
+            return Err(PyValueError::new_err("Size mismatch"));
+        }
+        let out = PyByteArray::new_with(py, len, |_| Ok(()))?;
+        let out_any = out.as_any();
+        match kernel {
+            Kernel::PilLToCairoA8 | Kernel::PilRgbxToCairoRgb24 | Kernel::PilRgbaToCairoArgb32 => {
+                // A plain copy, then the in place kernels.
+                let src = Buffer::new(&data)?;
+                copy_rows(
+                    unsafe { src.as_slice() },
+                    unsafe { out.as_bytes_mut() },
+                    row,
+                    stride,
+                );
+                match kernel {
+                    Kernel::PilRgbxToCairoRgb24 => {
+                        pil_rgbx_to_cairo_rgb24(py, out_any, w, h, stride)?
+                    }
+                    Kernel::PilRgbaToCairoArgb32 => {
+                        pil_rgba_to_cairo_argb32(py, out_any, w, h, stride, true)?
+                    }
+                    _ => {}
+                }
+            }
+            Kernel::PilRgbaPremultipliedToCairoArgb32 => {
+                pil_rgba_premultiplied_to_cairo_argb32(py, &data, out_any, w, h, stride)?
+            }
+            Kernel::PilLaToCairoArgb32 => {
+                pil_la_to_cairo_argb32(py, &data, out_any, w, h, stride, false, true)?
+            }
+            Kernel::PilLaPremultipliedToCairoArgb32 => {
+                pil_la_to_cairo_argb32(py, &data, out_any, w, h, stride, true, true)?
+            }
+            Kernel::PilRgbToCairoRgb24 => pil_rgb_to_cairo_rgb24(py, &data, out_any, w, h, stride)?,
+            Kernel::Pil1ToCairoA1 => pil_1_to_cairo_a1(py, &data, out_any, w, h, stride)?,
+            Kernel::PilRgbToCairoRgb16 => {
+                pil_rgb_to_cairo_rgb16(py, &data, out_any, w, h, stride, 3)?
+            }
+            Kernel::PilRgbToCairoRgb30 => {
+                pil_rgb_to_cairo_rgb30(py, &data, out_any, w, h, stride, 3)?
+            }
+            Kernel::PilI16ToCairoRgb30 => pil_i16_to_cairo_rgb30(py, &data, out_any, w, h, stride)?,
+            Kernel::PilRgbToCairoRgb96f => {
+                pil_rgb_to_cairo_rgb96f(py, &data, out_any, w, h, stride, 3)?
+            }
+            Kernel::PilI16ToCairoRgb96f => {
+                pil_i16_to_cairo_rgb96f(py, &data, out_any, w, h, stride)?
+            }
+            Kernel::PilRgbaToCairoRgba128f => {
+                pil_rgba_to_cairo_rgba128f(py, &data, out_any, w, h, stride)?
             }
         }
+        let create = CREATE_FOR_DATA.get_or_try_init(py, || {
+            let surface = py.import("cairo")?.getattr("ImageSurface")?;
+            Ok::<_, PyErr>(surface.getattr("create_for_data")?.unbind())
+        })?;
+        create.bind(py).call1((out, target, w, h, stride))
     }
 }
@@ -1,284 +1,1384 @@
+import math
+import os
+import struct
+import sys
+import zlib
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from pickle import PickleBuffer
+from typing import IO, TYPE_CHECKING, Any, Literal, TypeVar, overload
+
 import cairo
 from PIL import Image
 
-from pil_cairo._core import a1_swap as _a1_swap
-from pil_cairo._core import cairo_rgb30_to_pil_bgrx as _cario_rgb30_to_pil_bgrx
+from pil_cairo import _profile
+from pil_cairo._core import cairo_argb32_to_pil_rgba as _cairo_argb32_to_pil_rgba
 from pil_cairo._core import cairo_rgb30_to_pil_i as _cairo_rgb30_to_pil_i
+from pil_cairo._core import cairo_rgb30_to_pil_rgb as _cairo_rgb30_to_pil_rgb
 from pil_cairo._core import cairo_rgb96f_to_pil_f as _cairo_rgb96f_to_pil_f
 from pil_cairo._core import cairo_rgb96f_to_pil_rgb as _cairo_rgb96f_to_pil_rgb
 from pil_cairo._core import cairo_rgba128f_to_pil_f as _cairo_rgba128f_to_pil_f
 from pil_cairo._core import cairo_rgba128f_to_pil_rgba as _cairo_rgba128f_to_pil_rgba
+from pil_cairo._core import cairo_rgba128f_to_rgbaf as _cairo_rgba128f_to_rgbaf
+from pil_cairo._core import convert as _convert
+from pil_cairo._core import get_threads, set_threads
 from pil_cairo._core import pil_f_to_cairo_rgb96f as _pil_f_to_cairo_rgb96f
 from pil_cairo._core import pil_f_to_cairo_rgba128f as _pil_f_to_cairo_rgba128f
 from pil_cairo._core import pil_i_to_cairo_rgb30 as _pil_i_to_cairo_rgb30
 from pil_cairo._core import pil_rgb_to_cairo_rgb16 as _pil_rgb_to_cairo_rgb16
+from pil_cairo._core import pil_rgb_to_cairo_rgb24 as _pil_rgb_to_cairo_rgb24
 from pil_cairo._core import pil_rgb_to_cairo_rgb30 as _pil_rgb_to_cairo_rgb30
 from pil_cairo._core import pil_rgb_to_cairo_rgb96f as _pil_rgb_to_cairo_rgb96f
+from pil_cairo._core import pil_rgba_to_cairo_argb32 as _pil_rgba_to_cairo_argb32
+from pil_cairo._core import (
+    pil_rgba_to_cairo_argb32_reduced as _pil_rgba_to_cairo_argb32_reduced,
+)
 from pil_cairo._core import pil_rgba_to_cairo_rgba128f as _pil_rgba_to_cairo_rgba128f
+from pil_cairo._core import png_filter as _png_filter
+from pil_cairo._core import reduce_u8 as _reduce_u8
+from pil_cairo._core import rgbaf_to_cairo_rgba128f as _rgbaf_to_cairo_rgba128f
+from pil_cairo._pixels import (
+    _BITS_PER_PIXEL,
+    _CONVERT,
+    _DITHERED_PIL_KERNELS,
+    _EXTRA_MODES,
+    _FORMATS,
+    _MODES,
+    _PLANE_MODES,
+    RGB30,
+    RGB96F,
+    RGBA128F,
+    Dither,
+    Rounding,
+    Transfer,
+    _acquire,
+    _Buffer,
+    _check_dither,
+    _check_planes,
+    _check_rounding,
+    _check_transfer,
+    _convert_pil,
+    _decode_pil,
+    _rawmode,
+    _size,
+    _write_cairo,
+)
+from pil_cairo._pool import BufferPool
+from pil_cairo._profile import ProfileHook, get_profile_hook, profiled, set_profile_hook
+
+if TYPE_CHECKING:
+    import numpy as np
 
 __all__ = [
     "RGB30",
     "RGB96F",
     "RGBA128F",
+    "ArrayLayout",
+    "BufferPool",
+    "Dither",
+    "ProfileHook",
+    "Rounding",
+    "SurfaceImage",
+    "Transfer",
+    "array_to_cairo",
+    "cairo_to_array",
+    "convert_many",
+    "frames_to_cairo",
+    "get_profile_hook",
+    "get_threads",
+    "iter_to_cairo_tiles",
+    "load_surface",
+    "save_surface",
+    "set_profile_hook",
+    "set_threads",
+    "surfaces_to_frames",
     "to_cairo",
+    "to_cairo_into",
     "to_cairo_rgb16",
     "to_cairo_rgb30",
     "to_cairo_rgb96f",
     "to_cairo_rgba128f",
     "to_pil",
+    "to_pil_into",
+    "to_pil_many",
     "to_pil_rgb30",
     "to_pil_rgb96f",
     "to_pil_rgba128f",
+    "to_pil_rows",
 ]
-RGB30 = tuple[Image.Image, Image.Image, Image.Image]
-RGB96F = tuple[Image.Image, Image.Image, Image.Image]
-RGBA128F = tuple[Image.Image, Image.Image, Image.Image, Image.Image]
+_T = TypeVar("_T")
+_R = TypeVar("_R")
+_Box = tuple[int, int, int, int]
+ArrayLayout = Literal["HWC", "CHW"]
 
+# Formats of whole bytes per channel, which `_reduce_u8` averages as they are.
+_REDUCE_FORMATS = {cairo.Format.A8, cairo.Format.RGB24, cairo.Format.ARGB32}
+_PLANE_PIL_KERNELS = {
+    cairo.Format.RGB30: _cairo_rgb30_to_pil_i,
+    cairo.Format.RGB96F: _cairo_rgb96f_to_pil_f,
+    cairo.Format.RGBA128F: _cairo_rgba128f_to_pil_f,
+}
 
-def to_cairo(im: Image.Image) -> cairo.ImageSurface:
-    w, h = im.size
-    if im.mode == "1":
-        stride = cairo.Format.A1.stride_for_width(w)
-        data = bytearray(im.tobytes("raw", "1", stride))
-        _a1_swap(data, w, h, stride)
-        return cairo.ImageSurface.create_for_data(
-            data,
-            cairo.Format.A1,
-            w,
-            h,
-            stride,
-        )
-    if im.mode == "L":
-        stride = cairo.Format.A8.stride_for_width(w)
-        data = bytearray(im.tobytes("raw", "L", stride))
-        return cairo.ImageSurface.create_for_data(
-            data,
-            cairo.Format.A8,
-            w,
-            h,
-            stride,
-        )
-    if im.mode == "RGB":
-        stride = cairo.Format.RGB24.stride_for_width(w)
-        data = bytearray(im.tobytes("raw", "BGRX", stride))
-        return cairo.ImageSurface.create_for_data(
-            data,
-            cairo.Format.RGB24,
-            w,
-            h,
-            stride,
-        )
-    if im.mode == "RGBA":
-        stride = cairo.Format.ARGB32.stride_for_width(w)
-        data = bytearray(im.tobytes("raw", "BGRa", stride))
-        return cairo.ImageSurface.create_for_data(
-            data,
-            cairo.Format.ARGB32,
-            w,
-            h,
-            stride,
-        )
-    raise NotImplementedError(f"Unsupported mode: {im.mode}")
 
+def _check_box(box: _Box | None, w: int, h: int) -> _Box:
+    if box is None:
+        return 0, 0, w, h
+    x0, y0, x1, y1 = box
+    if not (0 <= x0 < x1 <= w and 0 <= y0 < y1 <= h):
+        raise ValueError("Box out of bounds")
+    return x0, y0, x1, y1
 
-def to_cairo_rgb16(im: Image.Image) -> cairo.ImageSurface:
-    if im.mode != "RGB":
-        raise ValueError("Wrong mode")
-    data = im.tobytes()
-    w, h = im.size
-    stride = cairo.Format.RGB16_565.stride_for_width(w)
-    out_data = bytearray(stride * h)
-    _pil_rgb_to_cairo_rgb16(data, out_data, w, h, stride)
-    return cairo.ImageSurface.create_for_data(
-        out_data,
-        cairo.Format.RGB16_565,
-        w,
-        h,
-        stride,
+
+def _crop(
+    im: Image.Image | RGB30 | RGBA128F,
+    box: _Box | None,
+) -> Image.Image | RGB30 | RGBA128F:
+    if box is None:
+        return im
+    box = _check_box(box, *_size(im))
+    if isinstance(im, Image.Image):
+        return im.crop(box)
+    return tuple(plane.crop(box) for plane in im)  # type: ignore[return-value]
+
+
+def _region(
+    data: memoryview, surface_format: cairo.Format, stride: int, box: _Box
+) -> memoryview:
+    # The surface memory from the first pixel of `box` to its last one, rows still
+    # `stride` bytes apart, so the kernels can walk just the box. An A1 box must start
+    # on a byte boundary.
+    x0, y0, x1, y1 = box
+    bits = _BITS_PER_PIXEL[surface_format]
+    return data[y0 * stride + x0 * bits // 8 : (y1 - 1) * stride + (x1 * bits + 7) // 8]
+
+
+# dtype of the items of a buffer, by struct format character.
+_ARRAY_DTYPES = {"B": "uint8", "f": "float32", "I": "uint32", "L": "uint32"}
+_ITEMSIZES = {"uint8": 1, "uint16": 2, "float32": 4, "uint32": 4}
+
+
+def _array_view(arr: Any) -> tuple[memoryview, str, memoryview]:
+    # The view for the shape, the dtype and the raw bytes. `memoryview.cast` refuses
+    # formats with an explicit byte order like "<f", the raw view of a contiguous buffer
+    # has none.
+    view = memoryview(arr)
+    if not view.c_contiguous:
+        raise ValueError("Array must be C-contiguous")
+    code = view.format.lstrip("@=" + ("<" if sys.byteorder == "little" else ">"))
+    dtype = _ARRAY_DTYPES.get(code)
+    if dtype is None or view.itemsize != _ITEMSIZES[dtype]:
+        raise NotImplementedError(f"Unsupported dtype: {view.format}")
+    return view, dtype, PickleBuffer(view).raw()
+
+
+def _copy_rows(
+    data: memoryview,
+    out: memoryview,
+    row: int,
+    h: int,
+    data_stride: int,
+    out_stride: int,
+) -> None:
+    if row == data_stride == out_stride:
+        out[: row * h] = data[: row * h]
+        return
+    for y in range(h):
+        out[y * out_stride : y * out_stride + row] = data[
+            y * data_stride : y * data_stride + row
+        ]
+
+
+def _write_rgb96f(
+    data: memoryview, out: memoryview, w: int, h: int, stride: int
+) -> None:
+    _copy_rows(data, out, w * 12, h, w * 12, stride)
+
+
+def _read_rgb96f(
+    data: memoryview, out: memoryview, w: int, h: int, stride: int
+) -> None:
+    _copy_rows(data, out, w * 12, h, stride, w * 12)
+
+
+# Float formats that can also be converted from/to one interleaved float32 buffer of
+# straight (not premultiplied) colors. RGB96F already is one, so it is copied row by
+# row.
+_INTERLEAVED_CAIRO_KERNELS: dict[
+    cairo.Format, Callable[[Any, Any, int, int, int], None]
+] = {
+    cairo.Format.RGB96F: _write_rgb96f,
+    cairo.Format.RGBA128F: _rgbaf_to_cairo_rgba128f,
+}
+_INTERLEAVED_PIL_KERNELS: dict[
+    cairo.Format, Callable[[Any, Any, int, int, int], None]
+] = {
+    cairo.Format.RGB96F: _read_rgb96f,
+    cairo.Format.RGBA128F: _cairo_rgba128f_to_rgbaf,
+}
+
+
+def _check_reduce(reduce: int) -> None:
+    if reduce < 1:
+        raise ValueError("Reduce must be positive")
+
+
+def _reduce_image(im: Image.Image, factor: int) -> Image.Image:
+    if im.mode in ("1", "P", "I;16"):
+        # Image.reduce can't average these, and averaging bits or palette indices is
+        # meaningless anyway, pick one pixel of each block instead.
+        size = (-(-im.width // factor), -(-im.height // factor))
+        return im.resize(size, Image.Resampling.NEAREST)
+    return im.reduce(factor)
+
+
+def _new_surface(
+    im: Image.Image | RGB30 | RGBA128F,
+    surface_format: cairo.Format,
+    pool: BufferPool | None,
+    rounding: Rounding = "pillow",
+    box: _Box | None = None,
+    dither: Dither | None = None,
+    reduce: int = 1,
+    transfer: Transfer | None = None,
+) -> cairo.ImageSurface:
+    if (
+        isinstance(im, Image.Image)
+        and (surface_format, im.mode) in _CONVERT
+        and pool is None
+        and box is None
+        and reduce == 1
+        and rounding == "pillow"
+        and dither is None
+        and transfer is None
+    ):
+        kernel, max_pixels = _CONVERT[surface_format, im.mode]
+        if im.width * im.height <= max_pixels:
+            # The plain cases are checked, allocated and converted by the extension in
+            # one call.
+            start = _profile.clock()
+            surface = _convert(im, surface_format, kernel)
+            _profile.lap("kernel", start)
+            return surface
+    _check_reduce(reduce)
+    im = _crop(im, box)
+    if reduce != 1 and isinstance(im, Image.Image):
+        if im.mode == "RGBA" and surface_format == cairo.Format.ARGB32:
+            return _new_reduced_argb32(im, pool, rounding, reduce)
+        im = _reduce_image(im, reduce)
+    elif reduce != 1:
+        im = tuple(plane.reduce(reduce) for plane in im)  # type: ignore[assignment]
+    w, h = _size(im)
+    start = _profile.clock()
+    if pool is not None:
+        surface = pool.acquire_surface(surface_format, w, h)
+        _profile.lap("surface", start)
+        try:
+            to_cairo_into(
+                im, surface, rounding, dither=dither, transfer=transfer, pool=pool
+            )
+        except BaseException:
+            pool.release_surface(surface)
+            raise
+        return surface
+    stride = surface_format.stride_for_width(w)
+    data = bytearray(stride * h)
+    _profile.lap("surface", start)
+    _write_cairo(
+        im, data, surface_format, stride, rounding, dither=dither, transfer=transfer
     )
+    start = _profile.clock()
+    surface = cairo.ImageSurface.create_for_data(data, surface_format, w, h, stride)
+    _profile.lap("surface", start)
+    return surface
 
 
-def to_cairo_rgb30(im: Image.Image | RGB30) -> cairo.ImageSurface:
-    if isinstance(im, Image.Image):
-        if im.mode != "RGB":
-            raise ValueError("Wrong mode")
-        data = im.tobytes()
-        w, h = im.size
-        stride = cairo.Format.RGB30.stride_for_width(w)
-        out_data = bytearray(stride * h)
-        _pil_rgb_to_cairo_rgb30(data, out_data, w, h, stride)
-        return cairo.ImageSurface.create_for_data(
-            out_data,
-            cairo.Format.RGB30,
-            w,
-            h,
-            stride,
+def _new_reduced_argb32(
+    im: Image.Image,
+    pool: BufferPool | None,
+    rounding: Rounding,
+    factor: int,
+) -> cairo.ImageSurface:
+    # Premultiply and average "RGBA" in one pass, only the reduced pixels are written.
+    _check_rounding(rounding)
+    surface_format = cairo.Format.ARGB32
+    w = -(-im.width // factor)
+    h = -(-im.height // factor)
+    start = _profile.clock()
+    if pool is not None:
+        surface = pool.acquire_surface(surface_format, w, h)
+    else:
+        stride = surface_format.stride_for_width(w)
+        data = bytearray(stride * h)
+        surface = cairo.ImageSurface.create_for_data(data, surface_format, w, h, stride)
+    start = _profile.lap("surface", start)
+    try:
+        pixels = im.tobytes()
+        start = _profile.lap("copy", start)
+        surface.flush()
+        _pil_rgba_to_cairo_argb32_reduced(
+            pixels,
+            surface.get_data(),
+            im.width,
+            im.height,
+            surface.get_stride(),
+            factor,
+            rounding != "truncate",
         )
+        _profile.lap("kernel", start)
+    except BaseException:
+        if pool is not None:
+            pool.release_surface(surface)
+        raise
+    surface.mark_dirty()
+    return surface
 
-    im0, im1, im2 = im
-    if not (im0.mode == im1.mode == im2.mode == "I"):
-        raise ValueError("Wrong mode")
-    if not (im0.size == im1.size == im2.size):
-        raise ValueError("Size mismatch")
-    data0 = im0.tobytes()
-    data1 = im1.tobytes()
-    data2 = im2.tobytes()
-    w, h = im0.size
-    stride = cairo.Format.RGB30.stride_for_width(w)
-    out_data = bytearray(stride * h)
-    _pil_i_to_cairo_rgb30(data0, data1, data2, out_data, w, h, stride)
-    return cairo.ImageSurface.create_for_data(out_data, cairo.Format.RGB30, w, h)
 
+@profiled
+def to_cairo(
+    im: Image.Image,
+    pool: BufferPool | None = None,
+    rounding: Rounding = "pillow",
+    box: _Box | None = None,
+    reduce: int = 1,
+) -> cairo.ImageSurface:
+    surface_format = _FORMATS.get(im.mode)
+    if surface_format is None:
+        raise NotImplementedError(f"Unsupported mode: {im.mode}")
+    return _new_surface(im, surface_format, pool, rounding, box, reduce=reduce)
 
-def to_cairo_rgb96f(im: Image.Image | RGB96F) -> cairo.ImageSurface:
-    if isinstance(im, Image.Image):
-        if im.mode != "RGB":
-            raise ValueError("Wrong mode")
-        data = im.tobytes()
-        w, h = im.size
-        stride = cairo.Format.RGB96F.stride_for_width(w)
-        out_data = bytearray(stride * h)
-        _pil_rgb_to_cairo_rgb96f(data, out_data, w, h, stride)
-        return cairo.ImageSurface.create_for_data(
-            out_data,
-            cairo.Format.RGB96F,
-            w,
-            h,
-            stride,
-        )
 
-    im0, im1, im2 = im
-    if not (im0.mode == im1.mode == im2.mode == "F"):
-        raise ValueError("Wrong mode")
-    if not (im0.size == im1.size == im2.size):
-        raise ValueError("Size mismatch")
-    data0 = im0.tobytes()
-    data1 = im1.tobytes()
-    data2 = im2.tobytes()
-    w, h = im0.size
-    stride = cairo.Format.RGB96F.stride_for_width(w)
-    out_data = bytearray(stride * h)
-    _pil_f_to_cairo_rgb96f(data0, data1, data2, out_data, w, h, stride)
-    return cairo.ImageSurface.create_for_data(out_data, cairo.Format.RGB96F, w, h)
+@profiled
+def to_cairo_rgb16(
+    im: Image.Image,
+    pool: BufferPool | None = None,
+    box: _Box | None = None,
+    dither: Dither | None = None,
+    reduce: int = 1,
+) -> cairo.ImageSurface:
+    return _new_surface(
+        im, cairo.Format.RGB16_565, pool, box=box, dither=dither, reduce=reduce
+    )
 
 
-def to_cairo_rgba128f(im: Image.Image | RGBA128F) -> cairo.ImageSurface:
-    if isinstance(im, Image.Image):
-        if im.mode != "RGBA":
-            raise ValueError("Wrong mode")
-        data = im.tobytes()
-        w, h = im.size
-        stride = cairo.Format.RGBA128F.stride_for_width(w)
-        out_data = bytearray(stride * h)
-        _pil_rgba_to_cairo_rgba128f(data, out_data, w, h, stride)
-        return cairo.ImageSurface.create_for_data(
-            out_data,
-            cairo.Format.RGBA128F,
-            w,
-            h,
-            stride,
-        )
+@profiled
+def to_cairo_rgb30(
+    im: Image.Image | RGB30,
+    pool: BufferPool | None = None,
+    box: _Box | None = None,
+    reduce: int = 1,
+) -> cairo.ImageSurface:
+    return _new_surface(im, cairo.Format.RGB30, pool, box=box, reduce=reduce)
 
-    im0, im1, im2, im3 = im
-    if not (im0.mode == im1.mode == im2.mode == im3.mode == "F"):
-        raise ValueError("Wrong mode")
-    if not (im0.size == im1.size == im2.size == im3.size):
+
+def _interleaved_to_cairo(
+    arr: Any,
+    surface_format: cairo.Format,
+    pool: BufferPool | None,
+    box: _Box | None,
+) -> cairo.ImageSurface:
+    view, dtype, raw = _array_view(arr)
+    c = len(_PLANE_MODES[surface_format])
+    if dtype != "float32" or view.ndim != 3 or view.shape[2] != c:
+        raise ValueError("Wrong shape")
+    full_h, full_w, _ = view.shape
+    x0, y0, x1, y1 = _check_box(box, full_w, full_h)
+    w = x1 - x0
+    h = y1 - y0
+    row = w * c * 4
+    full_row = full_w * c * 4
+    data = raw[y0 * full_row + x0 * c * 4 : (y1 - 1) * full_row + x1 * c * 4]
+    if row != full_row:
+        # The kernels read whole rows, gather the columns of the box first.
+        region = memoryview(bytearray(row * h))
+        _copy_rows(data, region, row, h, full_row, row)
+        data = region
+    kernel = _INTERLEAVED_CAIRO_KERNELS[surface_format]
+    if pool is not None:
+        surface = pool.acquire_surface(surface_format, w, h)
+        surface.flush()
+        kernel(data, surface.get_data(), w, h, surface.get_stride())
+        surface.mark_dirty()
+        return surface
+    stride = surface_format.stride_for_width(w)
+    out = bytearray(stride * h)
+    kernel(data, out, w, h, stride)
+    return cairo.ImageSurface.create_for_data(out, surface_format, w, h, stride)
+
+
+@profiled
+def to_cairo_rgb96f(
+    im: Image.Image | RGB96F | Any,
+    pool: BufferPool | None = None,
+    box: _Box | None = None,
+    reduce: int = 1,
+    transfer: Transfer | None = None,
+) -> cairo.ImageSurface:
+    if not isinstance(im, (Image.Image, tuple)):
+        if reduce != 1 or transfer is not None:
+            raise NotImplementedError(
+                "Unsupported array: reduce and transfer need an Image"
+            )
+        return _interleaved_to_cairo(im, cairo.Format.RGB96F, pool, box)
+    surface_format = cairo.Format.RGB96F
+    return _new_surface(
+        im, surface_format, pool, box=box, reduce=reduce, transfer=transfer
+    )
+
+
+@profiled
+def to_cairo_rgba128f(
+    im: Image.Image | RGBA128F | Any,
+    pool: BufferPool | None = None,
+    box: _Box | None = None,
+    reduce: int = 1,
+    transfer: Transfer | None = None,
+) -> cairo.ImageSurface:
+    if not isinstance(im, (Image.Image, tuple)):
+        if reduce != 1 or transfer is not None:
+            raise NotImplementedError(
+                "Unsupported array: reduce and transfer need an Image"
+            )
+        return _interleaved_to_cairo(im, cairo.Format.RGBA128F, pool, box)
+    surface_format = cairo.Format.RGBA128F
+    return _new_surface(
+        im, surface_format, pool, box=box, reduce=reduce, transfer=transfer
+    )
+
+
+def iter_to_cairo_tiles(
+    im: Image.Image,
+    tile: tuple[int, int] = (1024, 1024),
+    format: cairo.Format | None = None,
+    pool: BufferPool | None = None,
+    rounding: Rounding = "pillow",
+) -> Iterator[tuple[tuple[int, int, int, int], cairo.ImageSurface]]:
+    tile_w, tile_h = tile
+    if tile_w < 1 or tile_h < 1:
+        raise ValueError("Tile size must be positive")
+    w, h = im.size
+    for y in range(0, h, tile_h):
+        for x in range(0, w, tile_w):
+            box = (x, y, min(x + tile_w, w), min(y + tile_h, h))
+            part = im.crop(box)
+            if format is None:
+                yield box, to_cairo(part, pool, rounding)
+            else:
+                yield box, _new_surface(part, format, pool, rounding)
+
+
+@profiled
+def to_cairo_into(
+    im: Image.Image | RGB30 | RGBA128F,
+    surface: cairo.ImageSurface,
+    rounding: Rounding = "pillow",
+    box: _Box | None = None,
+    dither: Dither | None = None,
+    transfer: Transfer | None = None,
+    pool: BufferPool | None = None,
+) -> None:
+    surface_w = surface.get_width()
+    x0, y0, x1, y1 = _check_box(box, surface_w, surface.get_height())
+    if _size(im) != (x1 - x0, y1 - y0):
         raise ValueError("Size mismatch")
-    data0 = im0.tobytes()
-    data1 = im1.tobytes()
-    data2 = im2.tobytes()
-    data3 = im3.tobytes()
-    w, h = im0.size
-    stride = cairo.Format.RGBA128F.stride_for_width(w)
-    out_data = bytearray(stride * h)
-    _pil_f_to_cairo_rgba128f(data0, data1, data2, data3, out_data, w, h, stride)
-    return cairo.ImageSurface.create_for_data(out_data, cairo.Format.RGBA128F, w, h)
-
-
-def to_pil(surface: cairo.ImageSurface) -> Image.Image:
+    surface_format = surface.get_format()
+    if surface_format == cairo.Format.A1 and (x0 % 8 or (x1 % 8 and x1 != surface_w)):
+        if not isinstance(im, Image.Image) or im.mode != "1":
+            raise ValueError("Wrong mode")
+        # A1 is written a byte (8 pixels) at a time, so widen the box to whole bytes and
+        # keep the pixels around the patch.
+        byte_box = (x0 // 8 * 8, y0, min((x1 + 7) // 8 * 8, surface_w), y1)
+        region = to_pil(surface, box=byte_box)
+        region.paste(im, (x0 - byte_box[0], 0))
+        im, x0, x1 = region, byte_box[0], byte_box[2]
+    surface.flush()
+    stride = surface.get_stride()
+    data = surface.get_data()[y0 * stride : y1 * stride]
+    _write_cairo(im, data, surface_format, stride, rounding, x0, dither, transfer, pool)
+    surface.mark_dirty_rectangle(x0, y0, x1 - x0, y1 - y0)
+
+
+@profiled
+def load_surface(
+    fp: str | os.PathLike[str] | IO[bytes],
+    format: cairo.Format = cairo.Format.ARGB32,
+    draft_size: tuple[int, int] | None = None,
+    pool: BufferPool | None = None,
+) -> cairo.ImageSurface:
+    mode = _MODES.get(format)
+    if mode is None:
+        raise NotImplementedError(f"Unsupported format: {format}")
+    start = _profile.clock()
+    with Image.open(fp) as im:
+        if draft_size is not None:
+            # Let the JPEG decoder scale down by up to 8 and skip color conversion for
+            # grey.
+            im.draft("L" if mode in ("1", "L") else "RGB", draft_size)
+        im.load()
+        start = _profile.lap("decode", start)
+        if format == cairo.Format.ARGB32 and im.mode == "RGB":
+            # Opaque, so the pixels are the same as RGB24 and premultiplying them is a
+            # no-op.
+            w, h = im.size
+            stride = format.stride_for_width(w)
+            if pool is None:
+                data = bytearray(stride * h)
+                surface = cairo.ImageSurface.create_for_data(data, format, w, h, stride)
+            else:
+                surface = pool.acquire_surface(format, w, h)
+            _profile.lap("surface", start)
+            surface.flush()
+            try:
+                _write_cairo(
+                    im, surface.get_data(), cairo.Format.RGB24, stride, "pillow"
+                )
+            except BaseException:
+                if pool is not None:
+                    pool.release_surface(surface)
+                raise
+            surface.mark_dirty()
+            return surface
+        if im.mode != mode and im.mode not in _EXTRA_MODES.get(format, ()):
+            im = im.convert(mode)
+            _profile.lap("convert", start)
+        return _new_surface(im, format, pool)
+
+
+@contextmanager
+def _convert_pil_planes(
+    data: _Buffer,
+    surface_format: cairo.Format,
+    w: int,
+    h: int,
+    stride: int,
+    pool: BufferPool | None,
+) -> Iterator[list[bytearray]]:
+    modes = _PLANE_MODES[surface_format]
+    planes = [_acquire(pool, mode, w, h, w * 4) for mode in modes]
+    try:
+        start = _profile.clock()
+        _PLANE_PIL_KERNELS[surface_format](data, *planes, w, h, stride)
+        _profile.lap("kernel", start)
+        yield planes
+    finally:
+        if pool is not None:
+            for mode, plane in zip(modes, planes):
+                pool.release(mode, w, h, w * 4, plane)
+
+
+@profiled
+def to_pil(
+    surface: cairo.ImageSurface,
+    copy: bool = True,
+    pool: BufferPool | None = None,
+    rounding: Rounding = "pillow",
+    box: _Box | None = None,
+    dither: Dither | None = None,
+    reduce: int = 1,
+    transfer: Transfer | None = None,
+) -> Image.Image:
+    _check_reduce(reduce)
+    surface.flush()
     w = surface.get_width()
     h = surface.get_height()
     data = surface.get_data()
     stride = surface.get_stride()
     surface_format = surface.get_format()
-    if surface_format == cairo.Format.A1:
-        data = bytearray(data)
-        _a1_swap(data, w, h, stride)
-        return Image.frombuffer("1", (w, h), data, "raw", "1", stride)
-    if surface_format == cairo.Format.A8:
-        return Image.frombuffer("L", (w, h), data.tobytes(), "raw", "L", stride, 1)
-    if surface_format == cairo.Format.RGB24:
-        return Image.frombuffer("RGB", (w, h), data.tobytes(), "raw", "BGRX", stride)
-    if surface_format == cairo.Format.ARGB32:
-        return Image.frombuffer("RGBA", (w, h), data.tobytes(), "raw", "BGRa", stride)
-    if surface_format == cairo.Format.RGB16_565:
-        return Image.frombuffer("RGB", (w, h), data.tobytes(), "raw", "BGR;16", stride)
-    if surface_format == cairo.Format.RGB30:
-        data = bytearray(data.tobytes())
-        _cario_rgb30_to_pil_bgrx(data, w, h, stride)
-        return Image.frombuffer("RGB", (w, h), data, "raw", "BGRX", stride)
-    if surface_format == cairo.Format.RGB96F:
-        out_data = bytearray(w * h * 3)
-        _cairo_rgb96f_to_pil_rgb(data.tobytes(), out_data, w, h, stride)
-        return Image.frombuffer("RGB", (w, h), out_data)
-    if surface_format == cairo.Format.RGBA128F:
-        out_data = bytearray(w * h * 4)
-        _cairo_rgba128f_to_pil_rgba(data.tobytes(), out_data, w, h, stride)
-        return Image.frombuffer("RGBA", (w, h), out_data)
-    raise NotImplementedError(f"Unsupported format: {surface_format}")
-
-
-def to_pil_rgb30(surface: cairo.ImageSurface) -> RGB30:
-    if surface.get_format() != cairo.Format.RGB30:
-        raise ValueError("Wrong format")
-    data = surface.get_data().tobytes()
+    _check_dither(dither, surface_format, _DITHERED_PIL_KERNELS)
+    _check_transfer(transfer, surface_format)
+    if not copy:
+        # Only A8 has the memory layout of a Pillow mode, everything else is rearranged.
+        if surface_format != cairo.Format.A8 or box is not None or reduce != 1:
+            raise ValueError("copy=False needs a whole A8 surface")
+        # The image keeps the memoryview, and with it the surface, alive.
+        return Image.frombuffer("L", (w, h), data, "raw", "L", stride, 1)
+    box = _check_box(box, w, h)
+    if reduce == 1:
+        return _decode_region(
+            data, surface_format, stride, box, pool, rounding, dither, transfer
+        )
+    if surface_format not in _REDUCE_FORMATS:
+        # No kernel averages these, reduce the converted image.
+        im = _decode_region(
+            data, surface_format, stride, box, pool, rounding, dither, transfer
+        )
+        return _reduce_image(im, reduce)
+    # Average the surface pixels first and only convert the reduced ones.
+    x0, y0, x1, y1 = box
+    out_w = -(-(x1 - x0) // reduce)
+    out_h = -(-(y1 - y0) // reduce)
+    out_stride = surface_format.stride_for_width(out_w)
+    out = bytearray(out_stride * out_h)
+    region = _region(data, surface_format, stride, box)
+    bpp = _BITS_PER_PIXEL[surface_format] // 8
+    start = _profile.clock()
+    _reduce_u8(region, out, x1 - x0, y1 - y0, stride, out_stride, bpp, reduce)
+    _profile.lap("kernel", start)
+    return _decode_pil(
+        out, surface_format, out_w, out_h, out_stride, pool, rounding, dither
+    )
+
+
+def _decode_region(
+    data: memoryview,
+    surface_format: cairo.Format,
+    stride: int,
+    box: _Box,
+    pool: BufferPool | None,
+    rounding: Rounding,
+    dither: Dither | None = None,
+    transfer: Transfer | None = None,
+) -> Image.Image:
+    if surface_format not in _MODES:
+        raise NotImplementedError(f"Unsupported format: {surface_format}")
+    x0, y0, x1, y1 = box
+    # A1 can only be decoded from the start of a byte, cut the extra pixels off
+    # afterwards.
+    skip = x0 % 8 if surface_format == cairo.Format.A1 else 0
+    region = _region(data, surface_format, stride, (x0 - skip, y0, x1, y1))
+    w = x1 - x0 + skip
+    im = _decode_pil(
+        region, surface_format, w, y1 - y0, stride, pool, rounding, dither, transfer
+    )
+    return im.crop((skip, 0, im.width, im.height)) if skip else im
+
+
+def to_pil_rows(
+    surface: cairo.ImageSurface,
+    band_height: int = 256,
+    pool: BufferPool | None = None,
+    rounding: Rounding = "pillow",
+    dither: Dither | None = None,
+) -> Iterator[tuple[int, Image.Image]]:
+    if band_height < 1:
+        raise ValueError("Band height must be positive")
+    surface.flush()
     w = surface.get_width()
     h = surface.get_height()
+    data = surface.get_data()
     stride = surface.get_stride()
-    size = w * h * 4
-    r = bytearray(size)
-    g = bytearray(size)
-    b = bytearray(size)
-    _cairo_rgb30_to_pil_i(data, r, g, b, w, h, stride)
-    r = Image.frombuffer("I", (w, h), r)
-    g = Image.frombuffer("I", (w, h), g)
-    b = Image.frombuffer("I", (w, h), b)
+    surface_format = surface.get_format()
+    for y in range(0, h, band_height):
+        box = (0, y, w, min(y + band_height, h))
+        yield (
+            y,
+            _decode_region(data, surface_format, stride, box, pool, rounding, dither),
+        )
+
+
+def _to_pil_planes(
+    surface: cairo.ImageSurface,
+    surface_format: cairo.Format,
+    pool: BufferPool | None,
+    box: _Box | None,
+) -> list[Image.Image]:
+    if surface.get_format() != surface_format:
+        raise ValueError("Wrong format")
+    surface.flush()
+    x0, y0, x1, y1 = _check_box(box, surface.get_width(), surface.get_height())
+    w = x1 - x0
+    h = y1 - y0
+    stride = surface.get_stride()
+    data = _region(surface.get_data(), surface_format, stride, (x0, y0, x1, y1))
+    with _convert_pil_planes(data, surface_format, w, h, stride, pool) as planes:
+        start = _profile.clock()
+        ims = [
+            Image.frombytes(mode, (w, h), plane)
+            for mode, plane in zip(_PLANE_MODES[surface_format], planes)
+        ]
+        _profile.lap("copy", start)
+        return ims
+
+
+@profiled
+def to_pil_rgb30(
+    surface: cairo.ImageSurface,
+    pool: BufferPool | None = None,
+    box: _Box | None = None,
+) -> RGB30:
+    r, g, b = _to_pil_planes(surface, cairo.Format.RGB30, pool, box)
     return r, g, b
 
 
-def to_pil_rgb96f(surface: cairo.ImageSurface) -> RGB96F:
-    if surface.get_format() != cairo.Format.RGB96F:
+def _to_interleaved(
+    surface: cairo.ImageSurface,
+    surface_format: cairo.Format,
+    box: _Box | None,
+) -> memoryview:
+    if surface.get_format() != surface_format:
         raise ValueError("Wrong format")
-    data = surface.get_data().tobytes()
+    surface.flush()
+    x0, y0, x1, y1 = _check_box(box, surface.get_width(), surface.get_height())
+    w = x1 - x0
+    h = y1 - y0
+    c = len(_PLANE_MODES[surface_format])
+    stride = surface.get_stride()
+    data = _region(surface.get_data(), surface_format, stride, (x0, y0, x1, y1))
+    out = memoryview(bytearray(w * h * c * 4))
+    start = _profile.clock()
+    _INTERLEAVED_PIL_KERNELS[surface_format](data, out, w, h, stride)
+    _profile.lap("kernel", start)
+    return out.cast("f", (h, w, c))
+
+
+@overload
+def to_pil_rgb96f(
+    surface: cairo.ImageSurface,
+    pool: BufferPool | None = None,
+    box: _Box | None = None,
+    interleaved: Literal[False] = False,
+) -> RGB96F: ...
+
+
+@overload
+def to_pil_rgb96f(
+    surface: cairo.ImageSurface,
+    pool: BufferPool | None = None,
+    box: _Box | None = None,
+    *,
+    interleaved: Literal[True],
+) -> memoryview: ...
+
+
+@profiled
+def to_pil_rgb96f(
+    surface: cairo.ImageSurface,
+    pool: BufferPool | None = None,
+    box: _Box | None = None,
+    interleaved: bool = False,
+) -> RGB96F | memoryview:
+    if interleaved:
+        return _to_interleaved(surface, cairo.Format.RGB96F, box)
+    r, g, b = _to_pil_planes(surface, cairo.Format.RGB96F, pool, box)
+    return r, g, b
+
+
+@overload
+def to_pil_rgba128f(
+    surface: cairo.ImageSurface,
+    pool: BufferPool | None = None,
+    box: _Box | None = None,
+    interleaved: Literal[False] = False,
+) -> RGBA128F: ...
+
+
+@overload
+def to_pil_rgba128f(
+    surface: cairo.ImageSurface,
+    pool: BufferPool | None = None,
+    box: _Box | None = None,
+    *,
+    interleaved: Literal[True],
+) -> memoryview: ...
+
+
+@profiled
+def to_pil_rgba128f(
+    surface: cairo.ImageSurface,
+    pool: BufferPool | None = None,
+    box: _Box | None = None,
+    interleaved: bool = False,
+) -> RGBA128F | memoryview:
+    if interleaved:
+        return _to_interleaved(surface, cairo.Format.RGBA128F, box)
+    r, g, b, a = _to_pil_planes(surface, cairo.Format.RGBA128F, pool, box)
+    return r, g, b, a
+
+
+@profiled
+def to_pil_into(
+    surface: cairo.ImageSurface,
+    im: Image.Image | RGB30 | RGBA128F,
+    pool: BufferPool | None = None,
+    rounding: Rounding = "pillow",
+    dither: Dither | None = None,
+    transfer: Transfer | None = None,
+) -> None:
     w = surface.get_width()
     h = surface.get_height()
+    if _size(im) != (w, h):
+        raise ValueError("Size mismatch")
+    surface.flush()
+    data = surface.get_data()
     stride = surface.get_stride()
-    size = w * h * 4
-    r = bytearray(size)
-    g = bytearray(size)
-    b = bytearray(size)
-    _cairo_rgb96f_to_pil_f(data, r, g, b, w, h, stride)
-    r = Image.frombuffer("F", (w, h), r)
-    g = Image.frombuffer("F", (w, h), g)
-    b = Image.frombuffer("F", (w, h), b)
-    return r, g, b
+    surface_format = surface.get_format()
+    mode = _MODES.get(surface_format)
+    if mode is None:
+        raise NotImplementedError(f"Unsupported format: {surface_format}")
+    _check_dither(dither, surface_format, _DITHERED_PIL_KERNELS)
+    _check_transfer(transfer, surface_format)
+    if not isinstance(im, Image.Image):
+        if dither is not None or transfer is not None:
+            raise ValueError("Wrong mode")
+        _check_planes(im, surface_format)
+        with _convert_pil_planes(data, surface_format, w, h, stride, pool) as planes:
+            start = _profile.clock()
+            for plane, plane_data in zip(im, planes):
+                plane.frombytes(plane_data)
+            _profile.lap("copy", start)
+        return
+    if im.mode != mode:
+        raise ValueError("Wrong mode")
+    rawmode = _rawmode(surface_format, rounding)
+    if rawmode is not None:
+        start = _profile.clock()
+        im.frombytes(data, "raw", rawmode, stride)
+        _profile.lap("copy", start)
+    else:
+        with _convert_pil(
+            data, surface_format, w, h, stride, pool, rounding, dither, transfer
+        ) as out:
+            start = _profile.clock()
+            im.frombytes(out)
+            _profile.lap("copy", start)
 
 
-def to_pil_rgba128f(surface: cairo.ImageSurface) -> RGBA128F:
-    if surface.get_format() != cairo.Format.RGBA128F:
-        raise ValueError("Wrong format")
-    data = surface.get_data().tobytes()
+class SurfaceImage:
+    # Converts a surface only as far as it is read: `crop`, `getpixel` and `resize` with
+    # a box convert the bands of rows they touch, anything else converts the whole
+    # surface. Converted pixels are kept, so the surface should not be drawn on while
+    # the proxy is in use.
+    def __init__(
+        self,
+        surface: cairo.ImageSurface,
+        pool: BufferPool | None = None,
+        rounding: Rounding = "pillow",
+        band_height: int = 64,
+    ) -> None:
+        surface_format = surface.get_format()
+        mode = _MODES.get(surface_format)
+        if mode is None:
+            raise NotImplementedError(f"Unsupported format: {surface_format}")
+        _check_rounding(rounding)
+        if band_height < 1:
+            raise ValueError("Band height must be positive")
+        self.surface = surface
+        self.mode = mode
+        self.size = (surface.get_width(), surface.get_height())
+        self._pool = pool
+        self._rounding = rounding
+        self._band_height = band_height
+        self._image: Image.Image | None = None
+        self._bands: dict[int, Image.Image] = {}
+
+    @property
+    def width(self) -> int:
+        return self.size[0]
+
+    @property
+    def height(self) -> int:
+        return self.size[1]
+
+    def load(self) -> Image.Image:
+        if self._image is None:
+            self._image = to_pil(self.surface, pool=self._pool, rounding=self._rounding)
+            self._bands.clear()
+        return self._image
+
+    def _band(self, i: int) -> Image.Image:
+        band = self._bands.get(i)
+        if band is None:
+            w, h = self.size
+            box = (0, i * self._band_height, w, min((i + 1) * self._band_height, h))
+            self.surface.flush()
+            band = _decode_region(
+                self.surface.get_data(),
+                self.surface.get_format(),
+                self.surface.get_stride(),
+                box,
+                self._pool,
+                self._rounding,
+            )
+            self._bands[i] = band
+        return band
+
+    def _crop_bands(self, box: _Box) -> Image.Image:
+        if self._image is not None:
+            return self._image.crop(box)
+        x0, y0, x1, y1 = box
+        first = y0 // self._band_height
+        last = (y1 - 1) // self._band_height
+        if first == last:
+            top = first * self._band_height
+            return self._band(first).crop((x0, y0 - top, x1, y1 - top))
+        out = Image.new(self.mode, (x1 - x0, y1 - y0))
+        for i in range(first, last + 1):
+            top = i * self._band_height
+            band = self._band(i)
+            part = band.crop((x0, max(y0 - top, 0), x1, min(y1 - top, band.height)))
+            out.paste(part, (0, max(top - y0, 0)))
+        return out
+
+    def crop(self, box: tuple[float, float, float, float] | None = None) -> Image.Image:
+        if box is None:
+            return self.load().copy()
+        x0, y0, x1, y1 = (round(v) for v in box)
+        w, h = self.size
+        if not (0 <= x0 < x1 <= w and 0 <= y0 < y1 <= h):
+            # Let Pillow fill the parts outside the image.
+            return self.load().crop((x0, y0, x1, y1))
+        return self._crop_bands((x0, y0, x1, y1))
+
+    def getpixel(self, xy: tuple[int, int]) -> Any:
+        x, y = xy
+        w, h = self.size
+        x += w if x < 0 else 0
+        y += h if y < 0 else 0
+        if not (0 <= x < w and 0 <= y < h):
+            raise IndexError("image index out of range")
+        if self._image is not None:
+            return self._image.getpixel((x, y))
+        i = y // self._band_height
+        return self._band(i).getpixel((x, y - i * self._band_height))
+
+    def resize(
+        self,
+        size: tuple[int, int],
+        resample: int | None = None,
+        box: tuple[float, float, float, float] | None = None,
+        reducing_gap: float | None = None,
+    ) -> Image.Image:
+        if box is None or self._image is not None or 0 in size:
+            return self.load().resize(size, resample, box, reducing_gap)
+        # Convert the box plus enough pixels around it for the widest filter (Lanczos, 3
+        # pixels at the output scale), so the result is the same as resizing the whole
+        # image.
+        w, h = self.size
+        bx0, by0, bx1, by1 = box
+        margin_x = math.ceil(3 * max((bx1 - bx0) / size[0], 1)) + 1
+        margin_y = math.ceil(3 * max((by1 - by0) / size[1], 1)) + 1
+        x0 = max(math.floor(bx0) - margin_x, 0)
+        y0 = max(math.floor(by0) - margin_y, 0)
+        x1 = min(math.ceil(bx1) + margin_x, w)
+        y1 = min(math.ceil(by1) + margin_y, h)
+        if not (x0 < x1 and y0 < y1):
+            return self.load().resize(size, resample, box, reducing_gap)
+        region = self._crop_bands((x0, y0, x1, y1))
+        shifted = (bx0 - x0, by0 - y0, bx1 - x0, by1 - y0)
+        return region.resize(size, resample, shifted, reducing_gap)
+
+    def __getattr__(self, name: str) -> Any:
+        # Private names are looked up before __init__ has run, e.g. by copy and pickle.
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+
+# Pillow formats that cannot store alpha, surfaces with alpha are flattened onto black
+# for them.
+_OPAQUE_FORMATS = {"JPEG", "MPO", "PPM", "EPS"}
+# PNG color type of each mode `save_surface` writes a band at a time.
+_PNG_COLOR_TYPES = {"RGB": 2, "RGBA": 6}
+_PNG_BAND_HEIGHT = 64
+
+
+def _write_png_chunk(fp: IO[bytes], kind: bytes, data: bytes) -> None:
+    fp.write(struct.pack(">I", len(data)) + kind)
+    fp.write(data)
+    fp.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+
+def _save_png(
+    surface: cairo.ImageSurface,
+    fp: IO[bytes],
+    mode: str,
+    pool: BufferPool | None,
+    compress_level: int,
+) -> None:
+    # Convert, filter and compress a band of rows at a time, so no converted copy of the
+    # whole image is ever made.
     w = surface.get_width()
     h = surface.get_height()
+    bpp = Image.getmodebands(mode)
+    row = w * bpp
+    fp.write(b"\x89PNG\r\n\x1a\n")
+    header = struct.pack(">IIBBBBB", w, h, 8, _PNG_COLOR_TYPES[mode], 0, 0, 0)
+    _write_png_chunk(fp, b"IHDR", header)
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED, 15, 9, zlib.Z_FILTERED)
+    above = bytes(row)
+    for _, band in to_pil_rows(surface, _PNG_BAND_HEIGHT, pool):
+        start = _profile.clock()
+        pixels = band.tobytes()
+        scanlines = bytearray((row + 1) * band.height)
+        _png_filter(pixels, above, scanlines, w, band.height, bpp)
+        above = pixels[-row:]
+        start = _profile.lap("kernel", start)
+        data = compressor.compress(scanlines)
+        if data:
+            _write_png_chunk(fp, b"IDAT", data)
+        _profile.lap("encode", start)
+    start = _profile.clock()
+    _write_png_chunk(fp, b"IDAT", compressor.flush())
+    _write_png_chunk(fp, b"IEND", b"")
+    _profile.lap("encode", start)
+
+
+@profiled
+def save_surface(
+    surface: cairo.ImageSurface,
+    fp: str | os.PathLike[str] | IO[bytes],
+    format: str | None = None,
+    pool: BufferPool | None = None,
+    **params: Any,
+) -> None:
+    if format is None and isinstance(fp, (str, os.PathLike)):
+        format = Image.registered_extensions().get(os.path.splitext(fp)[1].lower())
+    surface_format = surface.get_format()
+    mode = _MODES.get(surface_format)
+    if (
+        format is not None
+        and format.upper() == "PNG"
+        and mode in _PNG_COLOR_TYPES
+        and set(params) <= {"compress_level"}
+        and surface.get_width() > 0
+        and surface.get_height() > 0
+    ):
+        compress_level = params.get("compress_level", -1)
+        if isinstance(fp, (str, os.PathLike)):
+            with open(fp, "wb") as f:
+                _save_png(surface, f, mode, pool, compress_level)
+        else:
+            _save_png(surface, fp, mode, pool, compress_level)
+        return
+    opaque = format is not None and format.upper() in _OPAQUE_FORMATS
+    if surface_format == cairo.Format.A8:
+        # The encoder reads the surface memory directly.
+        im = to_pil(surface, copy=False)
+    elif surface_format == cairo.Format.ARGB32 and opaque:
+        # Premultiplied colors are the colors flattened onto black, decode them as they
+        # are.
+        surface.flush()
+        w = surface.get_width()
+        h = surface.get_height()
+        im = Image.frombytes(
+            "RGB", (w, h), surface.get_data(), "raw", "BGRX", surface.get_stride()
+        )
+    else:
+        im = to_pil(surface, pool=pool)
+        if opaque and im.mode == "RGBA":
+            flat = Image.new("RGB", im.size)
+            flat.paste(im, mask=im.getchannel("A"))
+            im = flat
+    start = _profile.clock()
+    im.save(fp, format, **params)
+    _profile.lap("encode", start)
+
+
+def _split(data: memoryview, n: int) -> list[memoryview]:
+    size = len(data) // n
+    return [data[i * size : (i + 1) * size] for i in range(n)]
+
+
+def _write_a8(data: memoryview, out: memoryview, w: int, h: int, stride: int) -> None:
+    _copy_rows(data, out, w, h, w, stride)
+
+
+def _write_argb32(
+    data: memoryview, out: memoryview, w: int, h: int, stride: int
+) -> None:
+    _copy_rows(data, out, w * 4, h, w * 4, stride)
+    _pil_rgba_to_cairo_argb32(out, w, h, stride, True)
+
+
+def _write_rgb30_planes(
+    data: memoryview, out: memoryview, w: int, h: int, stride: int
+) -> None:
+    _pil_i_to_cairo_rgb30(*_split(data, 3), out, w, h, stride)
+
+
+def _write_rgb96f_planes(
+    data: memoryview, out: memoryview, w: int, h: int, stride: int
+) -> None:
+    _pil_f_to_cairo_rgb96f(*_split(data, 3), out, w, h, stride)
+
+
+def _write_rgba128f_planes(
+    data: memoryview,
+    out: memoryview,
+    w: int,
+    h: int,
+    stride: int,
+) -> None:
+    _pil_f_to_cairo_rgba128f(*_split(data, 4), out, w, h, stride)
+
+
+# Arrays `array_to_cairo` accepts, by (format, layout, dtype, channels). Each writer
+# takes the array as bytes, then the surface data, width, height and stride.
+_ARRAY_WRITERS: dict[
+    tuple[cairo.Format, str, str, int],
+    Callable[[memoryview, memoryview, int, int, int], None],
+] = {
+    (cairo.Format.A8, "HWC", "uint8", 1): _write_a8,
+    (cairo.Format.RGB24, "HWC", "uint8", 3): _pil_rgb_to_cairo_rgb24,
+    (cairo.Format.ARGB32, "HWC", "uint8", 4): _write_argb32,
+    (cairo.Format.RGB16_565, "HWC", "uint8", 3): _pil_rgb_to_cairo_rgb16,
+    (cairo.Format.RGB30, "HWC", "uint8", 3): _pil_rgb_to_cairo_rgb30,
+    (cairo.Format.RGB30, "CHW", "uint32", 3): _write_rgb30_planes,
+    (cairo.Format.RGB96F, "HWC", "uint8", 3): _pil_rgb_to_cairo_rgb96f,
+    (cairo.Format.RGB96F, "HWC", "float32", 3): _write_rgb96f,
+    (cairo.Format.RGB96F, "CHW", "float32", 3): _write_rgb96f_planes,
+    (cairo.Format.RGBA128F, "HWC", "uint8", 4): _pil_rgba_to_cairo_rgba128f,
+    (cairo.Format.RGBA128F, "HWC", "float32", 4): _rgbaf_to_cairo_rgba128f,
+    (cairo.Format.RGBA128F, "CHW", "float32", 4): _write_rgba128f_planes,
+}
+# Format picked by `array_to_cairo` when none is given, by (layout, dtype, channels).
+_ARRAY_FORMATS = {
+    ("HWC", "uint8", 1): cairo.Format.A8,
+    ("HWC", "uint8", 3): cairo.Format.RGB24,
+    ("HWC", "uint8", 4): cairo.Format.ARGB32,
+    ("HWC", "float32", 3): cairo.Format.RGB96F,
+    ("HWC", "float32", 4): cairo.Format.RGBA128F,
+    ("CHW", "uint32", 3): cairo.Format.RGB30,
+    ("CHW", "float32", 3): cairo.Format.RGB96F,
+    ("CHW", "float32", 4): cairo.Format.RGBA128F,
+}
+
+
+@profiled
+def array_to_cairo(
+    arr: Any,
+    format: cairo.Format | None = None,
+    layout: ArrayLayout = "HWC",
+) -> cairo.ImageSurface:
+    view, dtype, raw = _array_view(arr)
+    if layout == "HWC" and view.ndim == 2:
+        (h, w), c = view.shape, 1
+    elif layout == "HWC" and view.ndim == 3:
+        h, w, c = view.shape
+    elif layout == "CHW" and view.ndim == 3:
+        c, h, w = view.shape
+    elif layout in ("HWC", "CHW"):
+        raise ValueError("Wrong shape")
+    else:
+        raise ValueError(f"Unsupported layout: {layout}")
+    if format is None:
+        format = _ARRAY_FORMATS.get((layout, dtype, c))
+    writer = (
+        _ARRAY_WRITERS.get((format, layout, dtype, c)) if format is not None else None
+    )
+    if writer is None:
+        raise NotImplementedError(
+            f"Unsupported array: {layout} {dtype} x {c} to {format}"
+        )
+    stride = format.stride_for_width(w)
+    data = bytearray(stride * h)
+    writer(raw, memoryview(data), w, h, stride)
+    return cairo.ImageSurface.create_for_data(data, format, w, h, stride)
+
+
+def _read_rgb30_planes(data: memoryview, out: Any, w: int, h: int, stride: int) -> None:
+    _cairo_rgb30_to_pil_i(data, *out, w, h, stride)
+
+
+def _read_rgb96f_planes(
+    data: memoryview, out: Any, w: int, h: int, stride: int
+) -> None:
+    _cairo_rgb96f_to_pil_f(data, *out, w, h, stride)
+
+
+def _read_rgba128f_planes(
+    data: memoryview, out: Any, w: int, h: int, stride: int
+) -> None:
+    _cairo_rgba128f_to_pil_f(data, *out, w, h, stride)
+
+
+def _read_argb32(data: memoryview, out: Any, w: int, h: int, stride: int) -> None:
+    # Rounding to nearest, so that `array_to_cairo` gives the surface back exactly.
+    _cairo_argb32_to_pil_rgba(data, out, w, h, stride, True)
+
+
+# Raw surface memory as an array, by format: (dtype, channels), 0 channels means a 2D
+# array. A1 is exposed as whole rows of bytes.
+_NATIVE_ARRAYS = {
+    cairo.Format.A1: ("uint8", 0),
+    cairo.Format.A8: ("uint8", 0),
+    cairo.Format.RGB24: ("uint32", 0),
+    cairo.Format.ARGB32: ("uint32", 0),
+    cairo.Format.RGB16_565: ("uint16", 0),
+    cairo.Format.RGB30: ("uint32", 0),
+    cairo.Format.RGB96F: ("float32", 3),
+    cairo.Format.RGBA128F: ("float32", 4),
+}
+# Arrays `cairo_to_array` can produce, by (format, layout, dtype): (channels, reader).
+# The first dtype of a format and layout is the default. Each reader takes the surface
+# data, the output array (a list of planes for "CHW"), width, height and stride. Without
+# a reader, the layout matches the surface memory and a view of it is returned.
+_ARRAY_READERS: dict[
+    tuple[cairo.Format, str, str],
+    tuple[int, Callable[[memoryview, Any, int, int, int], None] | None],
+] = {
+    (cairo.Format.A8, "HWC", "uint8"): (0, None),
+    (cairo.Format.RGB24, "HWC", "uint8"): (3, None),
+    (cairo.Format.ARGB32, "HWC", "uint8"): (4, _read_argb32),
+    (cairo.Format.RGB30, "HWC", "uint8"): (3, _cairo_rgb30_to_pil_rgb),
+    (cairo.Format.RGB30, "CHW", "uint32"): (3, _read_rgb30_planes),
+    (cairo.Format.RGB96F, "HWC", "float32"): (3, None),
+    (cairo.Format.RGB96F, "HWC", "uint8"): (3, _cairo_rgb96f_to_pil_rgb),
+    (cairo.Format.RGB96F, "CHW", "float32"): (3, _read_rgb96f_planes),
+    (cairo.Format.RGBA128F, "HWC", "float32"): (4, _cairo_rgba128f_to_rgbaf),
+    (cairo.Format.RGBA128F, "HWC", "uint8"): (4, _cairo_rgba128f_to_pil_rgba),
+    (cairo.Format.RGBA128F, "CHW", "float32"): (4, _read_rgba128f_planes),
+}
+
+
+@profiled
+def cairo_to_array(
+    surface: cairo.ImageSurface,
+    layout: ArrayLayout | Literal["native"] = "HWC",
+    dtype: str | None = None,
+) -> "np.ndarray[Any, Any]":
+    import numpy as np
+
+    surface.flush()
+    w = surface.get_width()
+    h = surface.get_height()
+    data = surface.get_data()
     stride = surface.get_stride()
-    size = w * h * 4
-    r = bytearray(size)
-    g = bytearray(size)
-    b = bytearray(size)
-    a = bytearray(size)
-    _cairo_rgba128f_to_pil_f(data, r, g, b, a, w, h, stride)
-    r = Image.frombuffer("F", (w, h), r)
-    g = Image.frombuffer("F", (w, h), g)
-    b = Image.frombuffer("F", (w, h), b)
-    a = Image.frombuffer("F", (w, h), a)
-    return r, g, b, a
+    surface_format = surface.get_format()
+    if surface_format not in _MODES:
+        raise NotImplementedError(f"Unsupported format: {surface_format}")
+    if layout == "native":
+        if surface_format == cairo.Format.A1:
+            return np.ndarray((h, stride), np.uint8, data)
+        dtype, c = _NATIVE_ARRAYS[surface_format]
+    elif layout in ("HWC", "CHW"):
+        if layout == "HWC" and surface_format in (
+            cairo.Format.A1,
+            cairo.Format.RGB16_565,
+        ):
+            # No kernel of our own for these, let Pillow decode them.
+            return np.asarray(to_pil(surface))
+        if dtype is None:
+            dtype = next(
+                (
+                    key[2]
+                    for key in _ARRAY_READERS
+                    if key[:2] == (surface_format, layout)
+                ),
+                None,
+            )
+        entry = _ARRAY_READERS.get((surface_format, layout, dtype or ""))
+        if entry is None:
+            raise NotImplementedError(
+                f"Unsupported array: {surface_format} to {layout} {dtype}"
+            )
+        c, reader = entry
+        if reader is not None:
+            out = np.empty((c, h, w) if layout == "CHW" else (h, w, c), dtype)
+            reader(data, list(out) if layout == "CHW" else out, w, h, stride)
+            return out
+    else:
+        raise ValueError(f"Unsupported layout: {layout}")
+    # The layout matches the surface memory, return a view of it.
+    assert dtype is not None
+    if surface_format == cairo.Format.RGB24 and layout != "native":
+        # Native endian xRGB, pick R, G and B out of each 32-bit pixel.
+        offset, step = (2, -1) if sys.byteorder == "little" else (1, 1)
+        return np.ndarray((h, w, 3), np.uint8, data, offset, (stride, 4, step))
+    itemsize = _ITEMSIZES[dtype]
+    if c:
+        return np.ndarray(
+            (h, w, c), dtype, data, strides=(stride, itemsize * c, itemsize)
+        )
+    return np.ndarray((h, w), dtype, data, strides=(stride, itemsize))
+
+
+@overload
+def convert_many(
+    items: Iterable[Image.Image],
+    target: None = None,
+    max_workers: int | None = None,
+) -> list[cairo.ImageSurface]: ...
+
+
+@overload
+def convert_many(
+    items: Iterable[_T],
+    target: Callable[[_T], _R],
+    max_workers: int | None = None,
+) -> list[_R]: ...
+
+
+def convert_many(
+    items: Iterable[Any],
+    target: Callable[[Any], Any] | None = None,
+    max_workers: int | None = None,
+) -> list[Any]:
+    if target is None:
+        target = to_cairo
+    with ThreadPoolExecutor(max_workers) as executor:
+        return list(executor.map(target, items))
+
+
+def to_pil_many(
+    surfaces: Iterable[cairo.ImageSurface],
+    max_workers: int | None = None,
+) -> list[Image.Image]:
+    return convert_many(surfaces, to_pil, max_workers)
+
+
+def frames_to_cairo(
+    im: Image.Image,
+    format: cairo.Format = cairo.Format.ARGB32,
+    rounding: Rounding = "pillow",
+    max_workers: int | None = None,
+) -> list[cairo.ImageSurface]:
+    mode = _MODES.get(format)
+    if mode is None:
+        raise NotImplementedError(f"Unsupported format: {format}")
+    _check_rounding(rounding)
+    n = getattr(im, "n_frames", 1)
+    w, h = im.size
+    stride = format.stride_for_width(w)
+    size = stride * h
+    # Every frame has the size of the sequence, so one buffer holds them all and each
+    # surface maps its own slice of it.
+    data = memoryview(bytearray(size * n))
+    current = im.tell()
+    try:
+        with ThreadPoolExecutor(max_workers) as executor:
+            futures = []
+            for i in range(n):
+                # Seeking decodes the next frame over the current one, the workers get a
+                # copy.
+                im.seek(i)
+                frame_format = format
+                if format == cairo.Format.ARGB32 and im.mode == "RGB":
+                    # Opaque, written as RGB24 like `load_surface` does.
+                    frame = im.copy()
+                    frame_format = cairo.Format.RGB24
+                elif im.mode == mode or im.mode in _EXTRA_MODES.get(format, ()):
+                    frame = im.copy()
+                else:
+                    frame = im.convert(mode)
+                view = data[i * size : (i + 1) * size]
+                futures.append(
+                    executor.submit(
+                        _write_cairo, frame, view, frame_format, stride, rounding
+                    )
+                )
+            for future in futures:
+                future.result()
+    finally:
+        im.seek(current)
+    return [
+        cairo.ImageSurface.create_for_data(
+            data[i * size : (i + 1) * size], format, w, h, stride
+        )
+        for i in range(n)
+    ]
+
+
+def surfaces_to_frames(
+    surfaces: Iterable[cairo.ImageSurface],
+    rounding: Rounding = "pillow",
+    max_workers: int | None = None,
+) -> list[Image.Image]:
+    _check_rounding(rounding)
+    # Scratch buffers are handed from one frame to the next instead of allocated for
+    # each.
+    pool = BufferPool()
+    return convert_many(
+        surfaces, partial(to_pil, pool=pool, rounding=rounding), max_workers
+    )
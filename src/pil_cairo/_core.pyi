@@ -1,110 +1,319 @@
-def a1_swap(
-    data: bytearray,
+from typing import ClassVar, TypeAlias, final
+
+import cairo
+from PIL import Image
+
+_ReadableBuffer: TypeAlias = bytes | bytearray | memoryview
+_WritableBuffer: TypeAlias = bytearray | memoryview
+
+def set_threads(threads: int) -> None: ...
+def get_threads() -> int: ...
+def set_avx2(enabled: bool) -> None: ...
+def get_avx2() -> bool: ...
+def pil_1_to_cairo_a1(
+    data: _ReadableBuffer,
+    out: _WritableBuffer,
     w: int,
     h: int,
     stride: int,
 ) -> None: ...
 def pil_rgb_to_cairo_rgb16(
-    data: bytes,
-    out: bytearray,
+    data: _ReadableBuffer,
+    out: _WritableBuffer,
     w: int,
     h: int,
     stride: int,
+    bpp: int = 3,
+) -> None: ...
+def pil_rgb_to_cairo_rgb16_dithered(
+    data: _ReadableBuffer,
+    out: _WritableBuffer,
+    w: int,
+    h: int,
+    stride: int,
+    dither: str,
+    bpp: int = 3,
 ) -> None: ...
 def pil_rgb_to_cairo_rgb30(
-    data: bytes,
-    out: bytearray,
+    data: _ReadableBuffer,
+    out: _WritableBuffer,
     w: int,
     h: int,
     stride: int,
+    bpp: int = 3,
 ) -> None: ...
 def pil_i_to_cairo_rgb30(
-    r: bytes,
-    g: bytes,
-    b: bytes,
-    out: bytearray,
+    r: _ReadableBuffer,
+    g: _ReadableBuffer,
+    b: _ReadableBuffer,
+    out: _WritableBuffer,
     w: int,
     h: int,
     stride: int,
 ) -> None: ...
 def pil_rgb_to_cairo_rgb96f(
-    data: bytes,
-    out: bytearray,
+    data: _ReadableBuffer,
+    out: _WritableBuffer,
     w: int,
     h: int,
     stride: int,
+    bpp: int = 3,
 ) -> None: ...
 def pil_f_to_cairo_rgb96f(
-    r: bytes,
-    g: bytes,
-    b: bytes,
-    out: bytearray,
+    r: _ReadableBuffer,
+    g: _ReadableBuffer,
+    b: _ReadableBuffer,
+    out: _WritableBuffer,
     w: int,
     h: int,
     stride: int,
 ) -> None: ...
 def pil_rgba_to_cairo_rgba128f(
-    data: bytes,
-    out: bytearray,
+    data: _ReadableBuffer,
+    out: _WritableBuffer,
+    w: int,
+    h: int,
+    stride: int,
+) -> None: ...
+def pil_rgb_to_cairo_rgb96f_srgb(
+    data: _ReadableBuffer,
+    out: _WritableBuffer,
+    w: int,
+    h: int,
+    stride: int,
+    bpp: int = 3,
+) -> None: ...
+def pil_rgba_to_cairo_rgba128f_srgb(
+    data: _ReadableBuffer,
+    out: _WritableBuffer,
     w: int,
     h: int,
     stride: int,
 ) -> None: ...
 def pil_f_to_cairo_rgba128f(
-    r: bytes,
-    g: bytes,
-    b: bytes,
-    a: bytes,
-    out: bytearray,
+    r: _ReadableBuffer,
+    g: _ReadableBuffer,
+    b: _ReadableBuffer,
+    a: _ReadableBuffer,
+    out: _WritableBuffer,
+    w: int,
+    h: int,
+    stride: int,
+) -> None: ...
+def rgbaf_to_cairo_rgba128f(
+    data: _ReadableBuffer,
+    out: _WritableBuffer,
+    w: int,
+    h: int,
+    stride: int,
+) -> None: ...
+def pil_rgb_to_cairo_rgb24(
+    data: _ReadableBuffer,
+    out: _WritableBuffer,
+    w: int,
+    h: int,
+    stride: int,
+) -> None: ...
+def pil_rgbx_to_cairo_rgb24(
+    data: _WritableBuffer,
+    w: int,
+    h: int,
+    stride: int,
+) -> None: ...
+def pil_la_to_cairo_argb32(
+    data: _ReadableBuffer,
+    out: _WritableBuffer,
+    w: int,
+    h: int,
+    stride: int,
+    premultiplied: bool,
+    nearest: bool,
+) -> None: ...
+def pil_rgba_premultiplied_to_cairo_argb32(
+    data: _ReadableBuffer,
+    out: _WritableBuffer,
+    w: int,
+    h: int,
+    stride: int,
+) -> None: ...
+def pil_p_to_cairo_argb32(
+    data: _ReadableBuffer,
+    palette: _ReadableBuffer,
+    out: _WritableBuffer,
+    w: int,
+    h: int,
+    stride: int,
+) -> None: ...
+def pil_i16_to_cairo_rgb30(
+    data: _ReadableBuffer,
+    out: _WritableBuffer,
+    w: int,
+    h: int,
+    stride: int,
+) -> None: ...
+def pil_i16_to_cairo_rgb96f(
+    data: _ReadableBuffer,
+    out: _WritableBuffer,
     w: int,
     h: int,
     stride: int,
 ) -> None: ...
-def cairo_rgb30_to_pil_bgrx(
-    data: bytearray,
+def pil_rgba_to_cairo_argb32(
+    data: _WritableBuffer,
+    w: int,
+    h: int,
+    stride: int,
+    nearest: bool,
+) -> None: ...
+def cairo_argb32_to_pil_rgba(
+    data: _ReadableBuffer,
+    out: _WritableBuffer,
+    w: int,
+    h: int,
+    stride: int,
+    nearest: bool,
+) -> None: ...
+def cairo_rgb30_to_pil_rgb(
+    data: _ReadableBuffer,
+    out: _WritableBuffer,
     w: int,
     h: int,
     stride: int,
 ) -> None: ...
 def cairo_rgb96f_to_pil_rgb(
-    data: bytes,
-    out: bytearray,
+    data: _ReadableBuffer,
+    out: _WritableBuffer,
     w: int,
     h: int,
     stride: int,
 ) -> None: ...
 def cairo_rgba128f_to_pil_rgba(
-    data: bytes,
-    out: bytearray,
+    data: _ReadableBuffer,
+    out: _WritableBuffer,
+    w: int,
+    h: int,
+    stride: int,
+) -> None: ...
+def cairo_rgb96f_to_pil_rgb_srgb(
+    data: _ReadableBuffer,
+    out: _WritableBuffer,
+    w: int,
+    h: int,
+    stride: int,
+) -> None: ...
+def cairo_rgba128f_to_pil_rgba_srgb(
+    data: _ReadableBuffer,
+    out: _WritableBuffer,
     w: int,
     h: int,
     stride: int,
 ) -> None: ...
+def cairo_rgb30_to_pil_rgb_dithered(
+    data: _ReadableBuffer,
+    out: _WritableBuffer,
+    w: int,
+    h: int,
+    stride: int,
+    dither: str,
+) -> None: ...
+def cairo_rgb96f_to_pil_rgb_dithered(
+    data: _ReadableBuffer,
+    out: _WritableBuffer,
+    w: int,
+    h: int,
+    stride: int,
+    dither: str,
+    srgb: bool = False,
+) -> None: ...
+def cairo_rgba128f_to_pil_rgba_dithered(
+    data: _ReadableBuffer,
+    out: _WritableBuffer,
+    w: int,
+    h: int,
+    stride: int,
+    dither: str,
+    srgb: bool = False,
+) -> None: ...
 def cairo_rgb30_to_pil_i(
-    data: bytes,
-    r: bytearray,
-    g: bytearray,
-    b: bytearray,
+    data: _ReadableBuffer,
+    r: _WritableBuffer,
+    g: _WritableBuffer,
+    b: _WritableBuffer,
     w: int,
     h: int,
     stride: int,
 ) -> None: ...
 def cairo_rgb96f_to_pil_f(
-    data: bytes,
-    r: bytearray,
-    g: bytearray,
-    b: bytearray,
+    data: _ReadableBuffer,
+    r: _WritableBuffer,
+    g: _WritableBuffer,
+    b: _WritableBuffer,
     w: int,
     h: int,
     stride: int,
 ) -> None: ...
 def cairo_rgba128f_to_pil_f(
-    data: bytes,
-    r: bytearray,
-    g: bytearray,
-    b: bytearray,
-    a: bytearray,
+    data: _ReadableBuffer,
+    r: _WritableBuffer,
+    g: _WritableBuffer,
+    b: _WritableBuffer,
+    a: _WritableBuffer,
     w: int,
     h: int,
     stride: int,
 ) -> None: ...
+def cairo_rgba128f_to_rgbaf(
+    data: _ReadableBuffer,
+    out: _WritableBuffer,
+    w: int,
+    h: int,
+    stride: int,
+) -> None: ...
+def reduce_u8(
+    data: _ReadableBuffer,
+    out: _WritableBuffer,
+    w: int,
+    h: int,
+    stride: int,
+    out_stride: int,
+    bpp: int,
+    factor: int,
+) -> None: ...
+def pil_rgba_to_cairo_argb32_reduced(
+    data: _ReadableBuffer,
+    out: _WritableBuffer,
+    w: int,
+    h: int,
+    stride: int,
+    factor: int,
+    nearest: bool,
+) -> None: ...
+def png_filter(
+    data: _ReadableBuffer,
+    above: _ReadableBuffer,
+    out: _WritableBuffer,
+    w: int,
+    h: int,
+    bpp: int,
+) -> None: ...
+
+@final
+class Kernel:
+    Pil1ToCairoA1: ClassVar[Kernel]
+    PilLToCairoA8: ClassVar[Kernel]
+    PilRgbToCairoRgb24: ClassVar[Kernel]
+    PilRgbxToCairoRgb24: ClassVar[Kernel]
+    PilRgbaToCairoArgb32: ClassVar[Kernel]
+    PilRgbaPremultipliedToCairoArgb32: ClassVar[Kernel]
+    PilLaToCairoArgb32: ClassVar[Kernel]
+    PilLaPremultipliedToCairoArgb32: ClassVar[Kernel]
+    PilRgbToCairoRgb16: ClassVar[Kernel]
+    PilRgbToCairoRgb30: ClassVar[Kernel]
+    PilI16ToCairoRgb30: ClassVar[Kernel]
+    PilRgbToCairoRgb96f: ClassVar[Kernel]
+    PilI16ToCairoRgb96f: ClassVar[Kernel]
+    PilRgbaToCairoRgba128f: ClassVar[Kernel]
+
+def convert(
+    obj: Image.Image, target: cairo.Format, kernel: Kernel
+) -> cairo.ImageSurface: ...
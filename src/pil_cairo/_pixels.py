@@ -0,0 +1,488 @@
+import sys
+from array import array
+from collections.abc import Container, Iterator
+from contextlib import contextmanager
+from typing import Literal
+
+import cairo
+from PIL import Image
+
+from pil_cairo import _profile
+from pil_cairo._core import Kernel as _Kernel
+from pil_cairo._core import cairo_argb32_to_pil_rgba as _cairo_argb32_to_pil_rgba
+from pil_cairo._core import cairo_rgb30_to_pil_rgb as _cairo_rgb30_to_pil_rgb
+from pil_cairo._core import (
+    cairo_rgb30_to_pil_rgb_dithered as _cairo_rgb30_to_pil_rgb_dithered,
+)
+from pil_cairo._core import cairo_rgb96f_to_pil_rgb as _cairo_rgb96f_to_pil_rgb
+from pil_cairo._core import (
+    cairo_rgb96f_to_pil_rgb_dithered as _cairo_rgb96f_to_pil_rgb_dithered,
+)
+from pil_cairo._core import (
+    cairo_rgb96f_to_pil_rgb_srgb as _cairo_rgb96f_to_pil_rgb_srgb,
+)
+from pil_cairo._core import cairo_rgba128f_to_pil_rgba as _cairo_rgba128f_to_pil_rgba
+from pil_cairo._core import (
+    cairo_rgba128f_to_pil_rgba_dithered as _cairo_rgba128f_to_pil_rgba_dithered,
+)
+from pil_cairo._core import (
+    cairo_rgba128f_to_pil_rgba_srgb as _cairo_rgba128f_to_pil_rgba_srgb,
+)
+from pil_cairo._core import pil_1_to_cairo_a1 as _pil_1_to_cairo_a1
+from pil_cairo._core import pil_f_to_cairo_rgb96f as _pil_f_to_cairo_rgb96f
+from pil_cairo._core import pil_f_to_cairo_rgba128f as _pil_f_to_cairo_rgba128f
+from pil_cairo._core import pil_i16_to_cairo_rgb30 as _pil_i16_to_cairo_rgb30
+from pil_cairo._core import pil_i16_to_cairo_rgb96f as _pil_i16_to_cairo_rgb96f
+from pil_cairo._core import pil_i_to_cairo_rgb30 as _pil_i_to_cairo_rgb30
+from pil_cairo._core import pil_la_to_cairo_argb32 as _pil_la_to_cairo_argb32
+from pil_cairo._core import pil_p_to_cairo_argb32 as _pil_p_to_cairo_argb32
+from pil_cairo._core import pil_rgb_to_cairo_rgb16 as _pil_rgb_to_cairo_rgb16
+from pil_cairo._core import (
+    pil_rgb_to_cairo_rgb16_dithered as _pil_rgb_to_cairo_rgb16_dithered,
+)
+from pil_cairo._core import pil_rgb_to_cairo_rgb30 as _pil_rgb_to_cairo_rgb30
+from pil_cairo._core import pil_rgb_to_cairo_rgb96f as _pil_rgb_to_cairo_rgb96f
+from pil_cairo._core import (
+    pil_rgb_to_cairo_rgb96f_srgb as _pil_rgb_to_cairo_rgb96f_srgb,
+)
+from pil_cairo._core import (
+    pil_rgba_premultiplied_to_cairo_argb32 as _pil_rgba_premultiplied_to_cairo_argb32,
+)
+from pil_cairo._core import pil_rgba_to_cairo_argb32 as _pil_rgba_to_cairo_argb32
+from pil_cairo._core import pil_rgba_to_cairo_rgba128f as _pil_rgba_to_cairo_rgba128f
+from pil_cairo._core import (
+    pil_rgba_to_cairo_rgba128f_srgb as _pil_rgba_to_cairo_rgba128f_srgb,
+)
+from pil_cairo._core import pil_rgbx_to_cairo_rgb24 as _pil_rgbx_to_cairo_rgb24
+from pil_cairo._pool import BufferPool
+
+__all__ = ["RGB30", "RGB96F", "RGBA128F", "Dither", "Rounding", "Transfer"]
+
+RGB30 = tuple[Image.Image, Image.Image, Image.Image]
+RGB96F = tuple[Image.Image, Image.Image, Image.Image]
+RGBA128F = tuple[Image.Image, Image.Image, Image.Image, Image.Image]
+Rounding = Literal["pillow", "truncate", "nearest"]
+Dither = Literal["ordered", "floyd-steinberg"]
+Transfer = Literal["srgb"]
+_Buffer = bytearray | memoryview
+
+# Pillow mode of each cairo format, used in both directions.
+_MODES = {
+    cairo.Format.A1: "1",
+    cairo.Format.A8: "L",
+    cairo.Format.RGB24: "RGB",
+    cairo.Format.ARGB32: "RGBA",
+    cairo.Format.RGB16_565: "RGB",
+    cairo.Format.RGB30: "RGB",
+    cairo.Format.RGB96F: "RGB",
+    cairo.Format.RGBA128F: "RGBA",
+}
+# Format `to_cairo` picks for each mode.
+_FORMATS = {
+    "1": cairo.Format.A1,
+    "L": cairo.Format.A8,
+    "RGB": cairo.Format.RGB24,
+    "RGBX": cairo.Format.RGB24,
+    "RGBA": cairo.Format.ARGB32,
+    "RGBa": cairo.Format.ARGB32,
+    "LA": cairo.Format.ARGB32,
+    "La": cairo.Format.ARGB32,
+    "P": cairo.Format.ARGB32,
+    "I;16": cairo.Format.RGB30,
+}
+# Modes besides the one in `_MODES` that can be written straight into a format.
+_EXTRA_MODES = {
+    cairo.Format.RGB24: ("RGBX",),
+    cairo.Format.ARGB32: ("RGBa", "LA", "La", "P"),
+    cairo.Format.RGB30: ("I;16",),
+    cairo.Format.RGB96F: ("I;16",),
+}
+_BITS_PER_PIXEL = {
+    cairo.Format.A1: 1,
+    cairo.Format.A8: 8,
+    cairo.Format.RGB24: 32,
+    cairo.Format.ARGB32: 32,
+    cairo.Format.RGB16_565: 16,
+    cairo.Format.RGB30: 32,
+    cairo.Format.RGB96F: 96,
+    cairo.Format.RGBA128F: 128,
+}
+# Formats Pillow can decode straight from the surface memory.
+_RAWMODES = {
+    cairo.Format.A1: "1;R",
+    cairo.Format.A8: "L",
+    cairo.Format.RGB24: "BGRX",
+    cairo.Format.ARGB32: "BGRa",
+    cairo.Format.RGB16_565: "BGR;16",
+}
+# Formats whose pixels Pillow can paste straight into the surface buffer, for a kernel
+# to fix them up in place.
+_PASTE_MODES = {
+    cairo.Format.A8: "L",
+    cairo.Format.RGB24: "RGBX",
+    cairo.Format.ARGB32: "RGBA",
+}
+# Modes Pillow pastes into a `_PASTE_MODES` format without converting them first.
+_PASTED_MODES = ("L", "RGB", "RGBX", "RGBA")
+# Modes `_paste_into` can map a buffer as, which Pillow keeps in memory exactly as
+# `Image.tobytes()` returns them, and their bytes per pixel.
+_MAPPED_MODES = {"L": 1, "P": 1, "I;16": 2, "RGBX": 4, "RGBA": 4}
+# Modes the other kernels read from a scratch buffer Pillow pastes them into, laid out
+# like its own memory, instead of a new `tobytes()` frame: the mode of the buffer and
+# its bytes per pixel. "RGB" keeps the padding byte, the kernels are told to skip it.
+_SCRATCH_MODES = {"RGB": ("RGBX", 4), "RGBA": ("RGBA", 4), "I;16": ("I;16", 2)}
+# Kernel `_core.convert` runs for each pair it handles on its own.
+_CONVERT_KERNELS = {
+    (cairo.Format.A1, "1"): _Kernel.Pil1ToCairoA1,
+    (cairo.Format.A8, "L"): _Kernel.PilLToCairoA8,
+    (cairo.Format.RGB24, "RGB"): _Kernel.PilRgbToCairoRgb24,
+    (cairo.Format.RGB24, "RGBX"): _Kernel.PilRgbxToCairoRgb24,
+    (cairo.Format.ARGB32, "RGBA"): _Kernel.PilRgbaToCairoArgb32,
+    (cairo.Format.ARGB32, "RGBa"): _Kernel.PilRgbaPremultipliedToCairoArgb32,
+    (cairo.Format.ARGB32, "LA"): _Kernel.PilLaToCairoArgb32,
+    (cairo.Format.ARGB32, "La"): _Kernel.PilLaPremultipliedToCairoArgb32,
+    (cairo.Format.RGB16_565, "RGB"): _Kernel.PilRgbToCairoRgb16,
+    (cairo.Format.RGB30, "RGB"): _Kernel.PilRgbToCairoRgb30,
+    (cairo.Format.RGB30, "I;16"): _Kernel.PilI16ToCairoRgb30,
+    (cairo.Format.RGB96F, "RGB"): _Kernel.PilRgbToCairoRgb96f,
+    (cairo.Format.RGB96F, "I;16"): _Kernel.PilI16ToCairoRgb96f,
+    (cairo.Format.RGBA128F, "RGBA"): _Kernel.PilRgbaToCairoRgba128f,
+}
+# `_write_cairo` pastes `_PASTED_MODES` straight into the surface while `_core.convert`
+# goes through `tobytes()`, past this many pixels the extra copy costs more than the
+# glue it saves.
+_MAX_COPY_PIXELS = 1 << 16
+# The kernel and the largest image to use `_core.convert` for.
+_CONVERT = {
+    (surface_format, mode): (
+        kernel,
+        _MAX_COPY_PIXELS
+        if surface_format in _PASTE_MODES and mode in _PASTED_MODES
+        else sys.maxsize,
+    )
+    for (surface_format, mode), kernel in _CONVERT_KERNELS.items()
+}
+_PIL_KERNELS = {
+    cairo.Format.RGB30: _cairo_rgb30_to_pil_rgb,
+    cairo.Format.RGB96F: _cairo_rgb96f_to_pil_rgb,
+    cairo.Format.RGBA128F: _cairo_rgba128f_to_pil_rgba,
+}
+_SRGB_PIL_KERNELS = {
+    cairo.Format.RGB96F: _cairo_rgb96f_to_pil_rgb_srgb,
+    cairo.Format.RGBA128F: _cairo_rgba128f_to_pil_rgba_srgb,
+}
+_DITHERED_CAIRO_FORMATS = {cairo.Format.RGB16_565}
+_DITHERED_PIL_KERNELS = {
+    cairo.Format.RGB30: _cairo_rgb30_to_pil_rgb_dithered,
+    cairo.Format.RGB96F: _cairo_rgb96f_to_pil_rgb_dithered,
+    cairo.Format.RGBA128F: _cairo_rgba128f_to_pil_rgba_dithered,
+}
+# Formats that can also be converted from/to a tuple of single band images.
+_PLANE_MODES = {
+    cairo.Format.RGB30: ("I", "I", "I"),
+    cairo.Format.RGB96F: ("F", "F", "F"),
+    cairo.Format.RGBA128F: ("F", "F", "F", "F"),
+}
+_PLANE_CAIRO_KERNELS = {
+    cairo.Format.RGB30: _pil_i_to_cairo_rgb30,
+    cairo.Format.RGB96F: _pil_f_to_cairo_rgb96f,
+    cairo.Format.RGBA128F: _pil_f_to_cairo_rgba128f,
+}
+
+
+def _size(im: Image.Image | RGB30 | RGBA128F) -> tuple[int, int]:
+    if isinstance(im, Image.Image):
+        return im.size
+    size = im[0].size
+    if any(plane.size != size for plane in im):
+        raise ValueError("Size mismatch")
+    return size
+
+
+def _check_planes(im: RGB30 | RGBA128F, surface_format: cairo.Format) -> None:
+    modes = _PLANE_MODES.get(surface_format)
+    if modes is None or tuple(plane.mode for plane in im) != modes:
+        raise ValueError("Wrong mode")
+
+
+def _check_rounding(rounding: Rounding) -> None:
+    if rounding not in ("pillow", "truncate", "nearest"):
+        raise ValueError(f"Unsupported rounding: {rounding}")
+
+
+def _check_dither(
+    dither: Dither | None,
+    surface_format: cairo.Format,
+    formats: Container[cairo.Format],
+) -> None:
+    # `formats` are the ones with a dithering kernel in the direction being converted.
+    if dither is None:
+        return
+    if dither not in ("ordered", "floyd-steinberg"):
+        raise ValueError(f"Unsupported dither: {dither}")
+    if surface_format not in formats:
+        raise ValueError("Wrong format")
+
+
+def _check_transfer(transfer: Transfer | None, surface_format: cairo.Format) -> None:
+    if transfer is None:
+        return
+    if transfer != "srgb":
+        raise ValueError(f"Unsupported transfer: {transfer}")
+    if surface_format not in _SRGB_PIL_KERNELS:
+        raise ValueError("Wrong format")
+
+
+def _check_mode(im: Image.Image, surface_format: cairo.Format) -> None:
+    if im.mode != _MODES[surface_format] and im.mode not in _EXTRA_MODES.get(
+        surface_format, ()
+    ):
+        raise ValueError("Wrong mode")
+
+
+def _palette_argb32(im: Image.Image) -> bytes:
+    # The palette of a "P" image as 256 native endian premultiplied ARGB pixels, with
+    # the "transparency" of the image applied.
+    palette = im.getpalette("RGBA") or []
+    palette += [0, 0, 0, 255] * (256 - len(palette) // 4)
+    alpha = palette[3::4]
+    transparency = im.info.get("transparency")
+    if isinstance(transparency, int):
+        alpha[transparency] = 0
+    elif isinstance(transparency, bytes):
+        alpha[: len(transparency)] = transparency
+    pixels = array("I")
+    for i, a in enumerate(alpha):
+        # round(c * a / 255), as Pillow premultiplies.
+        r, g, b = ((c * a * 2 + 255) // 510 for c in palette[i * 4 : i * 4 + 3])
+        pixels.append(a << 24 | r << 16 | g << 8 | b)
+    return pixels.tobytes()
+
+
+def _paste_into(
+    im: Image.Image, data: _Buffer, mode: str, stride: int, x0: int = 0
+) -> None:
+    # Map whole rows of `data` as a Pillow image and let Pillow copy the pixels straight
+    # into it, starting at column `x0`. Pillow keeps "RGB" as 4 bytes per pixel
+    # internally, so pasting into "RGBX" is a plain row copy. `Image.frombuffer` maps
+    # `data` read-only, so this pastes through the core image, which is not public API:
+    # test_paste_into checks it against the Pillow versions pyproject.toml allows.
+    im.load()
+    width = stride // _MAPPED_MODES[mode]
+    out = Image.frombuffer(mode, (width, im.height), data, "raw", mode, stride, 1)
+    out.im.paste(im.im, (x0, 0, x0 + im.width, im.height))
+
+
+def _write_cairo(
+    im: Image.Image | RGB30 | RGBA128F,
+    data: _Buffer,
+    surface_format: cairo.Format,
+    stride: int,
+    rounding: Rounding,
+    x0: int = 0,
+    dither: Dither | None = None,
+    transfer: Transfer | None = None,
+    pool: BufferPool | None = None,
+) -> None:
+    # `data` holds whole rows, `im` is written starting at column `x0` of each.
+    if surface_format not in _MODES:
+        raise NotImplementedError(f"Unsupported format: {surface_format}")
+    _check_rounding(rounding)
+    _check_dither(dither, surface_format, _DITHERED_CAIRO_FORMATS)
+    _check_transfer(transfer, surface_format)
+    if transfer is not None and (not isinstance(im, Image.Image) or im.mode == "I;16"):
+        # Only 8-bit levels are decoded from sRGB.
+        raise ValueError("Wrong mode")
+    w, h = _size(im)
+    view = memoryview(data)[x0 * _BITS_PER_PIXEL[surface_format] // 8 :]
+    start = _profile.clock()
+    if not isinstance(im, Image.Image):
+        _check_planes(im, surface_format)
+        planes = [plane.tobytes() for plane in im]
+        start = _profile.lap("copy", start)
+        _PLANE_CAIRO_KERNELS[surface_format](*planes, view, w, h, stride)
+        _profile.lap("kernel", start)
+        return
+    _check_mode(im, surface_format)
+    scratch = None
+    bpp = 3
+    if surface_format in _PASTE_MODES and im.mode in _PASTED_MODES:
+        _paste_into(im, data, _PASTE_MODES[surface_format], stride, x0)
+        pixels: _Buffer | bytes = b""
+    elif im.mode in _SCRATCH_MODES:
+        scratch_mode, bpp = _SCRATCH_MODES[im.mode]
+        pixels = scratch = _acquire(pool, scratch_mode, w, h, w * bpp)
+        _paste_into(im, scratch, scratch_mode, w * bpp, 0)
+    else:
+        pixels = im.tobytes()
+    start = _profile.lap("copy", start)
+    palette = _palette_argb32(im) if im.mode == "P" else b""
+    try:
+        _pack_cairo(
+            pixels,
+            view,
+            surface_format,
+            im.mode,
+            w,
+            h,
+            stride,
+            rounding,
+            dither,
+            transfer,
+            palette,
+            bpp,
+        )
+    finally:
+        if scratch is not None and pool is not None:
+            pool.release(scratch_mode, w, h, w * bpp, scratch)
+    _profile.lap("kernel", start)
+
+
+def _pack_cairo(
+    pixels: _Buffer | bytes,
+    view: _Buffer,
+    surface_format: cairo.Format,
+    mode: str,
+    w: int,
+    h: int,
+    stride: int,
+    rounding: Rounding,
+    dither: Dither | None = None,
+    transfer: Transfer | None = None,
+    palette: bytes = b"",
+    bpp: int = 3,
+) -> None:
+    # `pixels` are laid out like `Image.tobytes()` of a `mode` image, except that "RGB"
+    # pixels take `bpp` bytes (3 or 4). Pixels `_paste_into` already put in `view` are
+    # fixed up in place instead, and `pixels` is ignored.
+    if surface_format == cairo.Format.A1:
+        _pil_1_to_cairo_a1(pixels, view, w, h, stride)
+    elif surface_format == cairo.Format.RGB24:
+        _pil_rgbx_to_cairo_rgb24(view, w, h, stride)
+    elif surface_format == cairo.Format.ARGB32 and mode == "RGBa":
+        _pil_rgba_premultiplied_to_cairo_argb32(pixels, view, w, h, stride)
+    elif surface_format == cairo.Format.ARGB32 and mode in ("LA", "La"):
+        nearest = rounding != "truncate"
+        _pil_la_to_cairo_argb32(pixels, view, w, h, stride, mode == "La", nearest)
+    elif surface_format == cairo.Format.ARGB32 and mode == "P":
+        _pil_p_to_cairo_argb32(pixels, palette, view, w, h, stride)
+    elif surface_format == cairo.Format.ARGB32:
+        # Pillow premultiplies with rounding to nearest too.
+        _pil_rgba_to_cairo_argb32(view, w, h, stride, rounding != "truncate")
+    elif surface_format == cairo.Format.RGB16_565 and dither is not None:
+        _pil_rgb_to_cairo_rgb16_dithered(pixels, view, w, h, stride, dither, bpp)
+    elif surface_format == cairo.Format.RGB16_565:
+        _pil_rgb_to_cairo_rgb16(pixels, view, w, h, stride, bpp)
+    elif surface_format == cairo.Format.RGB30 and mode == "I;16":
+        _pil_i16_to_cairo_rgb30(pixels, view, w, h, stride)
+    elif surface_format == cairo.Format.RGB30:
+        _pil_rgb_to_cairo_rgb30(pixels, view, w, h, stride, bpp)
+    elif surface_format == cairo.Format.RGB96F and transfer is not None:
+        _pil_rgb_to_cairo_rgb96f_srgb(pixels, view, w, h, stride, bpp)
+    elif surface_format == cairo.Format.RGB96F and mode == "I;16":
+        _pil_i16_to_cairo_rgb96f(pixels, view, w, h, stride)
+    elif surface_format == cairo.Format.RGB96F:
+        _pil_rgb_to_cairo_rgb96f(pixels, view, w, h, stride, bpp)
+    elif surface_format == cairo.Format.RGBA128F and transfer is not None:
+        _pil_rgba_to_cairo_rgba128f_srgb(pixels, view, w, h, stride)
+    elif surface_format == cairo.Format.RGBA128F:
+        _pil_rgba_to_cairo_rgba128f(pixels, view, w, h, stride)
+
+
+def _acquire(pool: BufferPool | None, mode: str, w: int, h: int, row: int) -> bytearray:
+    if pool is None:
+        return bytearray(row * h)
+    return pool.acquire(mode, w, h, row)
+
+
+# The scratch buffers are only valid inside the `with` block, Pillow copies them on
+# decode.
+@contextmanager
+def _convert_pil(
+    data: _Buffer,
+    surface_format: cairo.Format,
+    w: int,
+    h: int,
+    stride: int,
+    pool: BufferPool | None,
+    rounding: Rounding = "pillow",
+    dither: Dither | None = None,
+    transfer: Transfer | None = None,
+) -> Iterator[bytearray]:
+    mode = _MODES[surface_format]
+    row = w * Image.getmodebands(mode)
+    out = _acquire(pool, mode, w, h, row)
+    try:
+        start = _profile.clock()
+        _unpack_pil(data, out, surface_format, w, h, stride, rounding, dither, transfer)
+        _profile.lap("kernel", start)
+        yield out
+    finally:
+        if pool is not None:
+            pool.release(mode, w, h, row, out)
+
+
+def _unpack_pil(
+    data: _Buffer,
+    out: _Buffer,
+    surface_format: cairo.Format,
+    w: int,
+    h: int,
+    stride: int,
+    rounding: Rounding = "pillow",
+    dither: Dither | None = None,
+    transfer: Transfer | None = None,
+) -> None:
+    # Write the pixels into `out` laid out like `Image.tobytes()`. For ARGB32,
+    # truncating is what Pillow's "BGRa" decoder does, so this also gives the same
+    # pixels with "pillow" rounding.
+    if surface_format == cairo.Format.ARGB32:
+        _cairo_argb32_to_pil_rgba(data, out, w, h, stride, rounding == "nearest")
+    elif dither is not None and transfer is not None:
+        _DITHERED_PIL_KERNELS[surface_format](data, out, w, h, stride, dither, True)
+    elif dither is not None:
+        _DITHERED_PIL_KERNELS[surface_format](data, out, w, h, stride, dither)
+    elif transfer is not None:
+        _SRGB_PIL_KERNELS[surface_format](data, out, w, h, stride)
+    else:
+        _PIL_KERNELS[surface_format](data, out, w, h, stride)
+
+
+def _rawmode(surface_format: cairo.Format, rounding: Rounding) -> str | None:
+    _check_rounding(rounding)
+    # Pillow's "BGRa" decoder is what "pillow" rounding means, the others need our own
+    # kernel.
+    if surface_format == cairo.Format.ARGB32 and rounding != "pillow":
+        return None
+    return _RAWMODES.get(surface_format)
+
+
+def _decode_pil(
+    data: _Buffer,
+    surface_format: cairo.Format,
+    w: int,
+    h: int,
+    stride: int,
+    pool: BufferPool | None,
+    rounding: Rounding,
+    dither: Dither | None = None,
+    transfer: Transfer | None = None,
+) -> Image.Image:
+    mode = _MODES.get(surface_format)
+    if mode is None:
+        raise NotImplementedError(f"Unsupported format: {surface_format}")
+    _check_dither(dither, surface_format, _DITHERED_PIL_KERNELS)
+    _check_transfer(transfer, surface_format)
+    rawmode = _rawmode(surface_format, rounding)
+    if rawmode is not None:
+        start = _profile.clock()
+        im = Image.frombytes(mode, (w, h), data, "raw", rawmode, stride)
+        _profile.lap("copy", start)
+        return im
+    with _convert_pil(
+        data, surface_format, w, h, stride, pool, rounding, dither, transfer
+    ) as out:
+        start = _profile.clock()
+        im = Image.frombytes(mode, (w, h), out)
+        _profile.lap("copy", start)
+        return im
@@ -0,0 +1,107 @@
+from collections import OrderedDict
+from collections.abc import Hashable
+from threading import Lock
+
+import cairo
+
+__all__ = ["BufferPool"]
+
+
+class BufferPool:
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._nbytes = 0
+        self._lock = Lock()
+        self._free: dict[Hashable, list[object]] = {}
+        # Every pooled object, least recently released first.
+        self._lru: OrderedDict[int, tuple[Hashable, int]] = OrderedDict()
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def _take(self, key: Hashable) -> object | None:
+        with self._lock:
+            items = self._free.get(key)
+            if not items:
+                self.misses += 1
+                return None
+            item = items.pop()
+            if not items:
+                del self._free[key]
+            _, size = self._lru.pop(id(item))
+            self._nbytes -= size
+            self.hits += 1
+            return item
+
+    def _put(self, key: Hashable, item: object, size: int) -> None:
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if id(item) in self._lru:
+                return
+            self._free.setdefault(key, []).append(item)
+            self._lru[id(item)] = (key, size)
+            self._nbytes += size
+            while self._nbytes > self.max_bytes:
+                item_id, (old_key, old_size) = self._lru.popitem(last=False)
+                items = self._free[old_key]
+                items.pop(next(i for i, x in enumerate(items) if id(x) == item_id))
+                if not items:
+                    del self._free[old_key]
+                self._nbytes -= old_size
+                self.evictions += 1
+
+    def acquire(
+        self,
+        format: cairo.Format | str,
+        width: int,
+        height: int,
+        stride: int,
+    ) -> bytearray:
+        data = self._take(("buffer", format, width, height, stride))
+        if data is None:
+            return bytearray(stride * height)
+        assert isinstance(data, bytearray)
+        return data
+
+    def release(
+        self,
+        format: cairo.Format | str,
+        width: int,
+        height: int,
+        stride: int,
+        data: bytearray,
+    ) -> None:
+        self._put(("buffer", format, width, height, stride), data, len(data))
+
+    def acquire_surface(
+        self,
+        format: cairo.Format,
+        width: int,
+        height: int,
+    ) -> cairo.ImageSurface:
+        stride = format.stride_for_width(width)
+        surface = self._take(("surface", format, width, height, stride))
+        if surface is None:
+            data = bytearray(stride * height)
+            return cairo.ImageSurface.create_for_data(
+                data, format, width, height, stride
+            )
+        assert isinstance(surface, cairo.ImageSurface)
+        return surface
+
+    def release_surface(self, surface: cairo.ImageSurface) -> None:
+        stride = surface.get_stride()
+        height = surface.get_height()
+        key = ("surface", surface.get_format(), surface.get_width(), height, stride)
+        self._put(key, surface, stride * height)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._free.clear()
+            self._lru.clear()
+            self._nbytes = 0
@@ -0,0 +1,90 @@
+import threading
+from collections.abc import Callable
+from functools import wraps
+from time import perf_counter
+from typing import Any, TypeVar
+
+import cairo
+from PIL import Image
+
+__all__ = ["ProfileHook", "get_profile_hook", "set_profile_hook"]
+
+ProfileHook = Callable[[str, cairo.Format, int, int, int, dict[str, float]], None]
+
+_F = TypeVar("_F", bound=Callable[..., Any])
+
+_hook: ProfileHook | None = None
+# Stage timings of the outermost profiled call running on each thread.
+_local = threading.local()
+
+
+def set_profile_hook(hook: ProfileHook | None) -> None:
+    global _hook
+    _hook = hook
+
+
+def get_profile_hook() -> ProfileHook | None:
+    return _hook
+
+
+def clock() -> float:
+    # Only read the clock while a hook is set, `lap` ignores the start time otherwise.
+    return 0.0 if _hook is None else perf_counter()
+
+
+def lap(stage: str, start: float) -> float:
+    if _hook is None:
+        return 0.0
+    now = perf_counter()
+    stages: dict[str, float] | None = getattr(_local, "stages", None)
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + now - start
+    return now
+
+
+def _report(
+    name: str,
+    result: object,
+    args: tuple[Any, ...],
+    kwargs: dict[str, Any],
+    stages: dict[str, float],
+) -> None:
+    hook = _hook
+    surface = next(
+        (
+            x
+            for x in (result, *args, *kwargs.values())
+            if isinstance(x, cairo.ImageSurface)
+        ),
+        None,
+    )
+    if hook is None or surface is None:
+        return
+    w = surface.get_width()
+    h = surface.get_height()
+    # Decoding a box reports the size of the box.
+    if isinstance(result, Image.Image):
+        w, h = result.size
+    hook(name, surface.get_format(), w, h, surface.get_stride() * h, stages)
+
+
+def profiled(func: _F) -> _F:
+    name = func.__name__
+
+    @wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        if _hook is None or getattr(_local, "stages", None) is not None:
+            # Nested calls add their stages to the outermost one.
+            return func(*args, **kwargs)
+        stages: dict[str, float] = {"copy": 0.0, "kernel": 0.0, "surface": 0.0}
+        _local.stages = stages
+        start = perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            _local.stages = None
+        stages["total"] = perf_counter() - start
+        _report(name, result, args, kwargs, stages)
+        return result
+
+    return wrapper  # type: ignore[return-value]
@@ -0,0 +1,309 @@
+import os
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any
+
+import cairo
+from PIL import Image
+
+from pil_cairo._pixels import (
+    _FORMATS,
+    _MAPPED_MODES,
+    _MODES,
+    Rounding,
+    _check_mode,
+    _check_rounding,
+    _decode_pil,
+    _pack_cairo,
+    _palette_argb32,
+    _paste_into,
+    _unpack_pil,
+    _write_cairo,
+)
+
+__all__ = ["iter_to_cairo", "iter_to_pil"]
+
+# Formats whose conversion is only a repack of the pixels, which costs about as much as
+# copying them into shared memory. The parent converts these itself instead of paying
+# for two more copies.
+_INLINE_FORMATS = {
+    cairo.Format.A1,
+    cairo.Format.A8,
+    cairo.Format.RGB24,
+    cairo.Format.RGB16_565,
+}
+
+
+def _raw_size(mode: str, w: int, h: int) -> int:
+    # Size of `Image.tobytes()`, "1" is packed 8 pixels to a byte.
+    if mode == "1":
+        return (w + 7) // 8 * h
+    if mode == "I;16":
+        return w * h * 2
+    return w * h * Image.getmodebands(mode)
+
+
+def _to_pil_worker(
+    src_name: str,
+    dst_name: str,
+    surface_format: int,
+    w: int,
+    h: int,
+    stride: int,
+    rounding: Rounding,
+) -> None:
+    src = SharedMemory(src_name)
+    dst = SharedMemory(dst_name)
+    try:
+        _unpack_pil(
+            src.buf, dst.buf, cairo.Format(surface_format), w, h, stride, rounding
+        )
+    finally:
+        src.close()
+        dst.close()
+
+
+def _to_cairo_worker(
+    src_name: str | None,
+    dst_name: str,
+    mode: str,
+    surface_format: int,
+    w: int,
+    h: int,
+    stride: int,
+    rounding: Rounding,
+    palette: bytes,
+) -> None:
+    # Without a source block the parent pasted the pixels into `dst` already.
+    src = None if src_name is None else SharedMemory(src_name)
+    dst = SharedMemory(dst_name)
+    try:
+        pixels = b"" if src is None else src.buf
+        fmt = cairo.Format(surface_format)
+        _pack_cairo(pixels, dst.buf, fmt, mode, w, h, stride, rounding, palette=palette)
+    finally:
+        if src is not None:
+            src.close()
+        dst.close()
+
+
+# A job is the worker and its arguments, or None to convert in the parent, the shared
+# memory blocks it uses and the function returning its result once it is done.
+_Job = tuple[
+    Callable[..., None] | None, tuple[Any, ...], list[SharedMemory], Callable[[], Any]
+]
+_Task = tuple[Future[None] | None, list[SharedMemory], Callable[[], Any]]
+
+
+def _release(blocks: list[SharedMemory]) -> None:
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+
+
+def _finish(task: _Task) -> Any:
+    future, blocks, collect = task
+    try:
+        if future is not None:
+            future.result()
+        return collect()
+    finally:
+        _release(blocks)
+
+
+def _run(
+    jobs: Iterator[_Job],
+    executor: ProcessPoolExecutor | None,
+    max_workers: int | None,
+    max_pending: int | None,
+) -> Iterator[Any]:
+    # Keep at most `max_pending` items in flight and hand the results back in order, so
+    # only that many sets of shared memory blocks exist at a time however long the input
+    # is.
+    if max_pending is None:
+        max_pending = 2 * (max_workers or os.cpu_count() or 1)
+    if max_pending < 1:
+        raise ValueError("max_pending must be positive")
+    own = executor is None
+    if executor is None:
+        executor = ProcessPoolExecutor(max_workers)
+    pending: deque[_Task] = deque()
+    try:
+        for worker, args, blocks, collect in jobs:
+            future = None
+            if worker is not None:
+                try:
+                    future = executor.submit(worker, *args)
+                except BaseException:
+                    _release(blocks)
+                    raise
+            pending.append((future, blocks, collect))
+            if len(pending) >= max_pending:
+                yield _finish(pending.popleft())
+        while pending:
+            yield _finish(pending.popleft())
+    finally:
+        for future, _, _ in pending:
+            if future is not None:
+                future.cancel()
+        for future, blocks, _ in pending:
+            # A running worker still has the blocks open, wait for it before unlinking
+            # them.
+            if future is not None and not future.cancelled():
+                future.exception()
+            _release(blocks)
+        if own:
+            executor.shutdown()
+
+
+def _block(size: int) -> SharedMemory:
+    # Zero sized blocks are not allowed.
+    return SharedMemory(create=True, size=max(size, 1))
+
+
+def _fill(shm: SharedMemory, im: Image.Image) -> None:
+    # Let Pillow copy the pixels straight into the block where its memory layout allows
+    # it, rather than copying them once into `tobytes()` and once more into the block.
+    if im.mode in _MAPPED_MODES:
+        _paste_into(im, shm.buf, im.mode, im.width * _MAPPED_MODES[im.mode])
+    else:
+        pixels = im.tobytes()
+        shm.buf[: len(pixels)] = pixels
+
+
+def _collect_pil(dst: SharedMemory, mode: str, w: int, h: int) -> Image.Image:
+    with dst.buf[: _raw_size(mode, w, h)] as data:
+        return Image.frombytes(mode, (w, h), data)
+
+
+def _collect_cairo(
+    dst: SharedMemory,
+    surface_format: cairo.Format,
+    w: int,
+    h: int,
+    stride: int,
+) -> cairo.ImageSurface:
+    with dst.buf[: stride * h] as data:
+        out = bytearray(data)
+    return cairo.ImageSurface.create_for_data(out, surface_format, w, h, stride)
+
+
+def _new_surface(
+    im: Image.Image,
+    surface_format: cairo.Format,
+    stride: int,
+    rounding: Rounding,
+) -> cairo.ImageSurface:
+    data = bytearray(stride * im.height)
+    _write_cairo(im, data, surface_format, stride, rounding)
+    return cairo.ImageSurface.create_for_data(
+        data, surface_format, im.width, im.height, stride
+    )
+
+
+def _pil_jobs(
+    surfaces: Iterable[cairo.ImageSurface], rounding: Rounding
+) -> Iterator[_Job]:
+    for surface in surfaces:
+        surface_format = surface.get_format()
+        mode = _MODES.get(surface_format)
+        if mode is None:
+            raise NotImplementedError(f"Unsupported format: {surface_format}")
+        surface.flush()
+        w = surface.get_width()
+        h = surface.get_height()
+        stride = surface.get_stride()
+        data = surface.get_data()
+        if surface_format in _INLINE_FORMATS:
+            decode = partial(
+                _decode_pil, data, surface_format, w, h, stride, None, rounding
+            )
+            yield None, (), [], decode
+            continue
+        src = _block(stride * h)
+        src.buf[: stride * h] = data
+        dst = _block(_raw_size(mode, w, h))
+        # Send formats as plain ints, so the tasks do not rely on pickling pycairo
+        # enums.
+        args = (src.name, dst.name, int(surface_format), w, h, stride, rounding)
+        yield _to_pil_worker, args, [src, dst], partial(_collect_pil, dst, mode, w, h)
+
+
+def _cairo_jobs(
+    images: Iterable[Image.Image],
+    surface_format: cairo.Format | None,
+    rounding: Rounding,
+) -> Iterator[_Job]:
+    for im in images:
+        target = _FORMATS.get(im.mode) if surface_format is None else surface_format
+        if target is None:
+            raise NotImplementedError(f"Unsupported mode: {im.mode}")
+        if target not in _MODES:
+            raise NotImplementedError(f"Unsupported format: {target}")
+        _check_mode(im, target)
+        w, h = im.size
+        stride = target.stride_for_width(w)
+        if target in _INLINE_FORMATS:
+            yield None, (), [], partial(_new_surface, im, target, stride, rounding)
+            continue
+        dst = _block(stride * h)
+        blocks = [dst]
+        try:
+            if target == cairo.Format.ARGB32 and im.mode == "RGBA":
+                # Paste into the surface rows, the worker premultiplies them in place.
+                _paste_into(im, dst.buf, "RGBA", stride, 0)
+                src_name = None
+            else:
+                src = _block(_raw_size(im.mode, w, h))
+                blocks.append(src)
+                _fill(src, im)
+                src_name = src.name
+            palette = _palette_argb32(im) if im.mode == "P" else b""
+        except BaseException:
+            _release(blocks)
+            raise
+        args = (
+            src_name,
+            dst.name,
+            im.mode,
+            int(target),
+            w,
+            h,
+            stride,
+            rounding,
+            palette,
+        )
+        yield (
+            _to_cairo_worker,
+            args,
+            blocks,
+            partial(_collect_cairo, dst, target, w, h, stride),
+        )
+
+
+def iter_to_pil(
+    surfaces: Iterable[cairo.ImageSurface],
+    max_workers: int | None = None,
+    max_pending: int | None = None,
+    rounding: Rounding = "pillow",
+    executor: ProcessPoolExecutor | None = None,
+) -> Iterator[Image.Image]:
+    _check_rounding(rounding)
+    return _run(_pil_jobs(surfaces, rounding), executor, max_workers, max_pending)
+
+
+def iter_to_cairo(
+    images: Iterable[Image.Image],
+    format: cairo.Format | None = None,
+    max_workers: int | None = None,
+    max_pending: int | None = None,
+    rounding: Rounding = "pillow",
+    executor: ProcessPoolExecutor | None = None,
+) -> Iterator[cairo.ImageSurface]:
+    _check_rounding(rounding)
+    return _run(
+        _cairo_jobs(images, format, rounding), executor, max_workers, max_pending
+    )
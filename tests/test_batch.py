@@ -0,0 +1,59 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import cairo
+import pytest
+from PIL import Image
+
+from pil_cairo import Rounding, to_cairo, to_cairo_rgba128f, to_pil
+from pil_cairo.batch import iter_to_cairo, iter_to_pil
+
+
+def make_images() -> list[Image.Image]:
+    images = []
+    for size in [1, 32, 99]:
+        gradient = Image.radial_gradient("L").resize((size, size + 3))
+        images.append(gradient.convert("1"))
+        images.append(gradient)
+        images.append(gradient.convert("RGB"))
+        images.append(gradient.convert("P"))
+        images.append(Image.merge("RGBA", (gradient, gradient, gradient, gradient)))
+    return images
+
+
+def test_iter_to_cairo() -> None:
+    images = make_images()
+    surfaces = list(iter_to_cairo(images, max_workers=2, max_pending=3))
+    assert len(surfaces) == len(images)
+    for im, surface in zip(images, surfaces):
+        expected = to_cairo(im)
+        assert surface.get_format() == expected.get_format()
+        assert bytes(surface.get_data()) == bytes(expected.get_data()), im.mode
+    rgb = [im for im in images if im.mode == "RGB"]
+    for im, surface in zip(rgb, iter_to_cairo(rgb, cairo.Format.RGB30, max_workers=2)):
+        assert surface.get_format() == cairo.Format.RGB30
+        assert to_pil(surface).tobytes() == im.tobytes()
+    rgba = [im for im in images if im.mode == "RGBA"]
+    for im, surface in zip(
+        rgba, iter_to_cairo(rgba, cairo.Format.RGBA128F, max_workers=2)
+    ):
+        assert bytes(surface.get_data()) == bytes(to_cairo_rgba128f(im).get_data())
+    with pytest.raises(ValueError):
+        list(iter_to_cairo(images, cairo.Format.RGB16_565, max_workers=1))
+
+
+def test_iter_to_pil() -> None:
+    sources = make_images()
+    surfaces = [to_cairo(im) for im in sources]
+    surfaces += [to_cairo_rgba128f(im) for im in sources if im.mode == "RGBA"]
+    with ProcessPoolExecutor(2) as executor:
+        roundings: list[Rounding] = ["pillow", "nearest"]
+        for rounding in roundings:
+            images = iter_to_pil(surfaces, rounding=rounding, executor=executor)
+            for surface, im in zip(surfaces, images, strict=True):
+                expected = to_pil(surface, rounding=rounding)
+                assert im.mode == expected.mode
+                assert im.tobytes() == expected.tobytes()
+        # Stopping early leaves no work behind.
+        images = iter_to_pil(surfaces, max_pending=2, executor=executor)
+        next(images)
+        images.close()
@@ -1,20 +1,54 @@
+import ctypes
+import gc
+import sys
+import tracemalloc
 from io import BytesIO
 
 import cairo
 import numpy as np
+import PIL
+import pytest
 from PIL import Image, ImageDraw
 
 from pil_cairo import (
+    BufferPool,
+    Dither,
+    Rounding,
+    SurfaceImage,
+    array_to_cairo,
+    cairo_to_array,
+    convert_many,
+    frames_to_cairo,
+    get_profile_hook,
+    get_threads,
+    iter_to_cairo_tiles,
+    load_surface,
+    save_surface,
+    set_profile_hook,
+    set_threads,
+    surfaces_to_frames,
     to_cairo,
+    to_cairo_into,
     to_cairo_rgb16,
     to_cairo_rgb30,
     to_cairo_rgb96f,
     to_cairo_rgba128f,
     to_pil,
+    to_pil_into,
+    to_pil_many,
     to_pil_rgb30,
     to_pil_rgb96f,
     to_pil_rgba128f,
+    to_pil_rows,
 )
+from pil_cairo._core import (
+    Kernel,
+    convert,
+    get_avx2,
+    pil_rgb_to_cairo_rgb24,
+    set_avx2,
+)
+from pil_cairo._pixels import _CONVERT, _MAPPED_MODES, _paste_into
 
 
 def image_same(im1: Image.Image, im2: Image.Image, threshold: int = 0) -> bool:
@@ -50,7 +84,8 @@ def l_to_f(im: Image.Image) -> Image.Image:
 
 
 SIZES = [1, 32, 99]
-# Due to some reason (premultiplied alpha, rounding, etc.), there may be tiny difference.
+# Due to some reason (premultiplied alpha, rounding, etc.), there may be tiny
+# difference.
 THRESHOLD = 1
 # Formats without alpha and rounding.
 A1_A8_RGB24_THRESHOLD = 0
@@ -110,6 +145,21 @@ def test_to_cairo__rgba() -> None:
         assert image_same(im, im2, THRESHOLD), size
 
 
+def test_to_cairo__rgba_matches_pillow_packer() -> None:
+    if sys.byteorder != "little":
+        pytest.skip("Pillow's BGRa raw mode only matches ARGB32 on little endian")
+    r = Image.linear_gradient("L")
+    g = Image.radial_gradient("L")
+    b = Image.linear_gradient("L").rotate(90)
+    a = Image.radial_gradient("L").rotate(45)
+    rgba = Image.merge("RGBA", (r, g, b, a))
+    for size in SIZES:
+        im = rgba.resize((size, size))
+        surface = to_cairo(im)
+        stride = surface.get_stride()
+        assert bytes(surface.get_data()) == im.tobytes("raw", "BGRa", stride), size
+
+
 def test_to_cairo_rgb16() -> None:
     r = Image.linear_gradient("L")
     g = Image.new("L", (256, 256))
@@ -248,6 +298,45 @@ def test_to_pil__a8() -> None:
             assert image_same(im, im2, A1_A8_RGB24_THRESHOLD), size
 
 
+def test_to_pil__a8_no_copy() -> None:
+    for size in SIZES:
+        with cairo.ImageSurface(cairo.Format.A8, size, size) as surface:
+            cr = cairo.Context(surface)
+            cr.set_source_rgba(0, 0, 0, 0.5)
+            cr.paint()
+            im = to_pil(surface, copy=False)
+            assert image_same(im, to_pil(surface), A1_A8_RGB24_THRESHOLD), size
+            cr.set_operator(cairo.Operator.SOURCE)
+            cr.set_source_rgba(0, 0, 0, 1)
+            cr.paint()
+            surface.flush()
+            assert im.getextrema() == (255, 255), size
+
+    # The image keeps the surface memory alive after the last reference to the surface
+    # is dropped.
+    surface = cairo.ImageSurface(cairo.Format.A8, 99, 99)
+    cr = cairo.Context(surface)
+    gradient = cairo.LinearGradient(0, 0, 99, 99)
+    gradient.add_color_stop_rgba(0, 0, 0, 0, 0)
+    gradient.add_color_stop_rgba(1, 0, 0, 0, 1)
+    cr.set_source(gradient)
+    cr.paint()
+    expected = to_pil(surface).tobytes()
+    im = to_pil(surface, copy=False)
+    del cr, surface
+    gc.collect()
+    # Reuse freed memory of the same size, if any.
+    others = [cairo.ImageSurface(cairo.Format.A8, 99, 99) for _ in range(8)]
+    for other in others:
+        cairo.Context(other).paint()
+    assert im.tobytes() == expected
+
+    with pytest.raises(ValueError):
+        to_pil(cairo.ImageSurface(cairo.Format.ARGB32, 4, 4), copy=False)
+    with pytest.raises(ValueError):
+        to_pil(cairo.ImageSurface(cairo.Format.A8, 4, 4), copy=False, box=(0, 0, 2, 2))
+
+
 def test_to_pil__rgb24() -> None:
     for size in SIZES:
         with cairo.ImageSurface(cairo.Format.RGB24, size, size) as surface:
@@ -404,3 +493,919 @@ def test_to_pil_rgba128f() -> None:
             surface.write_to_png(f)
             im2 = Image.open(f)
             assert image_same(im, im2, THRESHOLD), size
+
+
+def test_convert_many() -> None:
+    r = Image.linear_gradient("L")
+    g = Image.new("L", (256, 256))
+    b = Image.radial_gradient("L")
+    a = Image.linear_gradient("L")
+    rgba = Image.merge("RGBA", (r, g, b, a))
+    ims = [rgba.resize((size, size)) for size in SIZES]
+    surfaces = convert_many(ims, max_workers=4)
+    assert [s.get_format() for s in surfaces] == [cairo.Format.ARGB32] * len(SIZES)
+    for im, im2 in zip(ims, to_pil_many(surfaces, max_workers=4)):
+        assert image_same(im, im2, THRESHOLD), im.size
+    surfaces = convert_many(ims, to_cairo_rgba128f, max_workers=4)
+    assert [s.get_format() for s in surfaces] == [cairo.Format.RGBA128F] * len(SIZES)
+
+
+def test_set_threads() -> None:
+    r = Image.linear_gradient("L")
+    g = Image.new("L", (256, 256))
+    b = Image.radial_gradient("L")
+    a = Image.linear_gradient("L")
+    im = Image.merge("RGBA", (r, g, b, a)).resize((1000, 700))
+    expected = bytes(to_cairo_rgba128f(im).get_data())
+    set_threads(4)
+    try:
+        assert get_threads() == 4
+        surface = to_cairo_rgba128f(im)
+        assert bytes(surface.get_data()) == expected
+        assert image_same(to_pil(surface), im, THRESHOLD)
+    finally:
+        set_threads(1)
+
+
+def test_avx2() -> None:
+    # Every alpha with every channel value, and an odd width for the loop tails.
+    arr = np.random.default_rng(0).integers(0, 256, (251, 263, 4), np.uint8)
+    arr[..., 3] = np.arange(263 * 251).reshape(251, 263) % 256
+    rgba = Image.fromarray(arr, "RGBA")
+    floats = np.asarray(rgba, np.float32) / 255
+    planes = tuple(Image.fromarray(floats[..., c]) for c in range(4))
+    argb32 = to_cairo(rgba)
+    rgb96f = to_cairo_rgb96f(rgba.convert("RGB"))
+    rgba128f = to_cairo_rgba128f(rgba)
+    roundings: list[Rounding] = ["pillow", "truncate", "nearest"]
+
+    def run() -> list[bytes]:
+        return [
+            *(bytes(to_cairo(rgba, rounding=r).get_data()) for r in roundings),
+            *(to_pil(argb32, rounding=r).tobytes() for r in roundings),
+            bytes(to_cairo_rgb96f(rgba.convert("RGB")).get_data()),
+            bytes(to_cairo_rgba128f(rgba).get_data()),
+            bytes(to_cairo_rgba128f(planes).get_data()),
+            bytes(to_cairo_rgba128f(floats).get_data()),
+            to_pil(rgb96f).tobytes(),
+            to_pil(rgba128f).tobytes(),
+            *(plane.tobytes() for plane in to_pil_rgba128f(rgba128f)),
+            np.asarray(to_pil_rgba128f(rgba128f, interleaved=True)).tobytes(),
+        ]
+
+    set_avx2(False)
+    try:
+        assert not get_avx2()
+        baseline = run()
+    finally:
+        set_avx2(True)
+    assert run() == baseline
+
+
+def test_to_cairo_into() -> None:
+    r = Image.linear_gradient("L")
+    g = Image.new("L", (256, 256))
+    b = Image.radial_gradient("L")
+    a = Image.linear_gradient("L")
+    rgba = Image.merge("RGBA", (r, g, b, a))
+    for size in SIZES:
+        im = rgba.resize((size, size))
+        with cairo.ImageSurface(cairo.Format.ARGB32, size, size) as surface:
+            to_cairo_into(im, surface)
+            assert bytes(surface.get_data()) == bytes(to_cairo(im).get_data()), size
+        with cairo.ImageSurface(cairo.Format.RGB96F, size, size) as surface:
+            to_cairo_into(im.convert("RGB"), surface)
+            expected = to_cairo_rgb96f(im.convert("RGB"))
+            assert bytes(surface.get_data()) == bytes(expected.get_data()), size
+        with cairo.ImageSurface(cairo.Format.RGBA128F, size, size) as surface:
+            planes = tuple(l_to_f(band) for band in im.split())
+            to_cairo_into(planes, surface)
+            expected = to_cairo_rgba128f(planes)
+            assert bytes(surface.get_data()) == bytes(expected.get_data()), size
+    with cairo.ImageSurface(cairo.Format.ARGB32, 2, 2) as surface:
+        with pytest.raises(ValueError):
+            to_cairo_into(Image.new("RGBA", (3, 2)), surface)
+        with pytest.raises(ValueError):
+            to_cairo_into(Image.new("RGB", (2, 2)), surface)
+
+
+def test_to_cairo_into_allocations() -> None:
+    rgb = Image.radial_gradient("L").resize((512, 512)).convert("RGB")
+    rgba = rgb.convert("RGBA")
+    i16 = Image.linear_gradient("L").resize((512, 512)).convert("I;16")
+    pool = BufferPool()
+    for surface_format, im in [
+        (cairo.Format.RGB24, rgb),
+        (cairo.Format.ARGB32, rgba),
+        (cairo.Format.RGB16_565, rgb),
+        (cairo.Format.RGB30, rgb),
+        (cairo.Format.RGB30, i16),
+        (cairo.Format.RGB96F, rgb),
+        (cairo.Format.RGB96F, i16),
+        (cairo.Format.RGBA128F, rgba),
+    ]:
+        with cairo.ImageSurface(surface_format, 512, 512) as surface:
+            to_cairo_into(im, surface, pool=pool)
+            expected = bytes(surface.get_data())
+            tracemalloc.start()
+            try:
+                to_cairo_into(im, surface, pool=pool)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            # Well below a single 512x512 frame of any mode.
+            assert peak < 1 << 16, (surface_format, im.mode, peak)
+            assert bytes(surface.get_data()) == expected
+
+
+def test_paste_into() -> None:
+    # `_paste_into` relies on Pillow internals, re-check it before allowing a new major
+    # version in pyproject.toml.
+    assert 12 <= int(PIL.__version__.split(".")[0]) < 13
+    gray = Image.radial_gradient("L").resize((37, 29))
+    rgba = Image.merge(
+        "RGBA", (gray, gray.rotate(90), gray.rotate(180), gray.rotate(270))
+    )
+    i16 = Image.frombytes("I;16", gray.size, np.asarray(gray, np.uint16).tobytes())
+    for im, mode in [
+        (gray, "L"),
+        (gray.convert("P"), "P"),
+        (rgba.convert("RGB"), "RGBX"),
+        (rgba.convert("RGBX"), "RGBX"),
+        (rgba, "RGBA"),
+        (i16, "I;16"),
+    ]:
+        stride = 45 * _MAPPED_MODES[mode]
+        data = bytearray(stride * im.height)
+        _paste_into(im, data, mode, stride, 5)
+        out = Image.frombytes(mode, (45, im.height), bytes(data))
+        assert out.crop((5, 0, 42, im.height)).tobytes() == im.convert(mode).tobytes()
+        assert not any(out.crop((0, 0, 5, im.height)).tobytes())
+        assert not any(out.crop((42, 0, 45, im.height)).tobytes())
+
+
+def test_to_pil_into() -> None:
+    for surface_format, mode in [
+        (cairo.Format.A8, "L"),
+        (cairo.Format.RGB24, "RGB"),
+        (cairo.Format.ARGB32, "RGBA"),
+        (cairo.Format.RGB30, "RGB"),
+        (cairo.Format.RGBA128F, "RGBA"),
+    ]:
+        for size in SIZES:
+            with cairo.ImageSurface(surface_format, size, size) as surface:
+                cr = cairo.Context(surface)
+                gradient = cairo.LinearGradient(0, 0, size, size)
+                gradient.add_color_stop_rgba(0, 1, 0, 0, 0)
+                gradient.add_color_stop_rgba(1, 0, 0, 1, 1)
+                cr.set_source(gradient)
+                cr.paint()
+                im = Image.new(mode, (size, size))
+                to_pil_into(surface, im)
+                assert image_same(im, to_pil(surface), A1_A8_RGB24_THRESHOLD), size
+    with cairo.ImageSurface(cairo.Format.RGB96F, 32, 32) as surface:
+        planes = (
+            Image.new("F", (32, 32)),
+            Image.new("F", (32, 32)),
+            Image.new("F", (32, 32)),
+        )
+        to_pil_into(surface, planes)
+        expected = to_pil_rgb96f(surface)
+        for plane, expected_plane in zip(planes, expected):
+            assert plane.tobytes() == expected_plane.tobytes()
+
+
+def test_buffer_pool() -> None:
+    pool = BufferPool()
+    im = Image.radial_gradient("L").resize((99, 99)).convert("RGBA")
+    surface = to_cairo(im, pool)
+    expected = bytes(surface.get_data())
+    pool.release_surface(surface)
+    assert (pool.hits, pool.misses) == (0, 1)
+    reused = to_cairo(im.transpose(Image.Transpose.ROTATE_90), pool)
+    assert reused is surface
+    assert (pool.hits, pool.misses) == (1, 1)
+    pool.release_surface(reused)
+    assert bytes(to_cairo(im, pool).get_data()) == expected
+    with cairo.ImageSurface(cairo.Format.RGBA128F, 32, 32) as surface:
+        first = to_pil(surface, pool=pool)
+        assert image_same(to_pil(surface, pool=pool), first)
+        to_pil_rgba128f(surface, pool)
+        to_pil_rgba128f(surface, pool)
+    assert pool.hits == 7
+    pool.clear()
+    assert pool.nbytes == 0
+
+    small = BufferPool(max_bytes=150)
+    small.release("L", 10, 10, 10, bytearray(100))
+    small.release("L", 10, 10, 10, bytearray(100))
+    assert (small.nbytes, small.evictions) == (100, 1)
+    assert len(small.acquire("L", 10, 10, 10)) == 100
+    assert len(small.acquire("L", 10, 10, 10)) == 100
+    assert (small.hits, small.misses) == (1, 1)
+
+
+def test_quantization_tables() -> None:
+    values = np.arange(256, dtype=np.uint16)
+    im = Image.fromarray(np.repeat(values.astype(np.uint8)[None, :, None], 3, 2))
+    rgb16 = np.frombuffer(to_cairo_rgb16(im).get_data(), np.uint16)[:256]
+    r5 = (values * 0x1F + 0x7F) // 0xFF
+    g6 = (values * 0x3F + 0x7F) // 0xFF
+    assert (rgb16 == (r5 << 11) | (g6 << 5) | r5).all()
+    rgb30 = np.frombuffer(to_cairo_rgb30(im).get_data(), np.uint32)[:256]
+    c10 = values.astype(np.uint32) * 0x3FF // 0xFF
+    assert (rgb30 == (c10 << 20) | (c10 << 10) | c10).all()
+
+    values = np.arange(1024, dtype=np.uint32)
+    with cairo.ImageSurface(cairo.Format.RGB30, 1024, 1) as surface:
+        data = np.frombuffer(surface.get_data(), np.uint32)
+        data[:1024] = (values << 20) | (values << 10) | values
+        surface.mark_dirty()
+        rgb = np.asarray(to_pil(surface))[0]
+        assert (rgb == (values * 0xFF // 0x3FF)[:, None]).all()
+        for plane in to_pil_rgb30(surface):
+            i = np.asarray(plane)[0].astype(np.uint32)
+            assert (i == values.astype(np.uint64) * 0xFFFFFFFF // 0x3FF).all()
+
+
+def test_argb32_rounding() -> None:
+    # Row `a` holds every premultiplied value of alpha `a`, the last row is fully
+    # opaque.
+    x = np.arange(256, dtype=np.uint32)
+    a = x[:, None]
+    p = np.minimum(x[None, :], a)
+    with cairo.ImageSurface(cairo.Format.ARGB32, 256, 256) as surface:
+        np.frombuffer(surface.get_data(), np.uint32)[:] = (
+            (a << 24) | (p << 16) | (p << 8) | p
+        )
+        surface.mark_dirty()
+        safe_a = np.maximum(a, 1)
+        for rounding, expected in [
+            ("truncate", p * 255 // safe_a),
+            ("nearest", (p * 255 + safe_a // 2) // safe_a),
+        ]:
+            arr = np.asarray(to_pil(surface, rounding=rounding)).astype(np.uint32)
+            expected = np.where(a == 0, 0, np.minimum(expected, 255))
+            assert (arr[..., 0] == expected).all(), rounding
+            assert (arr[..., 3] == a).all(), rounding
+        # Unpremultiplying to nearest is undone exactly by premultiplying.
+        back = to_cairo(to_pil(surface, rounding="nearest"), rounding="nearest")
+        assert bytes(back.get_data()) == bytes(surface.get_data())
+        with pytest.raises(ValueError):
+            to_pil(surface, rounding="up")  # type: ignore[arg-type]
+    # Column is the color, row is the alpha.
+    arr = np.empty((256, 256, 4), np.uint8)
+    arr[..., :3] = x[None, :, None]
+    arr[..., 3] = x[:, None]
+    data = np.frombuffer(
+        to_cairo(Image.fromarray(arr), rounding="truncate").get_data(), np.uint32
+    )
+    assert (
+        (data.reshape(256, 256) >> 16) & 0xFF == x[None, :] * x[:, None] // 255
+    ).all()
+
+
+def test_iter_to_cairo_tiles() -> None:
+    im = Image.radial_gradient("L").resize((99, 70)).convert("RGBA")
+    expected = to_pil(to_cairo(im))
+    out = Image.new("RGBA", im.size)
+    boxes = []
+    for box, surface in iter_to_cairo_tiles(im, (32, 40)):
+        boxes.append(box)
+        out.paste(to_pil(surface), box)
+    assert len(boxes) == 8
+    assert boxes[-1] == (96, 40, 99, 70)
+    assert image_same(out, expected)
+    for box, surface in iter_to_cairo_tiles(
+        im.convert("RGB"), (64, 64), cairo.Format.RGB96F
+    ):
+        assert surface.get_format() == cairo.Format.RGB96F
+        assert (surface.get_width(), surface.get_height()) == (
+            box[2] - box[0],
+            box[3] - box[1],
+        )
+
+
+def test_to_pil_rows() -> None:
+    for surface_format in [cairo.Format.A1, cairo.Format.ARGB32, cairo.Format.RGBA128F]:
+        with cairo.ImageSurface(surface_format, 99, 99) as surface:
+            cr = cairo.Context(surface)
+            gradient = cairo.LinearGradient(0, 0, 99, 99)
+            gradient.add_color_stop_rgba(0, 1, 0, 0, 0)
+            gradient.add_color_stop_rgba(1, 0, 0, 1, 1)
+            cr.set_source(gradient)
+            cr.paint()
+            expected = to_pil(surface)
+            out = Image.new(expected.mode, expected.size)
+            ys = []
+            for y, band in to_pil_rows(surface, 40):
+                ys.append(y)
+                out.paste(band, (0, y))
+            assert ys == [0, 40, 80]
+            assert image_same(out, expected), surface_format
+
+
+def test_box() -> None:
+    boxes = [(0, 0, 99, 99), (3, 5, 40, 41), (9, 90, 99, 99), (98, 0, 99, 1)]
+    for surface_format in [
+        cairo.Format.A1,
+        cairo.Format.A8,
+        cairo.Format.RGB24,
+        cairo.Format.ARGB32,
+        cairo.Format.RGB16_565,
+        cairo.Format.RGB30,
+        cairo.Format.RGBA128F,
+    ]:
+        with cairo.ImageSurface(surface_format, 99, 99) as surface:
+            cr = cairo.Context(surface)
+            gradient = cairo.LinearGradient(0, 0, 99, 99)
+            gradient.add_color_stop_rgba(0, 1, 0, 0, 0)
+            gradient.add_color_stop_rgba(1, 0, 0, 1, 1)
+            cr.set_source(gradient)
+            cr.paint()
+            full = to_pil(surface)
+            for box in boxes:
+                assert image_same(to_pil(surface, box=box), full.crop(box)), (
+                    surface_format,
+                    box,
+                )
+            with pytest.raises(ValueError):
+                to_pil(surface, box=(0, 0, 100, 99))
+    with cairo.ImageSurface(cairo.Format.RGBA128F, 99, 99) as surface:
+        full_planes = to_pil_rgba128f(surface)
+        for plane, expected in zip(to_pil_rgba128f(surface, box=boxes[1]), full_planes):
+            assert plane.tobytes() == expected.crop(boxes[1]).tobytes()
+
+    im = Image.radial_gradient("L").resize((99, 99)).convert("RGBA")
+    for box in boxes:
+        expected = to_cairo(im.crop(box))
+        assert bytes(to_cairo(im, box=box).get_data()) == bytes(expected.get_data()), (
+            box
+        )
+
+    for surface_format, mode in [
+        (cairo.Format.A1, "1"),
+        (cairo.Format.A8, "L"),
+        (cairo.Format.RGB24, "RGB"),
+    ]:
+        with cairo.ImageSurface(surface_format, 99, 99) as surface:
+            cr = cairo.Context(surface)
+            cr.set_source_rgba(1, 1, 1, 1)
+            cr.rectangle(10, 10, 60, 60)
+            cr.fill()
+            for box in boxes:
+                before = to_pil(surface)
+                patch = Image.linear_gradient("L").resize(
+                    (box[2] - box[0], box[3] - box[1])
+                )
+                patch = patch.convert(mode)
+                to_cairo_into(patch, surface, box=box)
+                before.paste(patch, box[:2])
+                assert image_same(to_pil(surface), before), (surface_format, box)
+
+
+def test_array_interop() -> None:
+    for size in SIZES:
+        arr = np.asarray(
+            Image.radial_gradient("L").resize((size, size)).convert("RGBA")
+        ).copy()
+        arr[..., 3] //= 2
+        surface = array_to_cairo(arr)
+        assert surface.get_format() == cairo.Format.ARGB32
+        assert bytes(surface.get_data()) == bytes(
+            to_cairo(Image.fromarray(arr)).get_data()
+        )
+        # Unpremultiplying to nearest gives the surface back exactly.
+        back = array_to_cairo(cairo_to_array(surface))
+        assert bytes(back.get_data()) == bytes(surface.get_data())
+
+        rgb = np.ascontiguousarray(arr[..., :3])
+        surface = array_to_cairo(rgb)
+        assert surface.get_format() == cairo.Format.RGB24
+        view = cairo_to_array(surface)
+        assert np.shares_memory(view, np.frombuffer(surface.get_data(), np.uint8))
+        assert (view == rgb).all()
+        native = cairo_to_array(to_cairo(Image.fromarray(rgb)), "native")
+        assert (cairo_to_array(surface, "native") & 0xFFFFFF == native & 0xFFFFFF).all()
+
+        planes = np.random.default_rng(size).random((4, size, size), np.float32)
+        planes[:3] *= planes[3]
+        surface = array_to_cairo(planes, layout="CHW")
+        assert surface.get_format() == cairo.Format.RGBA128F
+        assert np.allclose(cairo_to_array(surface, "CHW"), planes)
+        hwc = cairo_to_array(surface)
+        assert hwc.shape == (size, size, 4)
+        assert np.allclose(hwc[..., 3], planes[3])
+        assert cairo_to_array(surface, dtype="uint8").dtype == np.uint8
+
+        surface = array_to_cairo(np.ascontiguousarray(planes[:3].transpose(1, 2, 0)))
+        assert surface.get_format() == cairo.Format.RGB96F
+        view = cairo_to_array(surface)
+        assert np.shares_memory(view, np.frombuffer(surface.get_data(), np.uint8))
+        assert (view == planes[:3].transpose(1, 2, 0)).all()
+    with pytest.raises(ValueError):
+        array_to_cairo(np.zeros((4, 4, 3), np.uint8)[:, ::2])
+    with pytest.raises(NotImplementedError):
+        array_to_cairo(np.zeros((4, 4, 3), np.float64))
+
+    # ctypes exports its arrays with an explicit byte order, e.g. "<f".
+    le_float = (
+        ctypes.c_float.__ctype_le__ if sys.byteorder == "little" else ctypes.c_float
+    )
+    pixels = ((le_float * 3) * 4) * 2
+    surface = array_to_cairo(pixels())
+    assert surface.get_format() == cairo.Format.RGB96F
+    assert (surface.get_width(), surface.get_height()) == (4, 2)
+
+    # Short buffers raise ValueError from the kernels instead of panicking.
+    with pytest.raises(ValueError):
+        pil_rgb_to_cairo_rgb24(bytes(11), bytearray(32), 2, 2, 16)
+    with pytest.raises(ValueError):
+        pil_rgb_to_cairo_rgb24(bytes(12), bytearray(23), 2, 2, 16)
+
+
+def test_interleaved_float() -> None:
+    for surface_format in [cairo.Format.RGB96F, cairo.Format.RGBA128F]:
+        with cairo.ImageSurface(surface_format, 99, 99) as surface:
+            cr = cairo.Context(surface)
+            gradient = cairo.LinearGradient(0, 0, 99, 99)
+            gradient.add_color_stop_rgba(0, 1, 0, 0, 0.2)
+            gradient.add_color_stop_rgba(1, 0, 0, 1, 1)
+            cr.set_source(gradient)
+            cr.paint()
+            if surface_format == cairo.Format.RGB96F:
+                planes = to_pil_rgb96f(surface)
+                out = np.asarray(to_pil_rgb96f(surface, interleaved=True))
+                back = to_cairo_rgb96f(out)
+            else:
+                planes = to_pil_rgba128f(surface)
+                out = np.asarray(to_pil_rgba128f(surface, interleaved=True))
+                back = to_cairo_rgba128f(out)
+            expected = np.stack([np.asarray(plane) for plane in planes], -1)
+            assert out.shape == expected.shape
+            assert out.dtype == np.float32
+            assert np.allclose(out, expected)
+            assert np.allclose(
+                np.frombuffer(back.get_data(), np.float32),
+                np.frombuffer(surface.get_data(), np.float32),
+            )
+            # Read-only arrays are copied first and convert the same.
+            readonly = out.copy()
+            readonly.flags.writeable = False
+            if surface_format == cairo.Format.RGB96F:
+                back_readonly = to_cairo_rgb96f(readonly)
+            else:
+                back_readonly = to_cairo_rgba128f(readonly)
+            assert bytes(back_readonly.get_data()) == bytes(back.get_data())
+            box = (3, 5, 40, 41)
+            if surface_format == cairo.Format.RGB96F:
+                region = np.asarray(to_pil_rgb96f(surface, box=box, interleaved=True))
+                cropped = to_cairo_rgb96f(out, box=box)
+            else:
+                region = np.asarray(to_pil_rgba128f(surface, box=box, interleaved=True))
+                cropped = to_cairo_rgba128f(out, box=box)
+            assert (region == out[5:41, 3:40]).all()
+            assert (cropped.get_width(), cropped.get_height()) == (37, 36)
+            assert np.allclose(
+                np.frombuffer(cropped.get_data(), np.float32).reshape(36, 37, -1),
+                np.frombuffer(surface.get_data(), np.float32).reshape(99, 99, -1)[
+                    5:41, 3:40
+                ],
+            )
+    with pytest.raises(ValueError):
+        to_cairo_rgb96f(np.zeros((4, 4, 4), np.float32))
+
+
+def test_save_surface() -> None:
+    formats = [
+        cairo.Format.A8,
+        cairo.Format.RGB24,
+        cairo.Format.ARGB32,
+        cairo.Format.RGBA128F,
+    ]
+    for surface_format in formats:
+        with cairo.ImageSurface(surface_format, 99, 99) as surface:
+            cr = cairo.Context(surface)
+            gradient = cairo.LinearGradient(0, 0, 99, 99)
+            gradient.add_color_stop_rgba(0, 1, 0, 0, 0)
+            gradient.add_color_stop_rgba(1, 0, 0, 1, 1)
+            cr.set_source(gradient)
+            cr.paint()
+            f = BytesIO()
+            save_surface(surface, f, "PNG")
+            f.seek(0)
+            assert image_same(Image.open(f), to_pil(surface)), surface_format
+            if surface_format == cairo.Format.A8:
+                continue
+            # Written a band at a time, or by Pillow for options only it knows.
+            for params in [
+                {"compress_level": 1},
+                {"compress_level": 9},
+                {"dpi": (72, 72)},
+            ]:
+                f = BytesIO()
+                save_surface(surface, f, "PNG", **params)
+                f.seek(0)
+                assert image_same(Image.open(f), to_pil(surface)), (
+                    surface_format,
+                    params,
+                )
+            f = BytesIO()
+            save_surface(surface, f, "JPEG", quality=100)
+            f.seek(0)
+            im = Image.open(f)
+            assert im.mode == "RGB"
+            # Flattened onto black: transparent corner is black, opaque corner is blue.
+            r, g, b = im.getpixel((0, 0))  # type: ignore[misc]
+            assert max(r, g, b) < 8
+            r, g, b = im.getpixel((98, 98))  # type: ignore[misc]
+            assert b > 240 and r < 16
+
+
+def test_save_surface_png() -> None:
+    # Noise next to gradients, so every PNG filter gets picked somewhere.
+    rng = np.random.default_rng(0)
+    for w, h in [(1, 1), (3, 63), (99, 64), (1, 65), (37, 129), (64, 200)]:
+        noise = Image.fromarray(rng.integers(0, 256, (h, w, 4), np.uint8))
+        gradient = Image.linear_gradient("L").resize((w, h))
+        rgba = Image.merge(
+            "RGBA",
+            (
+                gradient,
+                *noise.split()[:2],
+                gradient.transpose(Image.Transpose.ROTATE_180),
+            ),
+        )
+        rgba.paste(noise.crop((0, 0, w, h // 2)), (0, 0))
+        rgb = rgba.convert("RGB")
+        for surface in [
+            to_cairo(rgb),
+            to_cairo(rgba),
+            to_cairo_rgb16(rgb),
+            to_cairo_rgb30(rgb),
+            to_cairo_rgb96f(rgb),
+            to_cairo_rgba128f(rgba),
+        ]:
+            expected = to_pil(surface)
+            for compress_level in [-1, 0, 1, 9]:
+                f = BytesIO()
+                save_surface(surface, f, "PNG", compress_level=compress_level)
+                f.seek(0)
+                Image.open(f).verify()
+                f.seek(0)
+                im = Image.open(f)
+                assert image_same(im, expected), (
+                    surface.get_format(),
+                    w,
+                    h,
+                    compress_level,
+                )
+
+
+def test_load_surface() -> None:
+    im = Image.radial_gradient("L").resize((99, 70))
+    rgba = Image.merge(
+        "RGBA", (im, im, im, im.transpose(Image.Transpose.FLIP_LEFT_RIGHT))
+    )
+    for source in [im, im.convert("RGB"), rgba, im.convert("P")]:
+        f = BytesIO()
+        source.save(f, "PNG")
+        f.seek(0)
+        surface = load_surface(f)
+        assert surface.get_format() == cairo.Format.ARGB32
+        expected = to_cairo(source.convert("RGBA"))
+        assert bytes(surface.get_data()) == bytes(expected.get_data()), source.mode
+        f.seek(0)
+        surface = load_surface(f, cairo.Format.RGB24)
+        assert image_same(to_pil(surface), source.convert("RGB")), source.mode
+
+    f = BytesIO()
+    im.convert("RGB").resize((800, 600)).save(f, "JPEG")
+    f.seek(0)
+    surface = load_surface(f, draft_size=(200, 150))
+    assert (surface.get_width(), surface.get_height()) == (200, 150)
+    f.seek(0)
+    surface = load_surface(f, cairo.Format.A8, draft_size=(400, 300))
+    assert (surface.get_width(), surface.get_height()) == (400, 300)
+
+
+def test_dither() -> None:
+    im = Image.new("RGB", (64, 64), (100, 100, 100))
+    dithers: list[Dither] = ["ordered", "floyd-steinberg"]
+    # 100 is 12.16 out of 31 and 24.71 out of 63.
+    for dither in dithers:
+        surface = to_cairo_rgb16(im, dither=dither)
+        data = np.frombuffer(surface.get_data(), np.uint16).reshape(64, -1)[:, :64]
+        r = (data >> 11).astype(np.float64)
+        g = ((data >> 5) & 0x3F).astype(np.float64)
+        assert set(np.unique(r)) == {12, 13}, dither
+        assert abs(r.mean() - 100 * 31 / 255) < 0.05, dither
+        assert abs(g.mean() - 100 * 63 / 255) < 0.05, dither
+    plain = np.frombuffer(to_cairo_rgb16(im).get_data(), np.uint16)
+    assert (plain >> 11 == 12).all()
+
+    with cairo.ImageSurface(cairo.Format.RGBA128F, 64, 64) as surface:
+        cr = cairo.Context(surface)
+        cr.set_source_rgba(0.3, 0.3, 0.3, 1)
+        cr.paint()
+        assert (np.asarray(to_pil(surface)) == [76, 76, 76, 255]).all()
+        for dither in dithers:
+            arr = np.asarray(to_pil(surface, dither=dither)).astype(np.float64)
+            assert set(np.unique(arr[..., 0])) == {76, 77}, dither
+            assert abs(arr[..., 0].mean() - 0.3 * 255) < 0.05, dither
+            assert (arr[..., 3] == 255).all(), dither
+    with pytest.raises(ValueError):
+        to_cairo_rgb16(im, dither="random")  # type: ignore[arg-type]
+    # Formats without a dithering kernel refuse to dither instead of ignoring it.
+    with pytest.raises(ValueError):
+        to_cairo_into(
+            im, cairo.ImageSurface(cairo.Format.RGB24, 64, 64), dither="ordered"
+        )
+    for surface_format in [cairo.Format.A8, cairo.Format.RGB24, cairo.Format.ARGB32]:
+        surface = cairo.ImageSurface(surface_format, 64, 64)
+        with pytest.raises(ValueError):
+            to_pil(surface, dither="ordered")
+        with pytest.raises(ValueError):
+            to_pil(surface, rounding="nearest", dither="ordered")
+
+
+def test_more_modes() -> None:
+    for size in SIZES:
+        im = Image.radial_gradient("L").resize((size, size))
+        alpha = im.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+        rgba = Image.merge("RGBA", (im, im.point(lambda x: 255 - x), im, alpha))
+        for source, expected in [
+            (rgba.convert("RGB").convert("RGBX"), rgba.convert("RGB")),
+            (rgba.convert("RGBa"), rgba),
+            (
+                Image.merge("LA", (im, alpha)),
+                Image.merge("LA", (im, alpha)).convert("RGBA"),
+            ),
+        ]:
+            surface = to_cairo(source)
+            expected_surface = to_cairo(expected)
+            assert surface.get_format() == expected_surface.get_format(), source.mode
+            assert bytes(surface.get_data()) == bytes(expected_surface.get_data()), (
+                source.mode
+            )
+        la = Image.merge("LA", (im, alpha))
+        assert image_same(
+            to_pil(to_cairo(la.convert("La"))), to_pil(to_cairo(la)), THRESHOLD
+        )
+
+        p = rgba.convert("RGB").quantize(64)
+        p.info["transparency"] = 0
+        surface = to_cairo(p)
+        assert surface.get_format() == cairo.Format.ARGB32
+        assert bytes(surface.get_data()) == bytes(
+            to_cairo(p.convert("RGBA")).get_data()
+        )
+
+        arr = np.arange(size * size, dtype=np.uint32) * 65535 // max(size * size - 1, 1)
+        i16 = Image.fromarray(arr.astype(np.uint16).reshape(size, size))
+        assert i16.mode == "I;16"
+        surface = to_cairo(i16)
+        assert surface.get_format() == cairo.Format.RGB30
+        data = (
+            np.frombuffer(surface.get_data(), np.uint32)
+            .reshape(size, -1)[:, :size]
+            .ravel()
+        )
+        expected_10 = (arr * 1023 + 32767) // 65535
+        assert (data >> 20 & 0x3FF == expected_10).all()
+        assert (data & 0x3FF == expected_10).all()
+        surface = to_cairo_rgb96f(i16)
+        floats = np.frombuffer(surface.get_data(), np.float32).reshape(size, size, 3)
+        assert np.allclose(floats[..., 1].ravel(), arr / 65535)
+
+
+def test_profile_hook() -> None:
+    events: list[tuple[str, cairo.Format, int, int, int, dict[str, float]]] = []
+    im = Image.new("RGBA", (40, 30), (10, 20, 30, 128))
+    assert get_profile_hook() is None
+    set_profile_hook(lambda *event: events.append(event))
+    try:
+        surface = to_cairo(im)
+        to_cairo(im, BufferPool())
+        to_pil(surface, box=(0, 0, 20, 10))
+        to_pil_rgba128f(to_cairo_rgba128f(im), interleaved=True)
+    finally:
+        set_profile_hook(None)
+    to_cairo(im)
+    assert [event[:4] for event in events] == [
+        ("to_cairo", cairo.Format.ARGB32, 40, 30),
+        ("to_cairo", cairo.Format.ARGB32, 40, 30),
+        ("to_pil", cairo.Format.ARGB32, 20, 10),
+        ("to_cairo_rgba128f", cairo.Format.RGBA128F, 40, 30),
+        ("to_pil_rgba128f", cairo.Format.RGBA128F, 40, 30),
+    ]
+    assert events[0][4] == surface.get_stride() * 30
+    for *_, stages in events:
+        assert set(stages) >= {"copy", "kernel", "surface", "total"}
+        assert all(t >= 0 for t in stages.values())
+        assert stages["copy"] + stages["kernel"] + stages["surface"] <= stages["total"]
+
+
+def test_surface_image() -> None:
+    for surface_format in [cairo.Format.A1, cairo.Format.ARGB32, cairo.Format.RGBA128F]:
+        with cairo.ImageSurface(surface_format, 99, 99) as surface:
+            cr = cairo.Context(surface)
+            gradient = cairo.LinearGradient(0, 0, 99, 99)
+            gradient.add_color_stop_rgba(0, 1, 0, 0, 0)
+            gradient.add_color_stop_rgba(1, 0, 0, 1, 1)
+            cr.set_source(gradient)
+            cr.paint()
+            expected = to_pil(surface)
+            proxy = SurfaceImage(surface, band_height=16)
+            assert proxy.size == expected.size and proxy.mode == expected.mode
+            for xy in [(0, 0), (50, 17), (98, 98), (-1, -1)]:
+                assert proxy.getpixel(xy) == expected.getpixel(xy), (surface_format, xy)
+            for box in [(3, 5, 40, 41), (9, 90, 99, 99), (0, 16, 99, 32)]:
+                assert image_same(proxy.crop(box), expected.crop(box)), (
+                    surface_format,
+                    box,
+                )
+            resized = proxy.resize(
+                (10, 10), Image.Resampling.LANCZOS, (20, 30.5, 60, 70), 2.0
+            )
+            assert image_same(
+                resized,
+                expected.resize(
+                    (10, 10), Image.Resampling.LANCZOS, (20, 30.5, 60, 70), 2.0
+                ),
+            )
+            assert proxy._image is None
+            box = (-5, -5, 10, 10)
+            assert image_same(proxy.crop(box), expected.crop(box))
+            assert image_same(proxy.load(), expected)
+            assert proxy.load() is proxy.load()
+            assert proxy.tobytes() == expected.tobytes()
+
+
+def reduce_array(arr: np.ndarray, factor: int) -> np.ndarray:
+    h, w = arr.shape[:2]
+    out = np.empty((-(-h // factor), -(-w // factor), *arr.shape[2:]), arr.dtype)
+    for y in range(out.shape[0]):
+        for x in range(out.shape[1]):
+            block = arr[y * factor : (y + 1) * factor, x * factor : (x + 1) * factor]
+            n = block.shape[0] * block.shape[1]
+            out[y, x] = (block.astype(np.uint32).sum(axis=(0, 1)) + n // 2) // n
+    return out
+
+
+def test_reduce() -> None:
+    for size in SIZES:
+        g = Image.radial_gradient("L").resize((size, size))
+        a = Image.linear_gradient("L").resize((size, size))
+        rgba = Image.merge("RGBA", (g, a, g.transpose(Image.Transpose.ROTATE_90), a))
+        for factor in [2, 3]:
+            surface = to_cairo(rgba)
+            pixels = np.frombuffer(surface.get_data(), np.uint8).reshape(size, size, 4)
+            expected = reduce_array(pixels, factor)
+            reduced = to_cairo(rgba, reduce=factor)
+            assert reduced.get_width() == expected.shape[1], (size, factor)
+            actual = np.frombuffer(reduced.get_data(), np.uint8).reshape(expected.shape)
+            assert (actual == expected).all(), (size, factor)
+
+            expected_surface = cairo.ImageSurface.create_for_data(
+                bytearray(expected.tobytes()),
+                cairo.Format.ARGB32,
+                expected.shape[1],
+                expected.shape[0],
+                expected.shape[1] * 4,
+            )
+            assert image_same(to_pil(surface, reduce=factor), to_pil(expected_surface))
+
+            rgb = rgba.convert("RGB")
+            assert bytes(to_cairo(rgb, reduce=factor).get_data()) == bytes(
+                to_cairo(rgb.reduce(factor)).get_data()
+            )
+            rgb30 = to_cairo_rgb30(rgb)
+            assert image_same(
+                to_pil(rgb30, reduce=factor), to_pil(rgb30).reduce(factor)
+            )
+    with pytest.raises(ValueError):
+        to_cairo(Image.new("RGB", (4, 4)), reduce=0)
+
+
+def test_transfer() -> None:
+    for size in SIZES:
+        g = Image.linear_gradient("L").resize((size, size))
+        b = Image.radial_gradient("L").resize((size, size))
+        rgb = Image.merge("RGB", (g, b, g.transpose(Image.Transpose.ROTATE_90)))
+        encoded = np.asarray(rgb).astype(np.float64) / 255
+        linear = np.where(
+            encoded <= 0.04045, encoded / 12.92, ((encoded + 0.055) / 1.055) ** 2.4
+        )
+
+        surface = to_cairo_rgb96f(rgb, transfer="srgb")
+        floats = np.frombuffer(surface.get_data(), np.float32)
+        floats = floats.reshape(size, -1)[:, : size * 3].reshape(size, size, 3)
+        assert np.allclose(floats, linear, atol=1e-6), size
+        assert image_same(to_pil(surface, transfer="srgb"), rgb), size
+        dithered = to_pil(surface, dither="ordered", transfer="srgb")
+        assert image_same(dithered, rgb, THRESHOLD), size
+
+        alpha = b.point(lambda v: max(v, 1))
+        rgba = Image.merge("RGBA", (*rgb.split(), alpha))
+        surface = to_cairo_rgba128f(rgba, transfer="srgb")
+        floats = np.frombuffer(surface.get_data(), np.float32).reshape(size, size, 4)
+        a = np.asarray(alpha).astype(np.float64)[..., None] / 255
+        assert np.allclose(floats[..., :3], linear * a, atol=1e-6), size
+        assert image_same(to_pil(surface, transfer="srgb"), rgba, THRESHOLD), size
+        out = Image.new("RGBA", (size, size))
+        to_pil_into(surface, out, transfer="srgb")
+        assert image_same(out, rgba, THRESHOLD), size
+
+    with pytest.raises(ValueError):
+        to_pil(to_cairo(Image.new("RGBA", (4, 4))), transfer="srgb")
+    with pytest.raises(ValueError):
+        to_cairo_rgb96f(Image.new("RGB", (4, 4)), transfer="bt709")  # type: ignore[arg-type]
+
+
+def test_frames() -> None:
+    colors = [(255, 0, 0, 255), (0, 255, 0, 128), (0, 0, 255, 0)]
+    frames = [Image.new("RGBA", (32, 16), color) for color in colors]
+    for i, frame in enumerate(frames):
+        ImageDraw.Draw(frame).rectangle(
+            (i * 4, 2, i * 4 + 8, 10), fill=(255, 255, 255, 255)
+        )
+    buf = BytesIO()
+    frames[0].save(buf, "PNG", save_all=True, append_images=frames[1:], duration=40)
+
+    with Image.open(buf) as im:
+        im.seek(1)
+        surfaces = frames_to_cairo(im)
+        assert im.tell() == 1
+    assert len(surfaces) == len(frames)
+    for surface, frame in zip(surfaces, frames):
+        assert surface.get_format() == cairo.Format.ARGB32
+        assert image_same(to_pil(surface), to_pil(to_cairo(frame)))
+
+    out = surfaces_to_frames(surfaces, max_workers=2)
+    assert [frame.mode for frame in out] == ["RGBA"] * len(frames)
+    for frame, surface in zip(out, surfaces):
+        assert image_same(frame, to_pil(surface))
+    buf = BytesIO()
+    out[0].save(buf, "PNG", save_all=True, append_images=out[1:], duration=40)
+    with Image.open(buf) as im:
+        assert im.n_frames == len(frames)
+
+    with Image.open(buf) as im:
+        surfaces = frames_to_cairo(im, cairo.Format.RGB24)
+    for surface, frame in zip(surfaces, out):
+        assert image_same(to_pil(surface), frame.convert("RGB"), THRESHOLD)
+
+    assert len(frames_to_cairo(Image.new("L", (4, 4)))) == 1
+    with pytest.raises(NotImplementedError):
+        frames_to_cairo(Image.new("RGB", (4, 4)), cairo.Format.INVALID)
+
+
+def test_convert() -> None:
+    for size in SIZES:
+        im = Image.radial_gradient("L").resize((size, size))
+        alpha = im.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+        rgba = Image.merge("RGBA", (im, im.point(lambda x: 255 - x), im, alpha))
+        arr = np.arange(size * size, dtype=np.uint32) * 65535 // max(size * size - 1, 1)
+        i16 = Image.fromarray(arr.astype(np.uint16).reshape(size, size))
+        for source, surface_format in [
+            (rgba, cairo.Format.ARGB32),
+            (rgba.convert("RGBa"), cairo.Format.ARGB32),
+            (Image.merge("LA", (im, alpha)), cairo.Format.ARGB32),
+            (Image.merge("LA", (im, alpha)).convert("La"), cairo.Format.ARGB32),
+            (rgba.convert("RGB"), cairo.Format.RGB24),
+            (rgba.convert("RGB").convert("RGBX"), cairo.Format.RGB24),
+            (im, cairo.Format.A8),
+            (im.convert("1"), cairo.Format.A1),
+            (rgba.convert("RGB"), cairo.Format.RGB16_565),
+            (rgba.convert("RGB"), cairo.Format.RGB30),
+            (i16, cairo.Format.RGB30),
+            (rgba.convert("RGB"), cairo.Format.RGB96F),
+            (i16, cairo.Format.RGB96F),
+            (rgba, cairo.Format.RGBA128F),
+        ]:
+            kernel, _ = _CONVERT[surface_format, source.mode]
+            surface = convert(source, surface_format, kernel)
+            expected = cairo.ImageSurface(surface_format, size, size)
+            to_cairo_into(source, expected)
+            assert surface.get_format() == surface_format
+            assert surface.get_stride() == expected.get_stride()
+            assert bytes(surface.get_data()) == bytes(expected.get_data()), source.mode
+
+    p = Image.new("P", (4, 4))
+    assert (cairo.Format.ARGB32, "P") not in _CONVERT
+    assert (cairo.Format.A8, "RGB") not in _CONVERT
+    # Big enough that pasting into the surface beats a copy through `tobytes()`.
+    assert _CONVERT[cairo.Format.ARGB32, "RGBA"][1] < 512 * 512
+    assert _CONVERT[cairo.Format.RGB30, "RGB"][1] >= 512 * 512
+    rgb = Image.new("RGB", (4, 4))
+    with pytest.raises(TypeError):
+        convert(rgb, cairo.Format.RGB24, "pil_rgb_to_cairo_rgb24")  # type: ignore[arg-type]
+    # The mode is checked against the kernel before anything is allocated.
+    with pytest.raises(ValueError):
+        convert(rgb, cairo.Format.RGB24, Kernel.PilRgbxToCairoRgb24)
+    assert bytes(to_cairo(p).get_data()) == bytes(
+        to_cairo(p.convert("RGBA")).get_data()
+    )
+    with pytest.raises(ValueError):
+        to_cairo_rgb30(Image.new("L", (4, 4)))